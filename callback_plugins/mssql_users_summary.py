@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+DOCUMENTATION = '''
+    callback: mssql_users_summary
+    type: aggregate
+    short_description: grouped summary of mssql_users results
+    description:
+      - Collects the results of mssql_users tasks and prints one summary per host at the end of the play,
+        errors first, then changes grouped by database.
+    requirements:
+      - enable in configuration (callbacks_enabled, callback_whitelist before ansible 2.11)
+    options:
+      max_records:
+        description: maximum number of records printed per group
+        default: 50
+        type: int
+        env:
+          - name: MSSQL_USERS_SUMMARY_MAX_RECORDS
+        ini:
+          - section: callback_mssql_users_summary
+            key: max_records
+'''
+
+from ansible.plugins.callback import CallbackBase
+
+MODULE_NAMES = ('mssql_users',)
+SERVER_GROUP = '(server)'
+
+
+class _HostSummary(object):
+
+    def __init__(self):
+        self.counts = dict(changed=0, info=0, warning=0, error=0)
+        self.operations = {}
+        self.records = dict(changed={}, info={}, warning={}, error={})
+        self.failures = []
+        self.results = 0
+
+    def add(self, result):
+        self.results += 1
+
+        for status, count in (result.get('counts') or {}).items():
+            self.counts[status] = self.counts.get(status, 0) + count
+
+        for operation, count in (result.get('operations') or {}).items():
+            self.operations[operation] = self.operations.get(operation, 0) + count
+
+        for status, records in (result.get('sample') or {}).items():
+            groups = self.records.setdefault(status, {})
+            for record in records:
+                groups.setdefault(record.get('database') or SERVER_GROUP, []).append(record.get('message') or record.get('operation'))
+
+        # ошибка модуля без записей (нет соединения, неверные параметры)
+        if result.get('failed') and result.get('msg') and not (result.get('counts') or {}).get('error'):
+            self.failures.append(result['msg'])
+
+
+class CallbackModule(CallbackBase):
+    """Вместо разбора результата каждого логина шаблоном в loop_control.label собирает результаты
+    mssql_users и печатает по каждому хосту одну сводку: сначала ошибки, затем изменения по базам данных."""
+
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'mssql_users_summary'
+    CALLBACK_NEEDS_WHITELIST = True
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self):
+        super(CallbackModule, self).__init__()
+        self.summaries = {}
+        self.max_records = 50
+
+    def set_options(self, task_keys=None, var_options=None, direct=None):
+        super(CallbackModule, self).set_options(task_keys=task_keys, var_options=var_options, direct=direct)
+        self.max_records = self.get_option('max_records')
+
+    def v2_runner_on_ok(self, result):
+        self.__collect(result)
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self.__collect(result)
+
+    def v2_runner_item_on_ok(self, result):
+        self.__collect(result)
+
+    def v2_runner_item_on_failed(self, result):
+        self.__collect(result)
+
+    def v2_playbook_on_stats(self, stats):
+        for host in sorted(self.summaries):
+            summary = self.summaries[host]
+
+            self._display.banner("MSSQL USERS SUMMARY [{0}]".format(host))
+            self._display.display("results: {0}; changed: {1}; info: {2}; warning: {3}; error: {4}".format(
+                summary.results, summary.counts.get('changed', 0), summary.counts.get('info', 0),
+                summary.counts.get('warning', 0), summary.counts.get('error', 0)))
+
+            if summary.operations:
+                self._display.display("operations: " + ", ".join("{0}: {1}".format(name, count) for name, count in sorted(summary.operations.items())))
+
+            for message in summary.failures:
+                self._display.display("[MODULE_ERROR]: {0}".format(message), color='red')
+
+            self.__display_groups('ERRORS', summary.records.get('error'), 'red')
+            self.__display_groups('CHANGES', summary.records.get('changed'), 'yellow')
+            self.__display_groups('WARNINGS', summary.records.get('warning'), 'bright purple')
+            self.__display_groups('INFO', summary.records.get('info'), None)
+
+    def __collect(self, result):
+        task = result._task
+
+        if task.action not in MODULE_NAMES and task.action.split('.')[-1] not in MODULE_NAMES:
+            return
+
+        # результат цикла приходит и по каждому элементу, и целиком с results - учитываем только элементы
+        if 'results' in result._result:
+            return
+
+        host = result._host.get_name()
+        self.summaries.setdefault(host, _HostSummary()).add(result._result)
+
+    def __display_groups(self, title, groups, color):
+        if not groups:
+            return
+
+        self._display.display("\n[{0}]:".format(title), color=color)
+
+        for database in sorted(groups, key=lambda name: (name != SERVER_GROUP, name.lower())):
+            messages = groups[database]
+            self._display.display("  {0} ({1}):".format(database, len(messages)), color=color)
+
+            for message in messages[:self.max_records]:
+                self._display.display("    {0}".format(message), color=color)
+
+            if len(messages) > self.max_records:
+                self._display.display("    ... {0} more".format(len(messages) - self.max_records), color=color)
@@ -31,48 +31,93 @@ from ansible.module_utils.basic import AnsibleModule
 def main():
 
     connection_spec=dict(
-        type='dict',
-        required=True,
         login=dict(type='str', required=True),
         password=dict(type='str', no_log=True, required=True),
         host=dict(type='str', required=True),
         port=dict(type='int', default=1433, required=False)
     )
 
+    permission_spec=dict(
+        permission=dict(type='str', required=True),
+        securable_class=dict(choices=['DATABASE', 'SCHEMA', 'OBJECT'], default='DATABASE', required=False),
+        securable=dict(type='str', required=False),
+        state=dict(choices=['grant', 'deny'], default='grant', required=False)
+    )
+
     database_spec=dict(
         name=dict(type='str', required=True),
-        state=dict(choices=['present', 'absent'], default='present', required=True),
-        roles=dict(type='list', elements='str')
+        state=dict(choices=['present', 'absent'], default='present', required=False),
+        roles=dict(type='list', elements='str', default=[], required=False),
+        permissions=dict(type='list', elements='dict', options=permission_spec, required=False)
     )
 
     user_spec=dict(
         name=dict(type='str', required=True),
-        state=dict(choices=['present', 'absent'], default='present', required=True),
-        databases=dict(type='list', elements='dict', options=database_spec)
+        databases=dict(type='list', elements='dict', options=database_spec, default=[], required=False)
     )
 
     sql_login_spec=dict(
-        type='dict',
         login=dict(type='str', required=True),
-        enabled=dict(type='bool',default=True, required=True),
+        enabled=dict(type='bool', default=True, required=False),
         sid=dict(type='str', required=False),
-        state=dict(choices=['present', 'absent'], default='present', required=True),
+        state=dict(choices=['present', 'absent'], default='present', required=False),
         password=dict(type='str', no_log=True, required=False),
+        password_hash=dict(type='str', no_log=True, required=False),
         default_database=dict(type='str', required=False),
         default_language=dict(type='str', required=False),
-        users=dict(type='list', elements='dict', options=user_spec)
+        users=dict(type='list', elements='dict', options=user_spec, default=[], required=False)
     )
 
-    module_args=dict(connection=connection_spec, sql_login=sql_login_spec)
+    module_args=dict(
+        connection=dict(type='dict', options=connection_spec, required=True),
+        sql_login=dict(type='dict', options=sql_login_spec, required=False),
+        sql_logins=dict(type='list', elements='dict', options=sql_login_spec, required=False),
+        artifact=dict(type='path', required=False),
+        logins=dict(type='list', elements='str', required=False),
+        workers=dict(type='int', default=1, required=False),
+        results_file=dict(type='path', required=False),
+        sample_size=dict(type='int', default=20, required=False),
+        capabilities_cache=dict(type='path', required=False),
+        capabilities_ttl=dict(type='int', default=3600, required=False),
+        orphaned_users=dict(type='str', choices=['report', 'remap', 'drop'], required=False),
+        orphaned_users_databases=dict(type='list', elements='str', required=False),
+        batch_size=dict(type='int', default=500, required=False),
+        profile=dict(type='path', required=False),
+        metrics_file=dict(type='path', required=False),
+        service_socket=dict(type='path', required=False),
+        verify=dict(type='bool', default=False, required=False),
+        password_check=dict(type='str', choices=['server', 'client'], default='server', required=False),
+        role_diff=dict(type='str', choices=['client', 'server'], default='client', required=False),
+        lock_timeout=dict(type='int', required=False),
+        journal=dict(type='path', required=False)
+    )
 
-    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
+    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True,
+                           mutually_exclusive=[['sql_login', 'sql_logins', 'artifact']],
+                           required_one_of=[['sql_login', 'sql_logins', 'artifact', 'orphaned_users']])
 
-    if not mssql_found:
+    if not mssql_found and not module.params['service_socket']:
         module.fail_json(msg='required pymssql module', exception=PYMSSQL_IMP_ERR)
 
+    from ansible.module_utils.sql_profiler import Profiler
+
+    profiler = Profiler(module.params['profile'])
+
+    with profiler:
+        result = synchronize(module)
+
+    if profiler.enabled:
+        result['profile'] = profiler.summary
+
+    module.exit_json(**result)
+
+
+def synchronize(module):
     from ansible.module_utils.sql_objects import SqlLogin
-    from ansible.module_utils.db_provider import ConnectionFactory
     import ansible.module_utils.sql_processor as SqlProcessor
+    from ansible.module_utils.sql_results import ResultSink
+    import ansible.module_utils.sql_capabilities as SqlCapabilities
+    from ansible.module_utils.sql_metrics import Metrics, write_run_metrics
 
     connection_settings = module.params['connection']
     login = connection_settings['login']
@@ -80,45 +125,178 @@ def main():
     host = connection_settings['host']
     port = connection_settings['port']
 
-    sql_item = SqlLogin.from_json(module.params['sql_login'])
+    if module.params['logins'] is not None and not module.params['artifact']:
+        module.fail_json(msg="logins can be used only with artifact")
+
+    if module.params['artifact']:
+        from ansible.module_utils.sql_artifact import ArtifactReader
+
+        try:
+            sql_items = ArtifactReader(module.params['artifact']).get_many(module.params['logins'])
+        except Exception as e:
+            module.fail_json(msg="unable to read artifact {0}: {1}".format(module.params['artifact'], str(e)))
+    elif module.params['sql_logins'] is not None:
+        sql_items = list(map(SqlLogin.from_json, module.params['sql_logins']))
+    elif module.params['sql_login'] is not None:
+        sql_items = [SqlLogin.from_json(module.params['sql_login'])]
+    else:
+        sql_items = []
+
+    workers = module.params['workers']
+
+    if workers < 1:
+        module.fail_json(msg="workers must be greater than 0")
+
+    if module.params['batch_size'] < 1:
+        module.fail_json(msg="batch_size must be greater than 0")
 
     login_querystring = host
-    if port != "1433":
+    if port != 1433:
         login_querystring = "%s:%s" % (host, port)
 
     if login != "" and password == "":
         module.fail_json(msg="when supplying login arguments password must be provided")
 
+    if module.params['service_socket']:
+        result = request_service(module, login_querystring, sql_items)
+        if result is not None:
+            return result
+
+    if not mssql_found:
+        module.fail_json(msg='required pymssql module', exception=PYMSSQL_IMP_ERR)
+
+    from ansible.module_utils.db_provider import ConnectionFactory
+
     start_time = time.time()
     connection_factory = ConnectionFactory(login_querystring, login, password)
+    metrics = Metrics("mssql_users", dict(host=login_querystring))
 
     try:
-        sql_server_version = connection_factory.get_sql_server_version()
+        with metrics.phase("capabilities"):
+            capabilities = SqlCapabilities.load(connection_factory, login_querystring, module.params['capabilities_cache'], module.params['capabilities_ttl'])
     except Exception as e:
+        if module.params['metrics_file']:
+            metrics.set("up", 0, "Whether the server was reachable")
+            metrics.write(module.params['metrics_file'])
+
         if "Unknown database" in str(e):
             errno, errstr = e.args
             module.fail_json(msg="ERROR: %s %s" % (errno, errstr))
         else:
             module.fail_json(msg="unable to connect to {0}, check login and password are correct".format(host))
 
-    major_sql_server_version = int(sql_server_version.split('.')[0])
+    sql_server_version = capabilities.version
 
-    if major_sql_server_version not in [10, 12, 14]:
+    if capabilities.major_version < 10:
         module.fail_json(msg="sql server version {0} not supported".format(sql_server_version))
 
-    try:
-        result = SqlProcessor.apply_sql_login(connection_factory, sql_item, major_sql_server_version, module.check_mode)
-    except Exception as e:
-        module.fail_json(msg="{0}".format(str(e)))
+    with ResultSink(module.params['results_file'], module.params['sample_size']) as sink:
+        locks = None
+        if module.params['lock_timeout'] is not None and not module.check_mode:
+            from ansible.module_utils.sql_locks import AppLocks
+            locks = AppLocks(connection_factory, module.params['lock_timeout'], sink)
+
+        journal = None
+
+        try:
+            if module.params['journal'] and not module.check_mode:
+                from ansible.module_utils.sql_journal import Journal, get_desired_hash
+                journal = Journal(module.params['journal'], get_desired_hash(sql_items))
+
+            with metrics.phase("apply_logins"):
+                SqlProcessor.apply_sql_logins(connection_factory, sql_items, capabilities, module.check_mode, workers, sink,
+                                              module.params['password_check'], module.params['role_diff'], locks, journal)
+
+            verified = None
+            if module.params['verify'] and not module.check_mode:
+                with metrics.phase("verify"):
+                    verified = SqlProcessor.verify_sql_logins(connection_factory, sql_items, capabilities, sink.affected, workers, sink)
+
+            orphaned_users = None
+            if module.params['orphaned_users']:
+                with metrics.phase("orphaned_users"):
+                    orphaned_users = SqlProcessor.fix_orphaned_users(connection_factory, capabilities, module.params['orphaned_users'], module.check_mode,
+                                                                     module.params['orphaned_users_databases'], module.params['batch_size'], workers, sink)
+        except Exception as e:
+            if journal is not None:
+                journal.close()
+            if module.params['metrics_file']:
+                write_run_metrics(module.params['metrics_file'], metrics, connection_factory.statistics, sink, len(sql_items))
+            module.fail_json(msg="{0}".format(str(e)), **sink.summary())
+
+    if module.params['metrics_file']:
+        write_run_metrics(module.params['metrics_file'], metrics, connection_factory.statistics, sink, len(sql_items))
 
     end_time = time.time()
 
     execution_time = end_time - start_time
 
-    if result[3]:
-        module.fail_json(msg="; ".join(result[3]))
+    result = dict(changed=sink.changed, sql_server_version=sql_server_version, capabilities=capabilities.to_dict(), execution_time=execution_time, **sink.summary())
+
+    if orphaned_users is not None:
+        result['orphaned_users'] = orphaned_users
+
+    if verified is not None:
+        result['verified'] = verified
+
+    if locks is not None:
+        result['locks'] = locks.statistics
+
+    if journal is not None:
+        result['checkpoint'] = close_journal(journal, sink)
+
+    if sink.failed:
+        module.fail_json(msg=sink.get_error_message(), **result)
+
+    return result
+
+
+def close_journal(journal, sink):
+    # после успешного запуска журнал не нужен, после ошибки повторный запуск продолжит с него
+    checkpoint = dict(journal=journal.path, completed=not sink.failed, **journal.progress)
+
+    if sink.failed:
+        journal.close()
+    else:
+        journal.complete()
+
+    return checkpoint
+
+
+def request_service(module, login_querystring, sql_items):
+    import ansible.module_utils.sql_service as SqlService
+
+    connection_settings = module.params['connection']
+    payload = dict(connection=dict(server=login_querystring, login=connection_settings['login'], password=connection_settings['password']),
+                   sql_logins=sql_items,
+                   check_mode=module.check_mode,
+                   workers=module.params['workers'],
+                   results_file=module.params['results_file'],
+                   sample_size=module.params['sample_size'],
+                   orphaned_users=module.params['orphaned_users'],
+                   orphaned_users_databases=module.params['orphaned_users_databases'],
+                   batch_size=module.params['batch_size'],
+                   verify=module.params['verify'],
+                   password_check=module.params['password_check'],
+                   role_diff=module.params['role_diff'],
+                   lock_timeout=module.params['lock_timeout'],
+                   journal=module.params['journal'],
+                   metrics_file=module.params['metrics_file'])
+
+    try:
+        result = SqlService.request(module.params['service_socket'], payload)
+    except SqlService.ServiceUnavailable as e:
+        module.warn("reconciler service {0} is not available, running locally: {1}".format(module.params['service_socket'], str(e)))
+        return None
+    except SqlService.ServiceError as e:
+        # сервис уже получил запрос и мог начать изменения, поэтому локально повторять нельзя
+        module.fail_json(msg="reconciler service {0}: {1}".format(module.params['service_socket'], str(e)))
+
+    if result.pop('failed', False):
+        module.fail_json(**result)
+
+    return result
 
-    module.exit_json(changed=result[4], sql_server_version=sql_server_version, execution_time=execution_time, changes=result[0], sql_info=result[1], sql_warnings=result[2], sql_errors=result[3])
 
 if __name__ == '__main__':
     main()
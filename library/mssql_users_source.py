@@ -19,47 +19,129 @@ from ansible.module_utils.basic import AnsibleModule
 
 def main():
     module_args = dict(
-        sources=dict(required=True, type='list', elements='path'))
+        sources=dict(required=False, type='list', elements='path'),
+        workers=dict(required=False, type='int', default=1),
+        strict=dict(required=False, type='bool', default=False),
+        artifact=dict(required=False, type='path'),
+        profile=dict(required=False, type='path'),
+        metrics_file=dict(required=False, type='path'),
+        metrics_host=dict(required=False, type='str'),
+        state_file=dict(required=False, type='path'),
+        full_sync=dict(required=False, type='bool', default=False),
+        full_sync_interval=dict(required=False, type='int'),
+        commit_state=dict(required=False, type='bool', default=False))
 
     module = AnsibleModule(
         argument_spec=module_args,
-        supports_check_mode=True
+        supports_check_mode=True,
+        required_if=[['commit_state', True, ['state_file']]]
     )
 
-    from ansible.module_utils.sql_objects import SqlLogin
-    sources = module.params['sources']
+    if module.params['commit_state']:
+        import ansible.module_utils.sql_state as SqlState
 
-    sql_logins = {}
-    files_info = {}
+        changed = not module.check_mode and SqlState.commit(module.params['state_file'])
+        module.exit_json(changed=changed, state_file=module.params['state_file'])
 
-    for path in sources:
-        file_paths = glob.glob(path)
+    if not module.params['sources']:
+        module.fail_json(msg="sources is required")
 
-        files_info[path] = { 'files':file_paths }
-        
-        if not file_paths:
-            msg = "no files found for source: {0}".format(path)
-            module.log(msg)
-            if 'warnings' not in files_info[path]:
-                files_info[path]['warnings'] = []
+    from ansible.module_utils.sql_profiler import Profiler
 
-            files_info[path]['warnings'].append(msg)
-            continue
+    profiler = Profiler(module.params['profile'])
 
-        for file_path in file_paths:
-            try:
-                with open(file_path, "r") as read_file:
-                    data = json.load(read_file)
-                    for item in SqlLogin.parse(data):
-                        if item.login in sql_logins:
-                            module.fail_json(msg="DUPLICATE LOGIN: [{0}], FILE: [{1}]".format(item.login,file_path))
-                        sql_logins[item.login] = item
-            except Exception as e:
-                module.fail_json(msg="FILE: %s, PARSE SQL LOGIN EXCEPTION: %s" % (file_path, str(e)))
+    with profiler:
+        ansible_facts = parse_sources(module)
 
-    ansible_facts  = { 'sql_logins':json.loads(json.dumps(sql_logins, default=lambda o: o.__dict__, sort_keys=True)), 'files_info': files_info }
+    result = dict(changed=False, ansible_facts=ansible_facts)
 
-    module.exit_json(changed=False, ansible_facts = ansible_facts)
+    if profiler.enabled:
+        result['profile'] = profiler.summary
+
+    module.exit_json(**result)
+
+
+def parse_sources(module):
+    import ansible.module_utils.sql_sources as SqlSources
+    from ansible.module_utils.sql_metrics import Metrics
+    import socket
+
+    if module.params['workers'] != 1:
+        module.warn("workers is ignored, source files are parsed in the module process")
+
+    # в роли файл метрик пишется на каждый хост инвентаря, поэтому метка host должна их различать
+    metrics = Metrics("mssql_users_source", dict(host=module.params['metrics_host'] or socket.gethostname()))
+
+    def write_metrics(errors, sql_logins=None, files_info=None):
+        if not module.params['metrics_file']:
+            return
+
+        metrics.set("errors", errors, "Number of source errors")
+
+        if sql_logins is not None:
+            metrics.set("logins", len(sql_logins), "Number of parsed logins")
+            metrics.set("files", sum(len(info['files']) for info in files_info.values()), "Number of parsed source files")
+
+        metrics.write(module.params['metrics_file'])
+
+    try:
+        with metrics.phase("read_sources"):
+            sql_logins, files_info = SqlSources.read_sources(module.params['sources'], module.warn, module.params['strict'])
+    except SqlSources.SqlSourceError as e:
+        write_metrics(len(e.errors))
+        module.fail_json(msg=str(e), errors=e.errors)
+    except Exception as e:
+        write_metrics(1)
+        module.fail_json(msg=str(e))
+
+    delta = None
+
+    if module.params['state_file']:
+        sql_logins, delta = get_delta(module, sql_logins)
+        metrics.set("delta_logins", len(sql_logins), "Number of logins emitted for synchronization")
+
+    if module.params['artifact']:
+        import ansible.module_utils.sql_artifact as SqlArtifact
+
+        try:
+            with metrics.phase("write_artifact"):
+                artifact = SqlArtifact.write_artifact(module.params['artifact'], sql_logins)
+        except Exception as e:
+            write_metrics(1, sql_logins, files_info)
+            module.fail_json(msg="unable to write artifact {0}: {1}".format(module.params['artifact'], str(e)))
+
+        write_metrics(0, sql_logins, files_info)
+
+        ansible_facts = { 'sql_logins_artifact': artifact, 'files_info': files_info }
+    else:
+        with metrics.phase("to_facts"):
+            ansible_facts  = { 'sql_logins':SqlSources.to_facts(sql_logins), 'files_info': files_info }
+
+        write_metrics(0, sql_logins, files_info)
+
+    if delta is not None:
+        ansible_facts['sql_logins_delta'] = delta
+
+    return ansible_facts
+
+
+def get_delta(module, sql_logins):
+    import ansible.module_utils.sql_state as SqlState
+
+    state_file = module.params['state_file']
+
+    try:
+        delta = SqlState.get_delta(SqlState.load_state(state_file), sql_logins, module.params['full_sync'], module.params['full_sync_interval'])
+        SqlState.write_pending(state_file, delta)
+    except Exception as e:
+        module.fail_json(msg="unable to compute delta with state file {0}: {1}".format(state_file, str(e)))
+
+    del delta['fingerprints']
+
+    if not delta['full_sync']:
+        sql_logins = dict((login, sql_logins[login]) for login in delta['added'] + delta['changed'])
+
+    return sql_logins, delta
 
 if __name__ == '__main__':
     main()
@@ -1,3 +1,4 @@
+import threading
 import pymssql
 
 
@@ -8,8 +9,23 @@ class ConnectionFactory(object):
         self.__server = server
         self.__user = user
         self.__password = password
+        self.__lock = threading.Lock()
+        self.__statistics = dict(connections=0, round_trips=0)
+
+    @property
+    def statistics(self):
+        """Количество открытых соединений и выполненных запросов (round trips) за время работы фабрики."""
+        with self.__lock:
+            return dict(self.__statistics)
+
+    def count(self, name):
+        with self.__lock:
+            self.__statistics[name] += 1
 
     def connect(self, database="master", timeout=60):
+        return _Connection(self.open_connection(database, timeout), self)
+
+    def open_connection(self, database="master", timeout=60):
         server = self.__server
         user = self.__user
         password = self.__password
@@ -21,6 +37,8 @@ class ConnectionFactory(object):
         conn = pymssql.connect(server=server, user=user, password=password, database=database, timeout=timeout,
                                appname="ansible_mssql_module")
 
+        self.count("connections")
+
         return conn
 
     def get_sql_server_version(self):
@@ -32,3 +50,121 @@ class ConnectionFactory(object):
                 row = cursor.fetchone()
                 version = row[0]
                 return version.decode("utf-8")
+
+
+class ConnectionPool(ConnectionFactory):
+
+    def __init__(self, server, user, password, size=4):
+        """Constructor
+        :param size: сколько свободных соединений хранить на каждую базу данных
+
+        Соединение, закрытое через with, не закрывается, а откатывает незавершенную транзакцию
+        и возвращается в пул своей базы данных.
+        """
+        super(ConnectionPool, self).__init__(server, user, password)
+        self.size = size
+        self.__idle = {}
+        self.__pool_lock = threading.Lock()
+
+    def connect(self, database="master", timeout=60):
+        database = database or "master"
+
+        with self.__pool_lock:
+            idle = self.__idle.get(database)
+            conn = idle.pop() if idle else None
+
+        if conn is None:
+            conn = self.open_connection(database, timeout)
+
+        return _Connection(conn, self, lambda failed: self.__release(database, conn, failed))
+
+    def close(self):
+        with self.__pool_lock:
+            connections = [conn for idle in self.__idle.values() for conn in idle]
+            self.__idle = {}
+
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def __release(self, database, conn, failed):
+        try:
+            conn.rollback()
+        except Exception:
+            failed = True
+
+        if not failed:
+            with self.__pool_lock:
+                idle = self.__idle.setdefault(database, [])
+                if len(idle) < self.size:
+                    idle.append(conn)
+                    return
+
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+class _Connection(object):
+
+    def __init__(self, connection, factory, release=None):
+        self.__connection = connection
+        self.__factory = factory
+        self.__release = release
+
+    def cursor(self, *args, **kwargs):
+        return _Cursor(self.__connection.cursor(*args, **kwargs), self.__factory)
+
+    def __getattr__(self, name):
+        return getattr(self.__connection, name)
+
+    def __enter__(self):
+        if self.__release is None:
+            self.__connection.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.__release is None:
+            return self.__connection.__exit__(exc_type, exc_value, traceback)
+
+        # ошибка sql server не ломает соединение, а ошибка сети ломает - такие в пул не возвращаем
+        self.__release(exc_type is not None and not issubclass(exc_type, pymssql.DatabaseError))
+        return False
+
+
+class _Cursor(object):
+
+    def __init__(self, cursor, factory):
+        self.__cursor = cursor
+        self.__factory = factory
+
+    def execute(self, *args, **kwargs):
+        self.__factory.count("round_trips")
+        return self.__cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self.__factory.count("round_trips")
+        return self.__cursor.executemany(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.__cursor, name)
+
+    def __iter__(self):
+        return iter(self.__cursor)
+
+    def __enter__(self):
+        self.__cursor.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self.__cursor.__exit__(exc_type, exc_value, traceback)
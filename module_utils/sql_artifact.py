@@ -0,0 +1,83 @@
+import json
+import os
+from ansible.module_utils.sql_objects import SqlLogin
+
+INDEX_SUFFIX = ".index"
+
+
+def write_artifact(path, sql_logins):
+    """Метод записывает логины в отсортированный по имени логина jsonl файл с индексом смещений.
+    Args:
+        path (str): путь к файлу
+        sql_logins (dict): словарь SqlLogin по имени логина
+
+    Returns:
+        dict: описание файла: путь, путь к индексу, количество и имена логинов
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    index_path = path + INDEX_SUFFIX
+    logins = sorted(sql_logins)
+    index = {}
+    offset = 0
+
+    # в файле есть пароли, поэтому он доступен только владельцу
+    tmp_path = path + ".tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as write_file:
+        for login in logins:
+            line = json.dumps(sql_logins[login], default=lambda o: o.__dict__, sort_keys=True,
+                              separators=(',', ':')).encode("utf-8") + b"\n"
+            write_file.write(line)
+            index[login] = [offset, len(line)]
+            offset += len(line)
+
+    tmp_index_path = index_path + ".tmp"
+    fd = os.open(tmp_index_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as write_file:
+        json.dump(index, write_file, separators=(',', ':'))
+
+    os.rename(tmp_path, path)
+    os.rename(tmp_index_path, index_path)
+
+    return dict(path=path, index=index_path, count=len(logins), size=offset, logins=logins)
+
+
+class ArtifactReader(object):
+
+    def __init__(self, path):
+        """Constructor
+        :param path: путь к файлу, записанному write_artifact
+        """
+        self.path = path
+
+        with open(path + INDEX_SUFFIX, "r") as read_file:
+            self.__index = json.load(read_file)
+
+    @property
+    def logins(self):
+        return sorted(self.__index)
+
+    def get(self, login):
+        return self.get_many([login])[0]
+
+    def get_many(self, logins=None):
+        if logins is None:
+            logins = self.logins
+
+        positions = []
+        for login in logins:
+            if login not in self.__index:
+                raise KeyError("login: {0} not found in {1}".format(login, self.path))
+            positions.append(self.__index[login])
+
+        sql_logins = []
+
+        with open(self.path, "rb") as read_file:
+            for offset, length in positions:
+                read_file.seek(offset)
+                sql_logins.append(SqlLogin.from_json(json.loads(read_file.read(length).decode("utf-8"))))
+
+        return sql_logins
@@ -0,0 +1,131 @@
+import json
+import os
+import re
+import time
+
+DEFAULT_CACHE_DIR = "~/.ansible/cache/mssql_capabilities"
+
+
+class SqlCapabilities(object):
+
+    def __init__(self, version, edition=None, engine_edition=None, hadr_enabled=False, mirroring=False,
+                 contained_databases=False, probed_at=None):
+        """Constructor
+        :param version: serverproperty('productversion')
+        :param edition: serverproperty('edition')
+        :param engine_edition: serverproperty('engineedition')
+        :param hadr_enabled: включены ли группы доступности (serverproperty('IsHadrEnabled'))
+        :param mirroring: есть ли базы данных в зеркалировании
+        :param contained_databases: включена ли 'contained database authentication'
+        :param probed_at: время получения профиля (unix time)
+        """
+        self.version = version
+        self.edition = edition
+        self.engine_edition = engine_edition
+        self.hadr_enabled = bool(hadr_enabled)
+        self.mirroring = bool(mirroring)
+        self.contained_databases = bool(contained_databases)
+        self.probed_at = probed_at or time.time()
+
+    @property
+    def major_version(self):
+        return int(self.version.split('.')[0])
+
+    @property
+    def supports_alter_role_membership(self):
+        # alter role ... add member появился в sql server 2012
+        return self.major_version >= 11
+
+    @property
+    def supports_string_agg(self):
+        return self.major_version >= 14
+
+    @property
+    def checks_primary_replica(self):
+        # sys.fn_hadr_is_primary_replica появилась в sql server 2014
+        return self.major_version >= 12 and self.hadr_enabled
+
+    @property
+    def checks_mirroring(self):
+        return self.mirroring
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+def probe(connection_factory):
+    """Метод получает профиль возможностей sql server одним запросом.
+    Args:
+        connection_factory (ConnectionFactory): Коннект к базе данных
+
+    Returns:
+        SqlCapabilities: профиль возможностей
+    """
+    _sql_command = '''
+    select cast(serverproperty('productversion') as nvarchar(128)),
+           cast(serverproperty('edition') as nvarchar(128)),
+           cast(serverproperty('engineedition') as int),
+           cast(isnull(serverproperty('IsHadrEnabled'), 0) as int),
+           (select count(*) from sys.database_mirroring where mirroring_guid is not null),
+           isnull((select cast(value_in_use as int) from sys.configurations where name = 'contained database authentication'), 0)
+    '''
+
+    with connection_factory.connect() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(_sql_command)
+            row = cursor.fetchone()
+
+    return SqlCapabilities(__to_str(row[0]), __to_str(row[1]), row[2], row[3], row[4], row[5])
+
+
+def load(connection_factory, host, cache_dir=None, ttl=3600):
+    """Метод возвращает профиль возможностей из локального кеша или получает его с сервера.
+    Args:
+        connection_factory (ConnectionFactory): Коннект к базе данных
+        host (str): сервер, ключ кеша
+        cache_dir (str): каталог кеша
+        ttl (int): время жизни профиля в секундах, 0 - не использовать кеш
+
+    Returns:
+        SqlCapabilities: профиль возможностей
+    """
+    cache_path = None
+
+    if ttl > 0:
+        cache_dir = os.path.expanduser(cache_dir or DEFAULT_CACHE_DIR)
+        cache_path = os.path.join(cache_dir, re.sub(r'[^\w.-]', '_', host) + ".json")
+
+        try:
+            with open(cache_path, "r") as read_file:
+                capabilities = SqlCapabilities.from_dict(json.load(read_file))
+
+            if time.time() - capabilities.probed_at < ttl:
+                return capabilities
+        except (IOError, OSError, ValueError, TypeError, KeyError):
+            pass
+
+    capabilities = probe(connection_factory)
+
+    if cache_path:
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+
+            tmp_path = cache_path + ".tmp"
+            with open(tmp_path, "w") as write_file:
+                json.dump(capabilities.to_dict(), write_file)
+            os.rename(tmp_path, cache_path)
+        except (IOError, OSError):
+            pass
+
+    return capabilities
+
+
+def __to_str(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    return value
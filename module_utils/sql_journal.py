@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+PROGRESS_SUFFIX = ".progress"
+
+
+def get_desired_hash(sql_logins):
+    """Метод вычисляет хеш желаемого состояния, по которому журнал понимает, что запуск тот же самый.
+    Args:
+        sql_logins (list): список SqlLogin
+
+    Returns:
+        str: sha256 канонического json логинов
+    """
+    data = json.dumps(sorted(sql_logins, key=lambda sql_login: sql_login.login), default=lambda o: o.__dict__, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class Journal(object):
+
+    def __init__(self, path, desired_hash, progress_interval=1.0):
+        """Constructor
+        :param path: путь к jsonl файлу журнала
+        :param desired_hash: хеш желаемого состояния, журнал другого состояния начинается заново
+        :param progress_interval: не чаще чем раз в столько секунд обновлять файл прогресса
+
+        Журнал хранит завершенные логины и базы данных: первая строка - заголовок с хешем состояния,
+        каждая следующая - один завершенный ключ. Строка дописывается сразу после завершения, поэтому
+        после падения повторный запуск с тем же состоянием пропускает уже сделанное.
+        """
+        self.path = path
+        self.desired_hash = desired_hash
+        self.progress_interval = progress_interval
+        self.total = 0
+        self.resumed = 0
+        self.__done = set()
+        self.__lock = threading.Lock()
+        self.__started = time.time()
+        self.__progress_at = 0
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        if os.path.exists(path):
+            self.__load()
+
+        # журнал переписывается целиком: так отбрасывается недописанная при падении строка
+        self.__file = open(path, "w")
+        self.__write(dict(hash=desired_hash, started=self.__started))
+
+        for key in sorted(self.__done):
+            self.__write(dict(key=key))
+
+    @staticmethod
+    def key(*parts):
+        return "\x1f".join(parts)
+
+    def is_done(self, key):
+        with self.__lock:
+            return key in self.__done
+
+    def mark(self, key):
+        with self.__lock:
+            if key in self.__done:
+                return
+
+            self.__done.add(key)
+            self.__write(dict(key=key, at=time.time()))
+
+            if time.time() - self.__progress_at >= self.progress_interval:
+                self.__write_progress()
+
+    @property
+    def progress(self):
+        with self.__lock:
+            return self.__get_progress()
+
+    def complete(self):
+        """Метод удаляет журнал после успешного запуска, следующий запуск начнется с начала."""
+        self.close()
+
+        for path in (self.path, self.path + PROGRESS_SUFFIX):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def close(self):
+        with self.__lock:
+            if self.__file is not None:
+                self.__write_progress()
+                self.__file.close()
+                self.__file = None
+
+    def __load(self):
+        with open(self.path, "r") as read_file:
+            lines = read_file.read().splitlines()
+
+        if not lines:
+            return
+
+        try:
+            header = json.loads(lines[0])
+        except ValueError:
+            return
+
+        if header.get('hash') != self.desired_hash:
+            return
+
+        for line in lines[1:]:
+            try:
+                self.__done.add(json.loads(line)['key'])
+            except (ValueError, KeyError):
+                # последняя строка могла не дописаться при падении
+                break
+
+        self.resumed = len(self.__done)
+        self.__started = header.get('started', self.__started)
+
+    def __write(self, entry):
+        self.__file.write(json.dumps(entry, separators=(',', ':')) + "\n")
+        self.__file.flush()
+
+    def __get_progress(self):
+        return dict(done=len(self.__done), total=self.total, resumed=self.resumed, elapsed=round(time.time() - self.__started, 3))
+
+    def __write_progress(self):
+        self.__progress_at = time.time()
+        tmp_path = self.path + PROGRESS_SUFFIX + ".tmp"
+
+        with open(tmp_path, "w") as write_file:
+            json.dump(self.__get_progress(), write_file)
+
+        os.rename(tmp_path, self.path + PROGRESS_SUFFIX)
@@ -0,0 +1,110 @@
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+from ansible.module_utils.sql_statements import SqlStatement
+from ansible.module_utils.sql_results import SqlRecord, STATUS_INFO
+
+RESOURCE_PREFIX = "mssql_users:"
+
+# sp_getapplock: 0 - получена сразу, 1 - получена после ожидания, -1 - таймаут, -2 - отмена, -3 - deadlock, -999 - ошибка
+_GET_APP_LOCK = SqlStatement('''
+    declare @result int;
+    exec @result = sp_getapplock @Resource = @resource, @LockMode = 'Exclusive', @LockOwner = 'Session', @LockTimeout = @timeout;
+    select @result;''', [("resource", "nvarchar(255)"), ("timeout", "int")])
+
+_RELEASE_APP_LOCK = SqlStatement("exec sp_releaseapplock @Resource = @resource, @LockOwner = 'Session'", [("resource", "nvarchar(255)")])
+
+
+class LockTimeout(Exception):
+    pass
+
+
+class AppLocks(object):
+
+    def __init__(self, connection_factory, timeout=30, sink=None, report_wait=1.0):
+        """Constructor
+        :param connection_factory: фабрика соединений
+        :param timeout: сколько секунд ждать блокировку
+        :param sink: приемник записей, в него пишется info о долгом ожидании
+        :param report_wait: ожидание дольше этого количества секунд попадает в sink
+
+        Эксклюзивные блокировки sp_getapplock принадлежат сессии и держатся на отдельном соединении,
+        пока выполняется операция, поэтому несколько контроллеров не выполняют DDL одного логина
+        или одной базы данных одновременно. При обрыве соединения sql server снимает блокировку сам.
+        """
+        self.connection_factory = connection_factory
+        self.timeout = timeout
+        self.sink = sink
+        self.report_wait = report_wait
+        self.__lock = threading.Lock()
+        self.__statistics = dict(acquired=0, waited=0, timeouts=0, wait_seconds=0.0, max_wait_seconds=0.0)
+
+    @property
+    def statistics(self):
+        """Количество полученных блокировок, ожиданий, таймаутов и суммарное и максимальное время ожидания."""
+        with self.__lock:
+            statistics = dict(self.__statistics)
+
+        statistics['wait_seconds'] = round(statistics['wait_seconds'], 6)
+        statistics['max_wait_seconds'] = round(statistics['max_wait_seconds'], 6)
+        return statistics
+
+    @contextmanager
+    def lock(self, database, resource, login=None):
+        """Метод держит блокировку ресурса базы данных, пока выполняется блок with.
+        Args:
+            database (str): база данных, в которой берется блокировка (master для логинов)
+            resource (str): имя ресурса, например login:name
+            login (str): логин для записи об ожидании
+
+        Raises:
+            LockTimeout: блокировка не получена за timeout секунд
+        """
+        resource = self.get_resource_name(resource)
+        started = time.time()
+
+        with self.connection_factory.connect(database=database) as conn:
+            with conn.cursor() as cursor:
+                _GET_APP_LOCK.execute(cursor, resource=resource, timeout=int(self.timeout * 1000))
+                result = cursor.fetchone()[0]
+
+            waited = time.time() - started
+            self.__count(result, waited)
+
+            if result >= 0:
+                if self.sink is not None and waited >= self.report_wait:
+                    self.sink.emit(SqlRecord(STATUS_INFO, 'lock_wait', login=login, database=database, duration=waited, details=dict(resource=resource),
+                                             message='[DB: {0}] LOCK {1} - WAITED {2:.3f} SEC'.format(database, resource, waited)))
+
+                try:
+                    yield
+                finally:
+                    with conn.cursor() as cursor:
+                        _RELEASE_APP_LOCK.execute(cursor, resource=resource)
+                return
+
+        # таймаут не ломает соединение, поэтому исключение выбрасывается после возврата соединения в пул
+        raise LockTimeout("[DB: {0}] LOCK {1} NOT ACQUIRED IN {2} SECONDS (sp_getapplock: {3})".format(database, resource, self.timeout, result))
+
+    @staticmethod
+    def get_resource_name(resource):
+        # имена логинов и пользователей сравниваются сервером без учета регистра, ресурс applock - с учетом
+        name = RESOURCE_PREFIX + resource.lower()
+
+        if len(name) > 255:
+            name = RESOURCE_PREFIX + hashlib.sha1(name.encode("utf-8")).hexdigest()
+
+        return name
+
+    def __count(self, result, waited):
+        with self.__lock:
+            if result < 0:
+                self.__statistics['timeouts'] += 1
+            else:
+                self.__statistics['acquired'] += 1
+
+            if result != 0:
+                self.__statistics['waited'] += 1
+                self.__statistics['wait_seconds'] += waited
+                self.__statistics['max_wait_seconds'] = max(self.__statistics['max_wait_seconds'], waited)
@@ -0,0 +1,130 @@
+import os
+import time
+
+
+class Metrics(object):
+
+    def __init__(self, prefix, labels=None):
+        """Constructor
+        :param prefix: префикс имен метрик, например mssql_users
+        :param labels: метки, которые добавляются ко всем метрикам, например host
+        """
+        self.prefix = prefix
+        self.labels = labels or {}
+        self.started = time.time()
+        self.phases = {}
+        self.__metrics = {}
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def set(self, name, value, help_text=None, metric_type="gauge", **labels):
+        """Задает значение метрики prefix_name с дополнительными метками."""
+        metric = self.__metrics.setdefault(name, dict(help=help_text or name, type=metric_type, samples={}))
+        metric["samples"][tuple(sorted(labels.items()))] = value
+
+    def write(self, path):
+        """Метод атомарно записывает метрики в textfile формате node-exporter.
+        Args:
+            path (str): путь к .prom файлу
+
+        Returns:
+            str: путь к файлу
+        """
+        self.set("run_duration_seconds", time.time() - self.started, "Duration of the run in seconds")
+
+        for name, duration in self.phases.items():
+            self.set("phase_duration_seconds", duration, "Duration of the run phases in seconds", phase=name)
+
+        self.set("last_run_timestamp_seconds", time.time(), "Unix time of the end of the last run")
+
+        lines = []
+
+        for name in sorted(self.__metrics):
+            metric = self.__metrics[name]
+            full_name = "{0}_{1}".format(self.prefix, name)
+            lines.append("# HELP {0} {1}".format(full_name, metric["help"]))
+            lines.append("# TYPE {0} {1}".format(full_name, metric["type"]))
+
+            for labels, value in sorted(metric["samples"].items()):
+                lines.append("{0}{1} {2}".format(full_name, self.__format_labels(dict(self.labels, **dict(labels))), self.__format_value(value)))
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # node-exporter может прочитать файл в момент записи, поэтому пишем во временный и переименовываем
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as write_file:
+            write_file.write("\n".join(lines) + "\n")
+        os.rename(tmp_path, path)
+
+        return path
+
+    @staticmethod
+    def __format_labels(labels):
+        if not labels:
+            return ""
+
+        items = []
+        for key in sorted(labels):
+            value = str(labels[key]).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+            items.append('{0}="{1}"'.format(key, value))
+
+        return "{" + ",".join(items) + "}"
+
+    @staticmethod
+    def __format_value(value):
+        if isinstance(value, bool):
+            return "1" if value else "0"
+
+        if isinstance(value, float):
+            return repr(round(value, 6))
+
+        return str(value)
+
+
+def write_run_metrics(path, metrics, statistics, sink, logins):
+    """Метод записывает метрики запуска mssql_users: соединения, запросы, записи по статусам и операциям.
+    Args:
+        path (str): путь к .prom файлу
+        metrics (Metrics): метрики запуска с длительностью фаз
+        statistics (dict): connections и round_trips фабрики соединений за время запуска
+        sink (ResultSink): приемник записей запуска
+        logins (int): количество логинов в запуске
+
+    Returns:
+        str: путь к файлу
+    """
+    metrics.set("up", 1, "Whether the server was reachable")
+    metrics.set("logins", logins, "Number of logins in the run")
+    metrics.set("connections", statistics['connections'], "Number of connections opened during the run")
+    metrics.set("round_trips", statistics['round_trips'], "Number of statements sent to the server during the run")
+    metrics.set("skipped_databases", sink.operations.get('check_database:info', 0) + sink.operations.get('check_database:warning', 0),
+                "Number of databases skipped as mirror, unavailable or not primary replica")
+
+    for status, count in sink.counts.items():
+        metrics.set("records", count, "Number of result records by status", status=status)
+
+    for key, count in sink.operations.items():
+        operation, status = key.split(':')
+        metrics.set("operations", count, "Number of result records by operation and status", operation=operation, status=status)
+
+    return metrics.write(path)
+
+
+class _Phase(object):
+
+    def __init__(self, metrics, name):
+        self.__metrics = metrics
+        self.__name = name
+        self.__started = None
+
+    def __enter__(self):
+        self.__started = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        phases = self.__metrics.phases
+        phases[self.__name] = phases.get(self.__name, 0) + time.time() - self.__started
+        return False
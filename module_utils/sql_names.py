@@ -0,0 +1,150 @@
+import unicodedata
+
+
+class NameIndex(object):
+
+    def __init__(self, names=None, collation=None):
+        """Constructor
+        :param names: имена, которые нужно добавить в индекс
+        :param collation: collation базы данных из sys.databases, по умолчанию *_CI_AS
+
+        Имена сравниваются так же, как их сравнивает sql server в этой базе данных:
+        с учетом или без учета регистра (_CS/_CI) и диакритики (_AS/_AI), _BIN и _BIN2 - побайтно.
+        """
+        self.collation = collation
+        self.case_sensitive, self.accent_sensitive = parse_collation(collation)
+        self.__names = {}
+        self.__values = {}
+
+        for name in names or []:
+            self.add(name)
+
+    def key(self, name):
+        if not self.case_sensitive:
+            name = name.upper()
+
+        if not self.accent_sensitive:
+            name = u"".join(c for c in unicodedata.normalize("NFD", name) if not unicodedata.combining(c))
+
+        return name
+
+    def add(self, name, value=None):
+        key = self.key(name)
+        self.__names.setdefault(key, name)
+        self.__values[key] = value
+
+    def name(self, name):
+        """Возвращает имя в написании, в котором оно хранится в индексе, или None."""
+        return self.__names.get(self.key(name))
+
+    def get(self, name, default=None):
+        return self.__values.get(self.key(name), default)
+
+    def difference(self, names):
+        """Возвращает имена индекса, которых нет среди names (с учетом collation индекса)."""
+        other = set(self.key(name) for name in names)
+        return [name for key, name in self.__names.items() if key not in other]
+
+    def __contains__(self, name):
+        return self.key(name) in self.__names
+
+    def __iter__(self):
+        return iter(self.__names.values())
+
+    def __len__(self):
+        return len(self.__names)
+
+
+def parse_collation(collation):
+    """Метод определяет чувствительность collation к регистру и диакритике.
+    Args:
+        collation (str): имя collation, например Cyrillic_General_CI_AS
+
+    Returns:
+        tuple: (case_sensitive, accent_sensitive)
+    """
+    if not collation:
+        return False, True
+
+    parts = collation.upper().split("_")
+
+    if "BIN" in parts or "BIN2" in parts:
+        return True, True
+
+    return "CS" in parts, "AI" not in parts
+
+
+def split_name(name):
+    """Метод разбирает многокомпонентное имя как parsename: части через точку, часть в [] или "" может содержать точки.
+    Args:
+        name (str): имя, например dbo.proc, [my.schema].[my.proc] или "dbo"."proc"
+
+    Returns:
+        list: части имени без кавычек
+
+    Raises:
+        ValueError: незакрытая кавычка, пустая часть или лишние символы после кавычки
+    """
+    parts = []
+    position = 0
+
+    while True:
+        while position < len(name) and name[position].isspace():
+            position += 1
+
+        if position < len(name) and name[position] in '["':
+            close = ']' if name[position] == '[' else '"'
+            part = []
+            position += 1
+
+            while True:
+                end = name.find(close, position)
+                if end < 0:
+                    raise ValueError("unclosed quote in name: {0}".format(name))
+
+                part.append(name[position:end])
+                position = end + 1
+
+                # ]] и "" внутри кавычек - экранированная закрывающая кавычка
+                if name[position:position + 1] != close:
+                    break
+
+                part.append(close)
+                position += 1
+
+            part = "".join(part)
+
+            while position < len(name) and name[position].isspace():
+                position += 1
+        else:
+            end = name.find('.', position)
+            end = len(name) if end < 0 else end
+            part = name[position:end].strip()
+            position = end
+
+            if not part:
+                raise ValueError("empty part in name: {0}".format(name))
+
+        parts.append(part)
+
+        if position >= len(name):
+            return parts
+
+        if name[position] != '.':
+            raise ValueError("unexpected character after quoted part in name: {0}".format(name))
+
+        position += 1
+
+
+def format_name(parts):
+    """Метод собирает имя из частей, в [] берутся только части с точками, кавычками и пробелами по краям,
+    поэтому имя из каталога и то же имя из источника дают одну строку."""
+    formatted = []
+
+    for part in parts:
+        if part != part.strip() or any(c in part for c in '.[]"'):
+            part = "[{0}]".format(part.replace("]", "]]"))
+
+        formatted.append(part)
+
+    return ".".join(formatted)
@@ -1,16 +1,105 @@
+import re
+from ansible.module_utils.sql_names import split_name, format_name
+
+
+class SqlPermission(object):
+
+    SECURABLE_CLASSES = ['DATABASE', 'SCHEMA', 'OBJECT']
+    STATES = ['grant', 'deny']
+
+    def __init__(self, permission, securable_class="DATABASE", securable=None, state="grant"):
+        """Constructor
+        :param permission: право, например SELECT, EXECUTE, VIEW DEFINITION
+        :param securable_class: DATABASE, SCHEMA или OBJECT
+        :param securable: имя схемы или объекта (schema.object), для DATABASE не задается
+        :param state: grant или deny
+        """
+        self.permission = permission
+        self.securable_class = securable_class
+        self.securable = securable
+        self.state = state
+
+    @property
+    def key(self):
+        return self.securable_class, self.securable, self.permission
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(**data)
+
+    @staticmethod
+    def parse(json_permissions):
+        sql_permissions = []
+
+        for key, value in json_permissions.items():
+            on = key.strip()
+
+            if '::' in on:
+                securable_class, securable = on.split('::', 1)
+                securable_class = securable_class.strip().upper()
+                securable = securable.strip()
+            else:
+                securable_class = on.upper()
+                securable = None
+
+            if securable_class not in SqlPermission.SECURABLE_CLASSES:
+                raise Exception('permissions: "{0}" parsing error, available securables: DATABASE, SCHEMA::name, OBJECT::schema.name'.format(on))
+
+            if securable_class != 'DATABASE' and not securable:
+                raise Exception('permissions: "{0}" parsing error, securable name is empty'.format(on))
+
+            if securable is not None:
+                try:
+                    parts = split_name(securable)
+                except ValueError as e:
+                    raise Exception('permissions: "{0}" parsing error, {1}'.format(on, str(e)))
+
+                if securable_class == 'OBJECT' and len(parts) == 1:
+                    parts = ['dbo'] + parts
+
+                if len(parts) != (1 if securable_class == 'SCHEMA' else 2):
+                    raise Exception('permissions: "{0}" parsing error, expected SCHEMA::name or OBJECT::schema.name'.format(on))
+
+                # имя хранится в том же виде, в каком его строит get_database_permissions: dbo.[my.proc]
+                securable = format_name(parts)
+
+            for state, permissions in value.items():
+                if not state or state.lower() not in SqlPermission.STATES:
+                    raise Exception('permissions: "{0}" state: "{1}" parsing error, availables state: grant or deny'.format(on, state))
+
+                for permission in permissions:
+                    permission = ' '.join(permission.upper().split())
+                    if not re.match(r'^[A-Z ]+$', permission):
+                        raise Exception('permissions: "{0}" permission: "{1}" parsing error'.format(on, permission))
+
+                    sql_permissions.append(SqlPermission(permission, securable_class, securable, state.lower()))
+
+        return sql_permissions
+
+
 class SqlDatabase(object):
 
-    def __init__(self, name, state="present", roles=[]):
+    def __init__(self, name, state="present", roles=[], permissions=None):
         """Constructor
          :type roles: str
+         :type permissions: SqlPermission
          """
         self.name = name
         self.state = state
         self.roles = roles
+        self.permissions = permissions
+
+    @property
+    def is_pattern(self):
+        """Имя базы данных является шаблоном (shop_*, *), а не конкретной базой"""
+        return any(c in self.name for c in '*?[')
 
     @classmethod
     def from_json(cls, data):
-        return cls(**data)
+        database = cls(**data)
+        if data.get("permissions") is not None:
+            database.permissions = list(map(SqlPermission.from_json, data["permissions"]))
+        return database
 
     @staticmethod
     def parse(json_databases):
@@ -20,17 +109,21 @@ class SqlDatabase(object):
             name = key.strip()
             roles = []
             state = "present"
+            permissions = None
 
             if 'roles' in value:
                 roles = value['roles']
 
+            if 'permissions' in value:
+                permissions = SqlPermission.parse(value['permissions'])
+
             if 'state' in value:
                 state = value['state']
                 if not state or state.lower() not in ['present', 'absent']:
                     raise Exception('db: {0} state: "{1}" parsing error, availables state: present or absent'.format(name, state))
                 state = state.lower()
 
-            sql_databases.append(SqlDatabase(name, state, roles))
+            sql_databases.append(SqlDatabase(name, state, roles, permissions))
 
         return sql_databases
 
@@ -82,7 +175,7 @@ class SqlUser(object):
 class SqlLogin(object):
 
     def __init__(self, login, sid=None, password=None, default_database=None, default_language=None, enabled=True,
-                 state="present", users=[]):
+                 state="present", users=[], password_hash=None):
         """Constructor"""
 
         self.login = login
@@ -93,6 +186,7 @@ class SqlLogin(object):
         self.enabled = enabled
         self.state = state
         self.users = users
+        self.password_hash = password_hash
 
 
     @classmethod
@@ -114,6 +208,7 @@ class SqlLogin(object):
             enabled = True
             state = "present"
             users = []
+            password_hash = None
 
             if 'sid' in value:
                 sid = value['sid']
@@ -121,6 +216,9 @@ class SqlLogin(object):
             if 'password' in value:
                 password = value['password']
 
+            if 'password_hash' in value:
+                password_hash = value['password_hash']
+
             if 'default_database' in value:
                 default_database = value['default_database']
 
@@ -144,7 +242,7 @@ class SqlLogin(object):
                     for database in user.databases:
                         database.state = state
 
-            sql_login = SqlLogin(login, sid, password, default_database, default_language, enabled, state, users)
+            sql_login = SqlLogin(login, sid, password, default_database, default_language, enabled, state, users, password_hash)
 
             sql_logins.append(sql_login)
 
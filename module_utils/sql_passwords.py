@@ -0,0 +1,81 @@
+import binascii
+import hashlib
+import os
+import re
+
+HASH_PATTERN = r'^0x0[12]00[0-9A-Fa-f]{48,}$'
+
+
+def hash_password(password, salt=None):
+    """Метод вычисляет хеш пароля в формате sql server 2012+: 0x0200 + salt(4) + SHA512(UTF-16LE(password) + salt).
+    Args:
+        password (str): пароль
+        salt (bytes): соль, по умолчанию случайная
+
+    Returns:
+        str: хеш в виде 0x..., который можно передать в PASSWORD = 0x... HASHED
+    """
+    salt = salt or os.urandom(4)
+    digest = hashlib.sha512(password.encode("utf-16-le") + salt).digest()
+    return "0x0200" + binascii.hexlify(salt + digest).decode("ascii").upper()
+
+
+def verify_password(password, password_hash):
+    """Метод проверяет пароль по хешу из sys.sql_logins.password_hash без обращения к серверу.
+    Args:
+        password (str): пароль
+        password_hash (bytes): хеш, 0x0200 - SHA-512 (2012+), 0x0100 - SHA-1 (2008)
+
+    Returns:
+        bool: True если пароль совпадает, None если формат хеша неизвестен
+    """
+    if not password_hash or len(password_hash) < 6:
+        return None
+
+    version, salt, digest = password_hash[:2], password_hash[2:6], password_hash[6:]
+    data = password.encode("utf-16-le") + salt
+
+    if version == b"\x02\x00":
+        return hashlib.sha512(data).digest() == digest[:64]
+
+    if version == b"\x01\x00":
+        return hashlib.sha1(data).digest() == digest[:20]
+
+    return None
+
+
+def is_password_hash(value):
+    return bool(value) and re.match(HASH_PATTERN, value) is not None
+
+
+def to_bytes(password_hash):
+    return binascii.unhexlify(password_hash[2:])
+
+
+def find_password_changes(sql_logins, password_hashes):
+    """Метод локально определяет логины, пароль которых отличается от желаемого.
+    Args:
+        sql_logins (list): список SqlLogin с password или password_hash
+        password_hashes (NameIndex): sys.sql_logins.password_hash по имени логина
+
+    Returns:
+        set: логины, которым нужно выполнить alter login ... with password
+    """
+    # один sha512 - единицы микросекунд: 100000 паролей проверяются за ~150 мс, запуск пула процессов
+    # и передача паролей в него обходится дороже, поэтому хеши считаются в этом процессе
+    changes = set()
+
+    for sql_login in sql_logins:
+        current = password_hashes.get(sql_login.login)
+
+        if current is None:
+            continue
+
+        if sql_login.password_hash:
+            # заранее вычисленный хеш сравнивается как есть, открытый пароль не нужен
+            if to_bytes(sql_login.password_hash) != current:
+                changes.add(sql_login.login)
+        elif sql_login.password and verify_password(sql_login.password, current) is not True:
+            changes.add(sql_login.login)
+
+    return changes
@@ -1,388 +1,1234 @@
+import fnmatch
+import functools
 import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import ansible.module_utils.sql_passwords as sql_passwords
 import ansible.module_utils.sql_utils as sql_utils
+from ansible.module_utils.sql_journal import Journal
+from ansible.module_utils.sql_locks import LockTimeout
+from ansible.module_utils.sql_names import NameIndex
+from ansible.module_utils.sql_objects import SqlDatabase
+from ansible.module_utils.sql_scheduler import Scheduler, DONE, SKIPPED
+from ansible.module_utils.sql_results import ResultSink, SqlRecord, STATUS_CHANGED, STATUS_INFO, STATUS_WARNING, STATUS_ERROR
+
+
+def apply_sql_login(connection_factory, sql_login, capabilities, check_mode, sink=None):
+    return apply_sql_logins(connection_factory, [sql_login], capabilities, check_mode, sink=sink)
+
+
+def apply_sql_logins(connection_factory, sql_logins, capabilities, check_mode, workers=1, sink=None, password_check='server', role_diff='client', locks=None, journal=None):
+    """Синхронизирует набор логинов графом операций: логин -> пользователь -> членство в ролях,
+    создание роли до членства в ней, удаление пользователей до удаления логина.
+    Args:
+        connection_factory (ConnectionFactory): Коннект к базе данных
+        sql_logins (list): список SqlLogin
+        capabilities (SqlCapabilities): профиль возможностей sql server
+        check_mode (bool): только проверить изменения
+        workers (int): количество одновременно выполняемых операций
+        sink (ResultSink): приемник записей о результатах
+        password_check (str): server - пароль сверяется pwdcompare для каждого логина,
+            client - хеши всех логинов читаются одним запросом и сверяются локально
+        role_diff (str): client - членство в ролях читается целиком и сравнивается локально,
+            server - желаемое членство загружается во временную таблицу и сравнивается на сервере
+        locks (AppLocks): блокировки sp_getapplock на логин, пользователя базы данных, роль db_executor
+            и права базы данных, чтобы несколько контроллеров не меняли одно и то же одновременно
+        journal (Journal): журнал завершенных логинов и баз данных, уже завершенные пропускаются
+
+    Returns:
+        ResultSink: приемник с записями о всех изменениях, предупреждениях и ошибках
+    """
+    if sink is None:
+        sink = ResultSink()
+
+    __check_duplicate_logins(sql_logins)
+
+    password_changes = None
+
+    if password_check == 'client':
+        try:
+            password_changes = __find_password_changes(connection_factory, [sql_login for sql_login in sql_logins
+                                                                            if journal is None or not journal.is_done(Journal.key('login', sql_login.login))])
+        except Exception as e:
+            sink.emit(SqlRecord(STATUS_WARNING, 'check_password',
+                                message='ERROR OCCIRRED WHILE GET PASSWORD HASHES, PASSWORDS WILL BE CHECKED ON SERVER: {0}'.format(str(e))))
+
+    database_jobs = {}
+    pattern_entries = []
+
+    for sql_login in sql_logins:
+        for user in sql_login.users:
+            literal_names = set(database.name.lower() for database in user.databases if not database.is_pattern)
+
+            for database in user.databases:
+                if database.is_pattern:
+                    pattern_entries.append((sql_login.login, user.name, database, literal_names))
+                else:
+                    database_jobs.setdefault(database.name, []).append((sql_login.login, user.name, database))
+
+    databases = None
+
+    if database_jobs or pattern_entries:
+        try:
+            databases = dict((database['name'], database) for database in sql_utils.get_databases(connection_factory, capabilities))
+        except Exception as e:
+            sink.emit(SqlRecord(STATUS_ERROR, 'check_database',
+                                message='ERROR OCCIRRED WHILE GET DATABASES: {0}'.format(str(e))))
+
+    if databases is not None:
+        __expand_database_patterns(pattern_entries, databases, database_jobs, sink)
+
+    scheduler = Scheduler(workers)
+    apply_login = __get_login_changes if check_mode else __apply_login
+    # без блокировок состояние всех логинов читается заранее, а изменения существующих логинов уходят одним
+    # скриптом до узлов логинов. С блокировками узел логина сам читает состояние и выполняет свой пакет под
+    # блокировкой: прочитанное до блокировки мог уже изменить другой контроллер
+    logins = __plan_logins(connection_factory, sql_logins, journal, sink) if locks is None else None
+    login_after = []
+
+    if not check_mode and logins is not None and any(logins['plan'].values()):
+        scheduler.add(('alter_logins',), functools.partial(__alter_logins, connection_factory, logins))
+        login_after.append(('alter_logins',))
+
+    if journal is not None:
+        journal.total = len(sql_logins) + (len(database_jobs) if databases is not None else 0)
+    login_states = {}
+
+    for sql_login in sql_logins:
+        login_states[sql_login.login] = sql_login.state
+
+        if sql_login.state == 'present':
+            scheduler.add(('login', sql_login.login), __journaled(journal, Journal.key('login', sql_login.login), __locked(
+                locks, 'master', 'login:' + sql_login.login, sink, sql_login.login, functools.partial(apply_login, connection_factory, sql_login, sink, password_changes, logins))),
+                          login_after)
+
+    # имена баз данных в sys.databases сравниваются без учета регистра
+    databases_by_lower_name = dict((name.lower(), database) for name, database in (databases or {}).items())
+    login_user_nodes = {}
+
+    for database_name, entries in sorted(database_jobs.items()):
+        if databases is None:
+            continue
+
+        if journal is not None and journal.is_done(Journal.key('database', database_name)):
+            continue
+
+        database_info = databases.get(database_name) or databases_by_lower_name.get(database_name.lower())
+        context = dict(permission_changes=[], memberships=[], role_diff=role_diff, lock=threading.Lock())
+        database_node = ('database', database_name)
+        role_node = ('create_role', database_name, 'db_executor')
+        # в недоступной базе блокировку не взять, а узлы ее пользователей все равно ничего не делают
+        database_locks = locks if __is_processed_database(database_info) else None
+
+        scheduler.add(database_node, functools.partial(__prepare_database, connection_factory, database_name, database_info, entries, capabilities, context, sink))
+
+        creates_role = any('db_executor' in NameIndex(database.roles) for _, _, database in entries)
+
+        if creates_role:
+            scheduler.add(role_node, __locked(database_locks, database_name, 'role:db_executor', sink, None,
+                                              functools.partial(__create_db_executor_role, connection_factory, database_name, context, check_mode, sink)), [database_node])
+
+        database_user_nodes = []
+
+        for position, (login, user_name, database) in enumerate(entries):
+            node = ('user', database_name, login, user_name, position)
+            after = [database_node]
+
+            if login_states.get(login) == 'present':
+                after.append(('login', login))
+
+            if 'db_executor' in NameIndex(database.roles):
+                after.append(role_node)
 
-def apply_sql_login(connection_factory, sql_login, sql_server_version, check_mode):
+            scheduler.add(node, __locked(database_locks, database_name, 'user:' + user_name, sink, login,
+                                         functools.partial(__process_user, connection_factory, database_name, context, login, user_name, database, capabilities, check_mode, sink)), after)
+            database_user_nodes.append(node)
+            login_user_nodes.setdefault(login, []).append(node)
+
+        scheduler.add(('permissions', database_name), __locked(database_locks, database_name, 'permissions', sink, None,
+                                                               functools.partial(__apply_permissions, connection_factory, database_name, context, check_mode, sink)),
+                      database_user_nodes, always=True)
+
+        if role_diff == 'server':
+            scheduler.add(('roles', database_name), __locked(database_locks, database_name, 'roles', sink, None,
+                                                             functools.partial(__apply_role_delta, connection_factory, database_name, context, capabilities, check_mode, sink)),
+                          database_user_nodes, always=True)
+
+        if journal is not None:
+            checkpoint_after = [database_node, ('permissions', database_name)] + database_user_nodes
+
+            if creates_role:
+                checkpoint_after.append(role_node)
 
-    if check_mode:
-        result = __get_sql_login_changes(connection_factory, sql_login, sql_server_version)
+            if role_diff == 'server':
+                checkpoint_after.append(('roles', database_name))
+
+            scheduler.add(('checkpoint', database_name), functools.partial(__checkpoint_database, journal, database_name, context, scheduler, checkpoint_after),
+                          checkpoint_after, always=True)
+
+    for sql_login in sql_logins:
+        if sql_login.state != 'present':
+            scheduler.add(('login', sql_login.login), __journaled(journal, Journal.key('login', sql_login.login), __locked(
+                locks, 'master', 'login:' + sql_login.login, sink, sql_login.login, functools.partial(apply_login, connection_factory, sql_login, sink, password_changes, logins))),
+                          login_user_nodes.get(sql_login.login, []))
+
+    scheduler.run()
+    __report_skipped(scheduler, sink)
+
+    return sink
+
+
+def fix_orphaned_users(connection_factory, capabilities, mode, check_mode, databases=None, batch_size=500, workers=1, sink=None):
+    """Находит пользователей-сирот во всех базах данных и переназначает их на логин с тем же именем
+    или удаляет.
+    Args:
+        connection_factory (ConnectionFactory): Коннект к базе данных
+        capabilities (SqlCapabilities): профиль возможностей sql server
+        mode (str): report - только отчет, remap - переназначить на логин с тем же именем,
+                    drop - переназначить, а остальных удалить
+        check_mode (bool): только проверить изменения
+        databases (list): базы данных, по умолчанию все пользовательские
+        batch_size (int): количество команд в одном пакете
+        workers (int): количество потоков для обработки баз данных
+        sink (ResultSink): приемник записей о результатах
+
+    Returns:
+        dict: количество сирот, переназначенных, удаленных и оставшихся по базам данных
+    """
+    if sink is None:
+        sink = ResultSink()
+
+    summary = {}
+
+    try:
+        all_databases = sql_utils.get_databases(connection_factory, capabilities)
+    except Exception as e:
+        sink.emit(SqlRecord(STATUS_ERROR, 'orphaned_users',
+                            message='ERROR OCCIRRED WHILE GET DATABASES: {0}'.format(str(e))))
+        return summary
+
+    targets = []
+
+    for database in all_databases:
+        if databases is None and database['database_id'] <= 4:
+            continue
+
+        if databases is not None and database['name'] not in databases:
+            continue
+
+        if not __is_target_database(database):
+            sink.emit(SqlRecord(STATUS_INFO, 'orphaned_users', database=database['name'],
+                                message='[DB: {0}] - SKIPPED, UNAVAILABLE, MIRROR OR NOT PRIMARY HADR REPLICA'.format(database['name'])))
+            continue
+
+        targets.append(database['name'])
+
+    def process(database_name):
+        summary[database_name] = __fix_database_orphaned_users(connection_factory, database_name, capabilities, mode, check_mode, batch_size, sink)
+
+    if workers > 1 and len(targets) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(process, targets))
     else:
-        result = __apply_sql_login(connection_factory, sql_login, sql_server_version)
+        list(map(process, targets))
 
-    return result
+    return summary
 
-def __apply_sql_login(connection_factory, sql_login, sql_server_version):
-    login = sql_login.login
 
-    exist = sql_utils.login_exists(connection_factory, login)
+def verify_sql_logins(connection_factory, sql_logins, capabilities, affected, workers=1, sink=None):
+    """Перечитывает после применения только затронутые логины, пользователей и членство в ролях
+    и сверяет их с желаемым состоянием. Каждое расхождение записывается как ошибка.
+    Args:
+        connection_factory (ConnectionFactory): Коннект к базе данных
+        sql_logins (list): список SqlLogin
+        capabilities (SqlCapabilities): профиль возможностей sql server
+        affected (set): (login, database, principal) измененных записей, см. ResultSink.affected
+        workers (int): количество потоков для обработки баз данных
+        sink (ResultSink): приемник записей о результатах
 
-    changes = []
-    warnings = []
-    errors = []
-    information = []
-    changed = False
+    Returns:
+        dict: количество проверенных логинов, пользователей и расхождений
+    """
+    if sink is None:
+        sink = ResultSink()
 
-    if sql_login.state == "present":
+    by_login = dict((sql_login.login, sql_login) for sql_login in sql_logins)
+    logins = set()
+    database_entries = {}
 
-        if exist:
-            options = []
+    for login, database_name, principal in affected:
+        sql_login = by_login.get(login)
 
-            try:
-                if sql_utils.change_default_database(connection_factory, sql_login.login, sql_login.default_database):
-                    options.append('DEFAULT_DATABASE: {0}'.format(sql_login.default_database))
-            except Exception as e:
-                errors.append('[LOGIN: {0}] ERROR OCCIRRED WHILE CHANGING DEFAULT_DATABASE: {1}: {2}'.format(sql_login.login, sql_login.default_database, str(e)))
+        if sql_login is None:
+            continue
 
-            try:
-                if sql_utils.change_default_language(connection_factory, sql_login.login, sql_login.default_language):
-                    options.append('DEFAULT_LANGUAGE: {0}'.format(sql_login.default_language))
-            except Exception as e:
-                errors.append('[LOGIN: {0}] ERROR OCCIRRED WHILE CHANGING DEFAULT_LANGUAGE: {1}: {2}'.format(sql_login.login, sql_login.default_language, str(e)))
+        if database_name is None:
+            logins.add(login)
+            continue
+
+        for user in sql_login.users:
+            if principal is not None and user.name.lower() != principal.lower():
+                continue
+
+            database = __find_database(user, database_name)
+            if database is not None:
+                database_entries.setdefault(database_name, {})[(login, user.name)] = database
+
+    summary = dict(logins=len(logins), users=sum(len(entries) for entries in database_entries.values()), mismatches=0)
+    lock = threading.Lock()
+
+    def mismatch(record):
+        sink.emit(record)
+        with lock:
+            summary['mismatches'] += 1
+
+    if logins:
+        try:
+            __verify_logins(connection_factory, [by_login[login] for login in sorted(logins)], mismatch)
+        except Exception as e:
+            sink.emit(SqlRecord(STATUS_ERROR, 'verify', message='ERROR OCCURRED WHILE VERIFY LOGINS: {0}'.format(str(e))))
+
+    try:
+        collations = dict((database['name'], database['collation_name']) for database in sql_utils.get_databases(connection_factory, capabilities)) if database_entries else {}
+    except Exception as e:
+        sink.emit(SqlRecord(STATUS_ERROR, 'verify', message='ERROR OCCIRRED WHILE GET DATABASES: {0}'.format(str(e))))
+        return summary
+
+    def process(job):
+        database_name, entries = job
+
+        try:
+            __verify_database(connection_factory, database_name, collations.get(database_name), entries, capabilities, mismatch)
+        except Exception as e:
+            sink.emit(SqlRecord(STATUS_ERROR, 'verify', database=database_name,
+                                message='[DB: {0}] ERROR OCCURRED WHILE VERIFY: {1}'.format(database_name, str(e))))
+
+    jobs = sorted(database_entries.items())
+
+    if workers > 1 and len(jobs) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(process, jobs))
+    else:
+        list(map(process, jobs))
+
+    return summary
+
+
+def __is_target_database(database):
+    return database['is_available'] and not database['is_mirror'] and database['is_primary_replica']
+
+
+def __expand_database_patterns(pattern_entries, databases, database_jobs, sink):
+    expanded = set()
+
+    for login, user_name, database, literal_names in pattern_entries:
+        pattern = database.name.lower()
+        matched = []
+
+        for name, info in databases.items():
+            # шаблоны раскрываются только в пользовательские базы данных
+            if info['database_id'] <= 4 or not __is_target_database(info):
+                continue
+
+            if name.lower() in literal_names or not fnmatch.fnmatchcase(name.lower(), pattern):
+                continue
+
+            key = (login, user_name, name.lower())
+            if key in expanded:
+                continue
+
+            expanded.add(key)
+            matched.append(name)
+            database_jobs.setdefault(name, []).append((login, user_name, SqlDatabase(name, database.state, database.roles, database.permissions)))
+
+        sink.emit(SqlRecord(STATUS_INFO, 'expand_databases', login=login, principal=user_name, details=dict(pattern=database.name, databases=len(matched)),
+                            message='[USER: {0}]: DATABASE PATTERN [{1}] - {2} DATABASES'.format(user_name, database.name, len(matched))))
+
+
+def __fix_database_orphaned_users(connection_factory, database_name, capabilities, mode, check_mode, batch_size, sink):
+    counts = dict(orphaned=0, remapped=0, dropped=0, unresolved=0, failed=0)
+
+    try:
+        orphaned_users = sql_utils.get_orphaned_users(connection_factory, database_name, capabilities)
+    except Exception as e:
+        sink.emit(SqlRecord(STATUS_ERROR, 'orphaned_users', database=database_name,
+                            message='[DB: {0}] ERROR OCCIRRED WHILE GET ORPHANED USERS: {1}'.format(database_name, str(e))))
+        return counts
+
+    counts['orphaned'] = len(orphaned_users)
+    actions = []
 
+    for user in orphaned_users:
+        if mode in ['remap', 'drop'] and user['login_name']:
+            actions.append(('remapped', user['user_name'], sql_utils.get_remap_user_statement(user['user_name'], user['login_name'])))
+        elif mode == 'drop':
+            actions.append(('dropped', user['user_name'], sql_utils.get_drop_user_statement(user['user_name'])))
+        else:
+            counts['unresolved'] += 1
+
+    if orphaned_users:
+        sink.emit(SqlRecord(STATUS_INFO, 'orphaned_users', database=database_name,
+                            details=dict(users=[user['user_name'] for user in orphaned_users[:100]]),
+                            message='[DB: {0}] - ORPHANED USERS: {1}'.format(database_name, len(orphaned_users))))
+
+    done = dict(remapped=[], dropped=[])
+
+    for offset in range(0, len(actions), batch_size):
+        batch = actions[offset:offset + batch_size]
+        started = time.time()
+
+        if check_mode:
+            errors = [None] * len(batch)
+        else:
             try:
-                if sql_utils.change_password(connection_factory, sql_login.login, sql_login.password):
-                    options.append('PASSWORD: *****')
+                errors = sql_utils.execute_batch(connection_factory, database_name, [statement for _, _, statement in batch])
             except Exception as e:
-                errors.append('[LOGIN: {0}] ERROR OCCIRRED WHILE CHANGING PASSWORD: {1}'.format(sql_login.login, str(e)))
+                errors = [str(e)] * len(batch)
 
-            if options:
-                changes.append('[LOGIN: {0}; {1}] - CHANGED'.format(sql_login.login, "; ".join(options)))
+        for (action, user_name, _), error in zip(batch, errors):
+            if error:
+                counts['failed'] += 1
+                sink.emit(SqlRecord(STATUS_ERROR, 'orphaned_users', database=database_name, principal=user_name,
+                                    message='[DB: {0}] USER: [{1}] ERROR OCCURRED WHILE FIX ORPHANED USER: {2}'.format(database_name, user_name, error)))
+                continue
+
+            counts[action] += 1
+            done[action].append(user_name)
+
+        for action, operation in (('remapped', 'remap_user'), ('dropped', 'drop_user')):
+            if done[action]:
+                sink.emit(SqlRecord(STATUS_CHANGED, operation, database=database_name, details=dict(users=done[action]),
+                                    duration=time.time() - started,
+                                    message='[DB: {0}] ORPHANED USERS {1}: {2}'.format(database_name, action.upper(), len(done[action]))))
+                done[action] = []
 
+    return counts
+
+
+def __check_duplicate_logins(sql_logins):
+    # у каждого логина один узел графа, а сервер сравнивает имена логинов без учета регистра
+    names = NameIndex()
+    duplicates = set()
+
+    for sql_login in sql_logins:
+        if sql_login.login in names:
+            duplicates.add(names.name(sql_login.login))
+        names.add(sql_login.login)
+
+    if duplicates:
+        raise ValueError("sql_logins contains duplicate logins: {0}".format(", ".join(sorted(duplicates))))
+
+
+def __report_skipped(scheduler, sink):
+    for key, status in scheduler.status.items():
+        if status != SKIPPED:
+            continue
+
+        cause = __describe_node(scheduler.get_root_cause(key))
+        details = dict(cause=cause)
+
+        if key[0] == 'login':
+            sink.emit(SqlRecord(STATUS_WARNING, 'skipped', login=key[1], details=details,
+                                message='[LOGIN: {0}] - SKIPPED: {1} FAILED'.format(key[1], cause)))
+        elif key[0] == 'create_role':
+            sink.emit(SqlRecord(STATUS_WARNING, 'skipped', database=key[1], roles=[key[2]], details=details,
+                                message='[DB: {0}] CREATE ROLE {1} - SKIPPED: {2} FAILED'.format(key[1], key[2], cause)))
+        elif key[0] == 'user':
+            sink.emit(SqlRecord(STATUS_WARNING, 'skipped', login=key[2], database=key[1], principal=key[3], details=details,
+                                message='[DB: {1}; USER: {0}] - SKIPPED: {2} FAILED'.format(key[3], key[1], cause)))
         else:
+            sink.emit(SqlRecord(STATUS_WARNING, 'skipped', details=details,
+                                message='{0} - SKIPPED: {1} FAILED'.format(__describe_node(key), cause)))
 
-            try:
-                if sql_utils.create_login(connection_factory, sql_login.login, sql_login.password, sql_login.sid, sql_login.default_database, sql_login.default_language):
 
-                    options = []
-                    from_windows = "\\" in login
+def __describe_node(key):
+    if key[0] == 'login':
+        return 'LOGIN: {0}'.format(key[1])
 
-                    options.append('LOGIN: {0}'.format(sql_login.login))
+    if key[0] == 'user':
+        return 'DB: {0}; USER: {1}'.format(key[1], key[3])
 
-                    if from_windows:
-                        options.append('TYPE: WINDOWS')
+    if key[0] == 'create_role':
+        return 'DB: {0}; CREATE ROLE: {1}'.format(key[1], key[2])
 
-                    if not from_windows:
+    if len(key) > 1:
+        return 'DB: {0}; {1}'.format(key[1], key[0].upper())
 
-                        if sql_login.sid:
-                            options.append("SID: {0}".format(sql_login.sid))
-                        else:
-                            sid = "0x" + hashlib.md5(login.upper().encode('utf-8')).hexdigest()
-                            options.append("SID: {0}".format(sid))
+    return key[0].upper()
 
-                        if sql_login.password:
-                            options.append("PASSWORD: *****")
 
-                    if sql_login.default_language:
-                        options.append("DEFAULT_LANGUAGE: {0}".format(sql_login.default_language))
+def __journaled(journal, key, function):
+    if journal is None:
+        return function
 
-                    if sql_login.default_database:
-                        options.append("DEFAULT_DATABASE: {0}".format(sql_login.default_database))
+    def call():
+        if journal.is_done(key):
+            return True
 
-                    changes.append('[{0}] - [CREATED]'.format("; ".join(options)))
+        result = function()
 
-            except Exception as e:
-                errors.append('[LOGIN: {0}] ERROR OCCIRRED WHILE CREATING: {1}'.format(sql_login.login, str(e)))
-                return changes, information, warnings, errors, False
+        if result is not False:
+            journal.mark(key)
 
-        if sql_login.enabled:
+        return result
 
-            try:
-                if sql_utils.disable_or_enable_login(connection_factory, sql_login.login, sql_login.enabled):
-                    changes.append('[LOGIN: {0}] - [ENABLED]'.format(sql_login.login))
-            except Exception as e:
-                errors.append('[LOGIN: {0}] ERROR OCCIRRED WHILE ENABLED: {1}'.format(sql_login.login, str(e)))
+    return call
+
+
+def __checkpoint_database(journal, database_name, context, scheduler, nodes):
+    # пропущенная база (зеркало, недоступна) не отмечается, чтобы повторный запуск проверил ее снова
+    if not context.get('skip', True) and all(scheduler.status.get(node) == DONE for node in nodes):
+        journal.mark(Journal.key('database', database_name))
+
+    return True
+
+
+def __is_processed_database(database_info):
+    return database_info is not None and database_info['is_available'] and not database_info['is_mirror'] and database_info['is_primary_replica']
+
+
+def __locked(locks, database_name, resource, sink, login, function):
+    if locks is None:
+        return function
+
+    def call():
+        try:
+            with locks.lock(database_name, resource, login):
+                return function()
+        except LockTimeout as e:
+            sink.emit(SqlRecord(STATUS_ERROR, 'lock', login=login, database=database_name, details=dict(resource=resource), message=str(e)))
+            return False
+
+    return call
+
+
+def __find_password_changes(connection_factory, sql_logins):
+    candidates = [sql_login for sql_login in sql_logins
+                  if sql_login.state == 'present' and "\\" not in sql_login.login and (sql_login.password or sql_login.password_hash)]
+
+    if not candidates:
+        return set()
+
+    password_hashes = sql_utils.get_password_hashes(connection_factory, [sql_login.login for sql_login in candidates])
+
+    return sql_passwords.find_password_changes(candidates, password_hashes)
+
+
+def __get_created_login_options(sql_login):
+    login = sql_login.login
+    options = []
+    details = {}
+    from_windows = "\\" in login
+
+    options.append('LOGIN: {0}'.format(sql_login.login))
+
+    if from_windows:
+        options.append('TYPE: WINDOWS')
+        details['type'] = 'windows'
+
+    if not from_windows:
+
+        if sql_login.sid:
+            sid = sql_login.sid
+        else:
+            sid = "0x" + hashlib.md5(login.upper().encode('utf-8')).hexdigest()
+
+        options.append("SID: {0}".format(sid))
+        details['sid'] = sid
+
+        if sql_login.password or sql_login.password_hash:
+            options.append("PASSWORD: *****")
+            details['password'] = '*****'
+
+    if sql_login.default_language:
+        options.append("DEFAULT_LANGUAGE: {0}".format(sql_login.default_language))
+        details['default_language'] = sql_login.default_language
+
+    if sql_login.default_database:
+        options.append("DEFAULT_DATABASE: {0}".format(sql_login.default_database))
+        details['default_database'] = sql_login.default_database
+
+    return options, details
+
+
+def __apply_login(connection_factory, sql_login, sink, password_changes=None, logins=None):
+    login = sql_login.login
+
+    state = __get_login_state(connection_factory, login, logins)
+    exist = state is not None
+
+    if sql_login.state == "present":
+
+        if exist:
+            started = time.time()
+            changes = __try_get_login_alter_changes(sql_login, state, logins, sink)
+            errors = __alter_login(connection_factory, login, changes, logins)
+            options = []
+            details = {}
+
+            for (option, value, text, _), error in zip(changes, errors):
+                if option == 'enabled':
+                    continue
+
+                if error:
+                    sink.emit(SqlRecord(STATUS_ERROR, 'alter_login', login=login, details=dict(option=option),
+                                        message='[LOGIN: {0}] ERROR OCCIRRED WHILE CHANGING {1}: {2}'.format(login, text, error)))
+                else:
+                    options.append(text)
+                    details[option] = value
+
+            if __is_password_pending(sql_login, password_changes):
+                # пароль не попадает в общий пакет alter login: он передается только параметром отдельного запроса,
+                # который сверяет его pwdcompare на сервере и меняет, только если он отличается
+                try:
+                    if sql_utils.change_password(connection_factory, sql_login.login, sql_login.password, sql_login.password_hash):
+                        options.append('PASSWORD: *****')
+                        details['password'] = '*****'
+                except Exception as e:
+                    sink.emit(SqlRecord(STATUS_ERROR, 'alter_login', login=login, details=dict(option='password'),
+                                        message='[LOGIN: {0}] ERROR OCCIRRED WHILE CHANGING PASSWORD: {1}'.format(sql_login.login, str(e))))
+
+            if options:
+                sink.emit(SqlRecord(STATUS_CHANGED, 'alter_login', login=login, details=details, duration=time.time() - started,
+                                    message='[LOGIN: {0}; {1}] - CHANGED'.format(sql_login.login, "; ".join(options))))
+
+            for (option, value, _, _), error in zip(changes, errors):
+                if option != 'enabled':
+                    continue
+
+                operation = 'enable_login' if value else 'disable_login'
+
+                if error:
+                    sink.emit(SqlRecord(STATUS_ERROR, operation, login=login,
+                                        message='[LOGIN: {0}] ERROR OCCIRRED WHILE {1}: {2}'.format(login, 'ENABLED' if value else 'DISABLED', error)))
+                else:
+                    sink.emit(SqlRecord(STATUS_CHANGED, operation, login=login, duration=time.time() - started,
+                                        message='[LOGIN: {0}] - [{1}]'.format(login, 'ENABLED' if value else 'DISABLED')))
 
         else:
+            started = time.time()
+
             try:
-                if sql_utils.disable_or_enable_login(connection_factory, sql_login.login, sql_login.enabled):
-                    changes.append('[LOGIN: {0}] - [DISABLED]'.format(sql_login.login))
+                if sql_utils.create_login(connection_factory, sql_login.login, sql_login.password, sql_login.sid, sql_login.default_database, sql_login.default_language,
+                                          sql_login.password_hash):
+                    options, details = __get_created_login_options(sql_login)
+                    sink.emit(SqlRecord(STATUS_CHANGED, 'create_login', login=login, details=details, duration=time.time() - started,
+                                        message='[{0}] - [CREATED]'.format("; ".join(options))))
+
             except Exception as e:
-                errors.append('[LOGIN: {0}] ERROR OCCIRRED WHILE DISABLED: {1}'.format(sql_login.login, str(e)))
+                sink.emit(SqlRecord(STATUS_ERROR, 'create_login', login=login,
+                                    message='[LOGIN: {0}] ERROR OCCIRRED WHILE CREATING: {1}'.format(sql_login.login, str(e))))
+                return False
+
+            # новый логин создается включенным
+            if not sql_login.enabled:
+                started = time.time()
+
+                try:
+                    if sql_utils.disable_or_enable_login(connection_factory, sql_login.login, sql_login.enabled):
+                        sink.emit(SqlRecord(STATUS_CHANGED, 'disable_login', login=login, duration=time.time() - started,
+                                            message='[LOGIN: {0}] - [DISABLED]'.format(sql_login.login)))
+                except Exception as e:
+                    sink.emit(SqlRecord(STATUS_ERROR, 'disable_login', login=login,
+                                        message='[LOGIN: {0}] ERROR OCCIRRED WHILE DISABLED: {1}'.format(sql_login.login, str(e))))
 
     if sql_login.state == "absent":
 
         if exist:
+            started = time.time()
 
             try:
                 if sql_utils.drop_login(connection_factory, sql_login.login):
-                    changes.append('[LOGIN: {0}] - [DROPPED]'.format(sql_login.login))
+                    sink.emit(SqlRecord(STATUS_CHANGED, 'drop_login', login=login, duration=time.time() - started,
+                                        message='[LOGIN: {0}] - [DROPPED]'.format(sql_login.login)))
             except Exception as e:
-                errors.append('[LOGIN: {0}] ERROR OCCIRRED WHILE DROP: {1}'.format(sql_login.login, str(e)))
-                return changes, information, warnings, errors, False
+                sink.emit(SqlRecord(STATUS_ERROR, 'drop_login', login=login,
+                                    message='[LOGIN: {0}] ERROR OCCIRRED WHILE DROP: {1}'.format(sql_login.login, str(e))))
+                return False
 
-    for user in sql_login.users:
+    return True
 
-        for database in user.databases:
-            database_name = database.name
-            roles = []
-            database_state = database.state
-            user_name = user.name
-            default_roles = []
 
-            try:
-                if sql_server_version == 10 and sql_utils.is_mirror_database(connection_factory, database_name):
-                    information.append('[DB: {0}] - IS MIRROR DATABASE'.format(database_name))
-                    continue
-            except Exception as e:
-                errors.append('[DB: {0}] ERROR OCCIRRED WHILE CHECK MIRRORING: {1}'.format(database_name, str(e)))
-                continue
+def __get_login_changes(connection_factory, sql_login, sink, password_changes=None, logins=None):
+    login = sql_login.login
 
-            try:
-                if not sql_utils.is_database_available(connection_factory, database_name):
-                    warnings.append('[DB: {0}] - UNAVAILABLE'.format(database_name))
-                    continue
-            except Exception as e:
-                errors.append('[DB: {0}] ERROR OCCIRRED WHILE CHECK DATABASE AVAILABILITY: {1}'.format(database_name, str(e)))
-                continue
+    state = __get_login_state(connection_factory, login, logins)
+    exist = state is not None
 
-            try:
-                if sql_server_version >= 12 and not sql_utils.is_primary_hadr_replica(connection_factory, database_name):
-                    information.append('[DB: {0}] - IS NOT PRIMARY HADR REPLICA'.format(database_name))
-                    continue
-            except Exception as e:
-                errors.append('[DB: {0}] ERROR OCCIRRED WHILE CHECK PRIMARY HADR REPLICA(sys.fn_hadr_is_primary_replica): {1}'.format(database_name, str(e)))
-                continue
+    if sql_login.state == "present":
+
+        if exist:
+
+            options = []
+            details = {}
+
+            for option, value, text, _ in __try_get_login_alter_changes(sql_login, state, logins, sink):
+                options.append(text)
 
-            if database_state == 'absent':
+                if option == 'enabled':
+                    details['state'] = 'enabled' if value else 'disabled'
+                else:
+                    details[option] = value
+
+            if password_changes is not None and sql_login.login in password_changes:
+                options.append('PASSWORD: *****')
+                details['password'] = '*****'
+            elif password_changes is None and (sql_login.password or sql_login.password_hash):
                 try:
-                    if sql_utils.drop_user(connection_factory, user_name, database_name):
-                        changes.append('[DB: {1}] USER: [{0}] - [DROPPED]'.format(user_name, database_name))
+                    if sql_utils.has_change_password(connection_factory, sql_login.login, sql_login.password, sql_login.password_hash):
+                        options.append('PASSWORD: *****')
+                        details['password'] = '*****'
                 except Exception as e:
-                    errors.append('[DB: {1}]: ERROR OCCURRED WHILE DROP USER: [{0}]; {2}'.format(user_name, database_name, str(e)))
-                    continue
+                    sink.emit(SqlRecord(STATUS_ERROR, 'alter_login', login=login, details=dict(option='password'),
+                                        message='[LOGIN: {0}] ERROR OCCIRRED WHILE CHANGING PASSWORD: {1}'.format(sql_login.login, str(e))))
+
+            if options:
+                sink.emit(SqlRecord(STATUS_CHANGED, 'alter_login', login=login, details=details,
+                                    message='[LOGIN: {0}; {1}] - CHANGED'.format(sql_login.login, "; ".join(options))))
+
+        else:
 
             try:
-                default_roles = sql_utils.get_available_roles(connection_factory, database_name)
+                options, details = __get_created_login_options(sql_login)
+                sink.emit(SqlRecord(STATUS_CHANGED, 'create_login', login=login, details=details,
+                                    message='[{0}] - [CREATED]'.format("; ".join(options))))
             except Exception as e:
-                errors.append('[DB: {0}] ERROR OCCIRRED WHILE GET AVAILABLE ROLES: {1}'.format(database_name, str(e)))
-                continue
+                sink.emit(SqlRecord(STATUS_ERROR, 'create_login', login=login,
+                                    message='[LOGIN: {0}] ERROR OCCIRRED WHILE CREATING: {1}'.format(sql_login.login, str(e))))
+                return False
 
-            if 'db_executor' in database.roles and 'db_executor' not in default_roles:
-                try:
-                    if sql_utils.create_db_executor_role(connection_factory, database_name):
-                        changes.append('[DB: {0}] CREATE ROLE db_executor'.format(database_name))
+    if sql_login.state == "absent" and exist:
+        sink.emit(SqlRecord(STATUS_CHANGED, 'drop_login', login=login,
+                            message='[LOGIN: {0}] - [DROPPED]'.format(sql_login.login)))
 
-                    default_roles.append('db_executor')
-                except Exception as e:
-                    errors.append('[DB: {0}]: create role db_executor and grant execute to db_executor exception: {1}'.format(database_name, str(e)))
-                    continue
+    return True
 
-            if database_state == 'present':
-                try:
-                    if sql_utils.create_user(connection_factory, user_name, login, database_name):
-                        changes.append('[DB: {1}] USER: [{0}] - [CREATED]'.format(user_name, database_name))
-                except Exception as e:
-                    errors.append('[DB: {1}]: ERROR OCCURRED WHILE CREATE USER: [{0}]; {2}'.format(user_name, database_name, str(e)))
-                    continue
 
-                for role in database.roles:
-                    if role.upper() in map(str.upper, default_roles):
-                        roles.append(role)
-                    else:
-                        warnings.append('[DB: {1}; USER: {0}]: SQL ROLE: [{2}] - UNAVAILABLE'.format(user_name, database_name, role))
+def __plan_logins(connection_factory, sql_logins, journal, sink):
+    # состояние всех логинов читается одним запросом, изменения существующих логинов вычисляются локально
+    logins = dict(current=None, plan={}, results={})
+    pending = [sql_login for sql_login in sql_logins if journal is None or not journal.is_done(Journal.key('login', sql_login.login))]
 
-                try:
-                    current_user_roles = sql_utils.get_user_roles(connection_factory, user_name, database_name)
-
-                    deleted = set(current_user_roles) - set(roles)
-                    add = set(roles) - set(current_user_roles)
-                    added_roles = []
-                    removed_roles = []
-
-                    for role in deleted:
-                        try:
-                            if sql_utils.remove_user_role(connection_factory, user_name, role, database_name, sql_server_version):
-                                removed_roles.append(role)
-                        except Exception as e:
-                            errors.append('[DB: {1}; USER: {0}]: ERROR OCCURRED WHILE REMOVE ROLE: {2} - {3}'.format(user_name, database_name, role, str(e)))
-
-                    for role in add:
-                        try:
-                            if sql_utils.add_user_role(connection_factory, user_name, role, database_name, sql_server_version):
-                                added_roles.append(role)
-                        except Exception as e:
-                            errors.append('[DB: {1}; USER: {0}]: ERROR OCCURRED WHILE ADD ROLE: {2} - {3}'.format(user_name, database_name, role, str(e)))
-                    
-                    if removed_roles:
-                        changes.append('[DB: {1}; USER: {0}]: REMOVED ROLES - [{2}]'.format(user_name, database_name, ", ".join(removed_roles)))
-
-                    if added_roles:
-                        changes.append('[DB: {1}; USER: {0}]: ADDED ROLES - [{2}]'.format(user_name, database_name, ", ".join(added_roles)))
+    if not pending:
+        return logins
 
-                except Exception as e:
-                    errors.append('[DB: {1}; USER: {0}]: ERROR OCCURRED WHILE GET USER ROLES: - {2}'.format(user_name, database_name, str(e)))
+    try:
+        logins['current'] = __get_current_logins(connection_factory, [sql_login.login for sql_login in pending])
+    except Exception as e:
+        sink.emit(SqlRecord(STATUS_WARNING, 'check_login',
+                            message='ERROR OCCIRRED WHILE GET LOGINS, LOGINS WILL BE READ ONE BY ONE: {0}'.format(str(e))))
+        return logins
+
+    for sql_login in pending:
+        state = logins['current'].get(sql_login.login)
+
+        if sql_login.state == 'present' and state is not None:
+            try:
+                logins['plan'][sql_login.login] = __get_login_alter_changes(sql_login, state)
+            except ValueError:
+                # ошибку сообщит узел логина
+                pass
 
-    if changes:
-        changed = True
+    return logins
 
-    return changes, information, warnings, errors, changed
 
+def __get_current_logins(connection_factory, login_names):
+    current = NameIndex()
+
+    for name, state in sql_utils.get_logins(connection_factory, login_names).items():
+        current.add(name, state)
+
+    return current
+
+
+def __get_login_state(connection_factory, login, logins):
+    if logins is not None and logins['current'] is not None:
+        return logins['current'].get(login)
+
+    return __get_current_logins(connection_factory, [login]).get(login)
+
+
+def __get_login_alter_changes(sql_login, state, logins=None):
+    """Изменения существующего логина без пароля: (опция, значение, текст для сообщения, alter login)."""
+    if logins is not None and sql_login.login in logins['plan']:
+        return logins['plan'][sql_login.login]
 
-def __get_sql_login_changes(connection_factory, sql_login, sql_server_version):
     login = sql_login.login
-    exist = sql_utils.login_exists(connection_factory, login)
-    
+    names = NameIndex()
     changes = []
-    warnings = []
-    errors = []
-    information = []
-    changed = False
 
-    if sql_login.state == "present":
+    if sql_login.default_database and names.key(state['default_database'] or '') != names.key(sql_login.default_database):
+        changes.append(('default_database', sql_login.default_database, 'DEFAULT_DATABASE: {0}'.format(sql_login.default_database)))
 
-        if exist:
+    if sql_login.default_language and names.key(state['default_language'] or '') != names.key(sql_login.default_language):
+        changes.append(('default_language', sql_login.default_language, 'DEFAULT_LANGUAGE: {0}'.format(sql_login.default_language)))
 
-            options = []
+    if state['is_disabled'] == bool(sql_login.enabled):
+        changes.append(('enabled', bool(sql_login.enabled), 'STATE: {0}'.format('ENABLED' if sql_login.enabled else 'DISABLED')))
 
-            try:
-                if sql_utils.has_change_default_database(connection_factory, sql_login.login, sql_login.default_database):
-                    options.append('DEFAULT_DATABASE: {0}'.format(sql_login.default_database))
-            except Exception as e:
-                errors.append('[LOGIN: {0}] ERROR OCCIRRED WHILE CHANGING DEFAULT_DATABASE: {1}: {2}'.format(sql_login.login, sql_login.default_database, str(e)))
+    return [(option, value, text, sql_utils.get_alter_login_statement(login, option, value)) for option, value, text in changes]
+
+
+def __is_password_pending(sql_login, password_changes):
+    # без локальной проверки хешей (password_changes is None) пароль каждого логина сверяется на сервере
+    if not (sql_login.password or sql_login.password_hash):
+        return False
+
+    return password_changes is None or sql_login.login in password_changes
+
+
+def __try_get_login_alter_changes(sql_login, state, logins, sink):
+    try:
+        return __get_login_alter_changes(sql_login, state, logins)
+    except ValueError as e:
+        sink.emit(SqlRecord(STATUS_ERROR, 'alter_login', login=sql_login.login,
+                            message='[LOGIN: {0}] ERROR OCCIRRED WHILE CHANGING: {1}'.format(sql_login.login, str(e))))
+        return []
+
+
+def __alter_login(connection_factory, login, changes, logins):
+    if not changes:
+        return []
+
+    if logins is not None and login in logins['results']:
+        return logins['results'][login]
+
+    try:
+        return sql_utils.execute_batch(connection_factory, 'master', [statement for _, _, _, statement in changes])
+    except Exception as e:
+        return [str(e)] * len(changes)
+
+
+def __alter_logins(connection_factory, logins, chunk_size=1000):
+    # изменения всех существующих логинов одним скриптом, результат каждой команды раскладывается по логинам
+    plan = [(login, changes) for login, changes in sorted(logins['plan'].items()) if changes]
+    chunk = []
+
+    for position, (login, changes) in enumerate(plan):
+        chunk.append((login, changes))
+
+        if position + 1 < len(plan) and sum(len(changes) for _, changes in chunk) < chunk_size:
+            continue
+
+        statements = [statement for _, changes in chunk for _, _, _, statement in changes]
+
+        try:
+            errors = sql_utils.execute_batch(connection_factory, 'master', statements)
+        except Exception as e:
+            errors = [str(e)] * len(statements)
+
+        offset = 0
+        for chunk_login, changes in chunk:
+            logins['results'][chunk_login] = errors[offset:offset + len(changes)]
+            offset += len(changes)
+
+        chunk = []
+
+    return True
+
+
+def __prepare_database(connection_factory, database_name, database_info, entries, capabilities, context, sink):
+    context['skip'] = True
+
+    if database_info is not None and database_info['is_mirror']:
+        sink.emit(SqlRecord(STATUS_INFO, 'check_database', database=database_name, details=dict(reason='mirror'),
+                            message='[DB: {0}] - IS MIRROR DATABASE'.format(database_name)))
+        return True
+
+    if database_info is None or not database_info['is_available']:
+        sink.emit(SqlRecord(STATUS_WARNING, 'check_database', database=database_name, details=dict(reason='unavailable'),
+                            message='[DB: {0}] - UNAVAILABLE'.format(database_name)))
+        return True
+
+    if not database_info['is_primary_replica']:
+        sink.emit(SqlRecord(STATUS_INFO, 'check_database', database=database_name, details=dict(reason='not_primary_replica'),
+                            message='[DB: {0}] - IS NOT PRIMARY HADR REPLICA'.format(database_name)))
+        return True
+
+    collation = database_info.get('collation_name')
+    context['collation'] = collation
+
+    try:
+        context['default_roles'] = NameIndex(sql_utils.get_available_roles(connection_factory, database_name), collation)
+    except Exception as e:
+        sink.emit(SqlRecord(STATUS_ERROR, 'get_available_roles', database=database_name,
+                            message='[DB: {0}] ERROR OCCIRRED WHILE GET AVAILABLE ROLES: {1}'.format(database_name, str(e))))
+        return False
+
+    context['users_roles'] = None
+    context['database_permissions'] = None
+
+    if context['role_diff'] != 'server' and any(database.state == 'present' for _, _, database in entries):
+        try:
+            context['users_roles'] = sql_utils.get_users_roles(connection_factory, database_name, capabilities, collation)
+        except Exception as e:
+            sink.emit(SqlRecord(STATUS_ERROR, 'get_user_roles', database=database_name,
+                                message='[DB: {0}]: ERROR OCCURRED WHILE GET USER ROLES: - {1}'.format(database_name, str(e))))
+            return False
+
+    if any(database.permissions is not None for _, _, database in entries):
+        try:
+            context['database_permissions'] = __to_name_index(sql_utils.get_database_permissions(connection_factory, database_name), collation)
+        except Exception as e:
+            sink.emit(SqlRecord(STATUS_ERROR, 'sync_permissions', database=database_name,
+                                message='[DB: {0}]: ERROR OCCURRED WHILE GET PERMISSIONS: - {1}'.format(database_name, str(e))))
+
+    context['skip'] = False
+
+    return True
+
+
+def __create_db_executor_role(connection_factory, database_name, context, check_mode, sink):
+    if context['skip'] or 'db_executor' in context['default_roles']:
+        return True
+
+    if check_mode:
+        sink.emit(SqlRecord(STATUS_CHANGED, 'create_role', database=database_name, roles=['db_executor'],
+                            message='[DB: {0}] CREATE ROLE db_executor'.format(database_name)))
+    else:
+        started = time.time()
+
+        try:
+            if sql_utils.create_db_executor_role(connection_factory, database_name):
+                sink.emit(SqlRecord(STATUS_CHANGED, 'create_role', database=database_name, roles=['db_executor'], duration=time.time() - started,
+                                    message='[DB: {0}] CREATE ROLE db_executor'.format(database_name)))
+        except Exception as e:
+            sink.emit(SqlRecord(STATUS_ERROR, 'create_role', database=database_name, roles=['db_executor'],
+                                message='[DB: {0}]: create role db_executor and grant execute to db_executor exception: {1}'.format(database_name, str(e))))
+            return False
+
+    context['default_roles'].add('db_executor')
+
+    return True
+
+
+def __process_user(connection_factory, database_name, context, login, user_name, database, capabilities, check_mode, sink):
+    if context['skip']:
+        return True
+
+    collation = context['collation']
+    default_roles = context['default_roles']
+
+    if database.state == 'absent':
+        started = time.time()
+
+        try:
+            if check_mode:
+                dropped = sql_utils.has_drop_user(connection_factory, user_name, database_name)
+            else:
+                dropped = sql_utils.drop_user(connection_factory, user_name, database_name)
+
+            if dropped:
+                sink.emit(SqlRecord(STATUS_CHANGED, 'drop_user', login=login, database=database_name, principal=user_name, duration=time.time() - started,
+                                    message='[DB: {1}] USER: [{0}] - [DROPPED]'.format(user_name, database_name)))
+        except Exception as e:
+            sink.emit(SqlRecord(STATUS_ERROR, 'drop_user', login=login, database=database_name, principal=user_name,
+                                message='[DB: {1}]: ERROR OCCURRED WHILE DROP USER: [{0}]; {2}'.format(user_name, database_name, str(e))))
+            return False
 
+    if database.state != 'present':
+        return True
+
+    started = time.time()
+
+    try:
+        if check_mode:
+            created = sql_utils.has_create_user(connection_factory, user_name, login, database_name)
+        else:
+            created = sql_utils.create_user(connection_factory, user_name, login, database_name)
+
+        if created:
+            sink.emit(SqlRecord(STATUS_CHANGED, 'create_user', login=login, database=database_name, principal=user_name, duration=time.time() - started,
+                                message='[DB: {1}] USER: [{0}] - [CREATED]'.format(user_name, database_name)))
+    except Exception as e:
+        sink.emit(SqlRecord(STATUS_ERROR, 'create_user', login=login, database=database_name, principal=user_name,
+                            message='[DB: {1}]: ERROR OCCURRED WHILE CREATE USER: [{0}]; {2}'.format(user_name, database_name, str(e))))
+        return False
+
+    if database.permissions is not None and context['database_permissions'] is not None:
+        statements = __get_permission_delta(database.permissions, context['database_permissions'].get(user_name, set()), collation)
+
+        if statements:
+            with context['lock']:
+                context['permission_changes'].append((login, user_name, statements))
+
+    roles = []
+
+    for role in database.roles:
+        if role in default_roles:
+            roles.append(default_roles.name(role))
+        else:
+            sink.emit(SqlRecord(STATUS_WARNING, 'add_roles', login=login, database=database_name, principal=user_name, roles=[role],
+                                message='[DB: {1}; USER: {0}]: SQL ROLE: [{2}] - UNAVAILABLE'.format(user_name, database_name, role)))
+
+    if context['role_diff'] == 'server':
+        with context['lock']:
+            context['memberships'].append((login, user_name, roles))
+        return True
+
+    current_user_roles = NameIndex(context['users_roles'].get(user_name, []), collation)
+    deleted = current_user_roles.difference(roles)
+    add = NameIndex(roles, collation).difference(current_user_roles)
+    started = time.time()
+    failed = False
+
+    if check_mode:
+        removed_roles = sorted(deleted)
+        added_roles = sorted(add)
+    else:
+        removed_roles = []
+        added_roles = []
+
+        for role in sorted(deleted):
             try:
-                if sql_utils.has_change_default_language(connection_factory, sql_login.login, sql_login.default_language):
-                    options.append('DEFAULT_LANGUAGE: {0}'.format(sql_login.default_language))
+                if sql_utils.remove_user_role(connection_factory, user_name, role, database_name, capabilities):
+                    removed_roles.append(role)
             except Exception as e:
-                errors.append('[LOGIN: {0}] ERROR OCCIRRED WHILE CHANGING DEFAULT_LANGUAGE: {1}: {2}'.format(sql_login.login, sql_login.default_language, str(e)))
+                failed = True
+                sink.emit(SqlRecord(STATUS_ERROR, 'remove_roles', login=login, database=database_name, principal=user_name, roles=[role],
+                                    message='[DB: {1}; USER: {0}]: ERROR OCCURRED WHILE REMOVE ROLE: {2} - {3}'.format(user_name, database_name, role, str(e))))
 
+        for role in sorted(add):
             try:
-                if sql_utils.has_change_password(connection_factory, sql_login.login, sql_login.password):
-                    options.append('PASSWORD: *****')
+                if sql_utils.add_user_role(connection_factory, user_name, role, database_name, capabilities):
+                    added_roles.append(role)
             except Exception as e:
-                errors.append('[LOGIN: {0}] ERROR OCCIRRED WHILE CHANGING PASSWORD: {1}'.format(sql_login.login, str(e)))
+                failed = True
+                sink.emit(SqlRecord(STATUS_ERROR, 'add_roles', login=login, database=database_name, principal=user_name, roles=[role],
+                                    message='[DB: {1}; USER: {0}]: ERROR OCCURRED WHILE ADD ROLE: {2} - {3}'.format(user_name, database_name, role, str(e))))
 
-            try:
-                is_enabled_login = sql_utils.is_enabled_login(connection_factory, sql_login.login)
+    if removed_roles:
+        sink.emit(SqlRecord(STATUS_CHANGED, 'remove_roles', login=login, database=database_name, principal=user_name, roles=removed_roles, duration=time.time() - started,
+                            message='[DB: {1}; USER: {0}]: REMOVED ROLES - [{2}]'.format(user_name, database_name, ", ".join(removed_roles))))
 
-                if sql_login.enabled and not is_enabled_login:
-                    options.append('STATE: ENABLED')
+    if added_roles:
+        sink.emit(SqlRecord(STATUS_CHANGED, 'add_roles', login=login, database=database_name, principal=user_name, roles=added_roles, duration=time.time() - started,
+                            message='[DB: {1}; USER: {0}]: ADDED ROLES - [{2}]'.format(user_name, database_name, ", ".join(added_roles))))
 
-                if not sql_login.enabled and is_enabled_login:
-                    options.append('STATE: DISABLED')
+    return not failed
 
-            except Exception as e:
-                errors.append('[LOGIN: {0}] ERROR OCCIRRED WHILE DISABLE/ENABLE: {1}'.format(sql_login.login, str(e)))
-            
-            if options:
-                changes.append('[LOGIN: {0}; {1}] - CHANGED'.format(sql_login.login, "; ".join(options)))
 
+def __apply_role_delta(connection_factory, database_name, context, capabilities, check_mode, sink):
+    if context['skip'] or not context['memberships']:
+        return True
+
+    logins = {}
+    memberships = []
+
+    for login, user_name, roles in context['memberships']:
+        logins.setdefault(user_name, login)
+        memberships.extend([(user_name, role) for role in roles] or [(user_name, None)])
+
+    started = time.time()
+
+    try:
+        delta = sql_utils.sync_role_members(connection_factory, database_name, memberships, not check_mode, capabilities)
+    except Exception as e:
+        sink.emit(SqlRecord(STATUS_ERROR, 'sync_roles', database=database_name,
+                            message='[DB: {0}]: ERROR OCCURRED WHILE SYNC ROLES: - {1}'.format(database_name, str(e))))
+        return False
+
+    duration = time.time() - started
+    changes = {}
+    failed = False
+
+    for row in delta:
+        user_name, role = row['user_name'], row['role_name']
+        operation = 'add_roles' if row['action'] == 'add' else 'remove_roles'
+
+        if row['error']:
+            failed = True
+            sink.emit(SqlRecord(STATUS_ERROR, operation, login=logins.get(user_name), database=database_name, principal=user_name, roles=[role],
+                                message='[DB: {1}; USER: {0}]: ERROR OCCURRED WHILE {2} ROLE: {3} - {4}'.format(
+                                    user_name, database_name, 'ADD' if row['action'] == 'add' else 'REMOVE', role, row['error'])))
         else:
+            changes.setdefault((user_name, operation), []).append(role)
 
-            try:
-                options = []
-                from_windows = "\\" in login
+    for (user_name, operation), roles in sorted(changes.items(), key=lambda item: (item[0][0], item[0][1] != 'remove_roles')):
+        roles = sorted(roles)
+        message = '[DB: {1}; USER: {0}]: {2} ROLES - [{3}]'.format(user_name, database_name, 'ADDED' if operation == 'add_roles' else 'REMOVED', ", ".join(roles))
+        sink.emit(SqlRecord(STATUS_CHANGED, operation, login=logins.get(user_name), database=database_name, principal=user_name, roles=roles,
+                            duration=duration, message=message))
 
-                options.append('LOGIN: {0}'.format(sql_login.login))
+    return not failed
 
-                if from_windows:
-                    options.append('TYPE: WINDOWS')
 
-                if not from_windows:
+def __find_database(user, database_name):
+    for database in user.databases:
+        if not database.is_pattern and database.name.lower() == database_name.lower():
+            return database
 
-                    if sql_login.sid:
-                        options.append("SID: {0}".format(sql_login.sid))
-                    else:
-                        sid = "0x" + hashlib.md5(login.upper().encode('utf-8')).hexdigest()
-                        options.append("SID: {0}".format(sid))
+    for database in user.databases:
+        if database.is_pattern and fnmatch.fnmatchcase(database_name.lower(), database.name.lower()):
+            return database
 
-                    if sql_login.password:
-                        options.append("PASSWORD: *****")
+    return None
 
-                if sql_login.default_language:
-                    options.append("DEFAULT_LANGUAGE: {0}".format(sql_login.default_language))
 
-                if sql_login.default_database:
-                    options.append("DEFAULT_DATABASE: {0}".format(sql_login.default_database))
+def __verify_logins(connection_factory, sql_logins, mismatch):
+    current = __get_current_logins(connection_factory, [sql_login.login for sql_login in sql_logins])
 
-                changes.append('[{0}] - [CREATED]'.format("; ".join(options)))
-            except Exception as e:
-                errors.append('[LOGIN: {0}] ERROR OCCIRRED WHILE CREATING: {1}'.format(sql_login.login, str(e)))
-                return changes, information, warnings, errors, False
+    for sql_login in sql_logins:
+        login = sql_login.login
+        state = current.get(login)
+        differences = []
 
-    if sql_login.state == "absent" and exist:
-        changes.append('[LOGIN: {0}] - [DROPPED]'.format(sql_login.login))
+        if sql_login.state == 'absent':
+            if state is not None:
+                differences.append('EXISTS')
+        elif state is None:
+            differences.append('NOT EXISTS')
+        else:
+            if state['is_disabled'] == bool(sql_login.enabled):
+                differences.append('STATE: {0}'.format('DISABLED' if state['is_disabled'] else 'ENABLED'))
 
-    for user in sql_login.users:
-        
-        for database in user.databases:
-            database_name = database.name
-            roles = []
-            database_state = database.state
-            user_name = user.name
-            default_roles = [] 
+            if sql_login.default_database and state['default_database'] != sql_login.default_database:
+                differences.append('DEFAULT_DATABASE: {0}'.format(state['default_database']))
 
-            try:
-                if sql_server_version == 10 and sql_utils.is_mirror_database(connection_factory, database_name):
-                    information.append('[DB: {0}] - IS MIRROR DATABASE'.format(database_name))
-                    continue
-            except Exception as e:
-                errors.append('[DB: {0}] ERROR OCCIRRED WHILE CHECK MIRRORING: {1}'.format(database_name, str(e)))
-                continue
+            if sql_login.default_language and state['default_language'] != sql_login.default_language:
+                differences.append('DEFAULT_LANGUAGE: {0}'.format(state['default_language']))
 
-            try:
-                if not sql_utils.is_database_available(connection_factory, database_name):
-                    warnings.append('[DB: {0}] - UNAVAILABLE'.format(database_name))
-                    continue
-            except Exception as e:
-                errors.append('[DB: {0}] ERROR OCCIRRED WHILE CHECK DATABASE AVAILABILITY: {1}'.format(database_name, str(e)))
-                continue
+        if differences:
+            mismatch(SqlRecord(STATUS_ERROR, 'verify', login=login, details=dict(differences=differences),
+                               message='[LOGIN: {0}] VERIFY FAILED - [{1}]'.format(login, "; ".join(differences))))
 
-            try:
-                if sql_server_version >= 12 and not sql_utils.is_primary_hadr_replica(connection_factory, database_name):
-                    information.append('[DB: {0}] - IS NOT PRIMARY HADR REPLICA'.format(database_name))
-                    continue
-            except Exception as e:
-                errors.append('[DB: {0}] ERROR OCCIRRED WHILE CHECK PRIMARY HADR REPLICA(sys.fn_hadr_is_primary_replica): {1}'.format(database_name, str(e)))
-                continue
 
-            if database_state == 'absent':
-                try:
-                    if sql_utils.has_drop_user(connection_factory, user_name, database_name):
-                        changes.append('[DB: {1}] USER: [{0}] - [DROPPED]'.format(user_name, database_name))
-                except Exception as e:
-                    errors.append('[DB: {1}]: ERROR OCCURRED WHILE DROP USER: [{0}]; {2}'.format(user_name, database_name, str(e)))
-                    continue
+def __verify_database(connection_factory, database_name, collation, entries, capabilities, mismatch):
+    # читаются только затронутые пользователи, а не весь каталог базы данных
+    user_names = sorted(set(user_name for _, user_name in entries))
+    users = __to_name_index(sql_utils.get_database_users(connection_factory, database_name, user_names), collation)
+    available_roles = None
+    users_roles = None
+    database_permissions = None
 
-            try:
-                default_roles = sql_utils.get_available_roles(connection_factory, database_name)
-            except Exception as e:
-                errors.append('[DB: {0}] ERROR OCCIRRED WHILE GET AVAILABLE ROLES: {1}'.format(database_name, str(e)))
-                continue
+    for (login, user_name), database in sorted(entries.items()):
+        differences = []
 
-            if 'db_executor' in database.roles and 'db_executor' not in default_roles:
-                default_roles.append('db_executor')
-                changes.append('[DB: {0}] CREATE ROLE db_executor'.format(database_name))
+        if database.state == 'absent':
+            if user_name in users:
+                differences.append('USER EXISTS')
+        elif user_name not in users:
+            differences.append('USER NOT EXISTS')
+        else:
+            if users.get(user_name) is None or users.get(user_name).lower() != login.lower():
+                differences.append('LOGIN: {0}'.format(users.get(user_name)))
 
-            if database_state == 'present':
-                try:
-                    if sql_utils.has_create_user(connection_factory, user_name, login, database_name):
-                        changes.append('[DB: {1}] USER: [{0}] - [CREATED]'.format(user_name, database_name))
-                except Exception as e:
-                    errors.append('[DB: {1}]: ERROR OCCURRED WHILE CREATE USER: [{0}]; {2}'.format(user_name, database_name, str(e)))
-                    continue
+            if available_roles is None:
+                available_roles = NameIndex(sql_utils.get_available_roles(connection_factory, database_name), collation)
+                users_roles = sql_utils.get_users_roles(connection_factory, database_name, capabilities, collation, user_names)
 
-                for role in database.roles:
-                    if role.upper() in map(str.upper, default_roles):
-                        roles.append(role)
-                    else:
-                        warnings.append('[DB: {1}; USER: {0}]: SQL ROLE: [{2}] - UNAVAILABLE'.format(user_name, database_name, role))
+            roles = [available_roles.name(role) for role in database.roles if role in available_roles]
+            current_roles = NameIndex(users_roles.get(user_name, []), collation)
+            missing = NameIndex(roles, collation).difference(current_roles)
+            extra = current_roles.difference(roles)
 
-                try:
-                    current_user_roles = sql_utils.get_user_roles(connection_factory, user_name, database_name)
+            if missing:
+                differences.append('MISSING ROLES: {0}'.format(", ".join(sorted(missing))))
 
-                    deleted = set(current_user_roles) - set(roles)
-                    add = set(roles) - set(current_user_roles)
+            if extra:
+                differences.append('EXTRA ROLES: {0}'.format(", ".join(sorted(extra))))
 
-                    if deleted:
-                        changes.append('[DB: {1}; USER: {0}]: REMOVED ROLES - [{2}]'.format(user_name, database_name, ", ".join(deleted)))
+            if database.permissions is not None:
+                if database_permissions is None:
+                    database_permissions = __to_name_index(sql_utils.get_database_permissions(connection_factory, database_name, user_names), collation)
 
-                    if add:
-                        changes.append('[DB: {1}; USER: {0}]: ADDED ROLES - [{2}]'.format(user_name, database_name, ", ".join(add)))
+                statements = __get_permission_delta(database.permissions, database_permissions.get(user_name, set()), collation)
+                if statements:
+                    differences.append('PERMISSIONS: {0}'.format(len(statements)))
 
-                except Exception as e:
-                    errors.append('[DB: {1}; USER: {0}]: ERROR OCCURRED WHILE GET USER ROLES; {2}'.format(user_name, database_name, str(e)))
+        if differences:
+            mismatch(SqlRecord(STATUS_ERROR, 'verify', login=login, database=database_name, principal=user_name, details=dict(differences=differences),
+                               message='[DB: {1}; USER: {0}]: VERIFY FAILED - [{2}]'.format(user_name, database_name, "; ".join(differences))))
+
+
+def __to_name_index(values, collation):
+    index = NameIndex(collation=collation)
+
+    for name, value in values.items():
+        index.add(name, value)
+
+    return index
+
+
+def __get_permission_delta(permissions, current_permissions, collation=None):
+    # схемы и объекты сравниваются по collation базы данных, в инструкции попадает написание из каталога
+    securables = NameIndex([item[1] for item in current_permissions if item[1] is not None], collation)
+
+    def key(securable_class, securable, permission):
+        return securable_class, None if securable is None else securables.key(securable), permission
+
+    current = dict((key(*item[:3]), item) for item in current_permissions)
+    desired = {}
+
+    for p in permissions:
+        securable = None if p.securable is None else securables.name(p.securable) or p.securable
+        desired[key(p.securable_class, securable, p.permission)] = (p.securable_class, securable, p.permission, p.state)
+
+    statements = []
+
+    for permission_key, item in sorted(desired.items(), key=lambda entry: entry[1]):
+        current_item = current.get(permission_key)
+
+        if current_item == item:
+            continue
+
+        if item[3] == 'grant' and current_item is not None and current_item[3] == 'grant_with_grant_option':
+            # grant уже есть, лишний только with grant option
+            statements.append(('revoke_grant_option',) + item[:3])
+        else:
+            statements.append((item[3],) + item[:3])
+
+    for permission_key, item in sorted(current.items(), key=lambda entry: entry[1]):
+        if permission_key not in desired:
+            statements.append(('revoke',) + item[:3])
+
+    return statements
+
+
+def __apply_permissions(connection_factory, database_name, context, check_mode, sink):
+    permission_changes = sorted(context['permission_changes'], key=lambda change: (change[0], change[1]))
+
+    if not permission_changes:
+        return True
+
+    started = time.time()
+    errors = []
+
+    if not check_mode:
+        batch = []
+        for login, user_name, statements in permission_changes:
+            for action, securable_class, securable, permission in statements:
+                batch.append(sql_utils.get_permission_statement(action, securable_class, securable, permission, user_name))
+
+        try:
+            errors = sql_utils.execute_batch(connection_factory, database_name, batch)
+        except Exception as e:
+            sink.emit(SqlRecord(STATUS_ERROR, 'sync_permissions', database=database_name,
+                                message='[DB: {0}]: ERROR OCCURRED WHILE APPLY PERMISSIONS: - {1}'.format(database_name, str(e))))
+            return False
+
+    duration = time.time() - started
+    position = 0
+
+    for login, user_name, statements in permission_changes:
+        applied = dict(grant=[], deny=[], revoke=[], revoke_grant_option=[])
+        descriptions = []
+
+        for action, securable_class, securable, permission in statements:
+            description = permission if securable_class == 'DATABASE' else '{0} ON {1}::{2}'.format(permission, securable_class, securable)
+            error = errors[position] if errors else None
+            position += 1
+
+            if error:
+                sink.emit(SqlRecord(STATUS_ERROR, 'sync_permissions', login=login, database=database_name, principal=user_name,
+                                    message='[DB: {1}; USER: {0}]: ERROR OCCURRED WHILE {2} {3} - {4}'.format(user_name, database_name, action.replace('_', ' ').upper(), description, error)))
+                continue
 
-    if changes:
-        changed = True
+            applied[action].append(description)
+            descriptions.append('{0} {1}'.format(action.replace('_', ' ').upper(), description))
 
-    return changes, information, warnings, errors, changed
+        if descriptions:
+            sink.emit(SqlRecord(STATUS_CHANGED, 'sync_permissions', login=login, database=database_name, principal=user_name,
+                                details=dict((action, items) for action, items in applied.items() if items), duration=duration,
+                                message='[DB: {1}; USER: {0}]: PERMISSIONS - [{2}]'.format(user_name, database_name, ", ".join(descriptions))))
@@ -0,0 +1,92 @@
+import cProfile
+import os
+import pstats
+import sys
+import threading
+
+PROFILE_ENVIRONMENT_VARIABLE = "MSSQL_USERS_PROFILE"
+
+
+class Profiler(object):
+
+    def __init__(self, path=None, limit=20):
+        """Constructor
+        :param path: путь к файлу статистики cProfile, если не задан берется из MSSQL_USERS_PROFILE
+        :param limit: количество функций в кратком отчете
+
+        cProfile профилирует только поток, в котором включен, поэтому потоки, запущенные внутри блока with
+        (пул workers), получают собственный профиль, и статистика всех потоков объединяется в один файл.
+        С python 3.12 cProfile работает через sys.monitoring и сам видит все потоки, отдельные профили не нужны.
+        """
+        self.path = path or os.environ.get(PROFILE_ENVIRONMENT_VARIABLE)
+        self.limit = limit
+        self.summary = None
+        self.__profile = None
+        self.__thread_profiles = []
+        self.__lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def __enter__(self):
+        if self.enabled:
+            self.__profile = cProfile.Profile()
+            self.__thread_profiles = []
+            if sys.version_info < (3, 12):
+                threading.setprofile(self.__profile_thread)
+            self.__profile.enable()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.__profile:
+            return False
+
+        self.__profile.disable()
+        threading.setprofile(None)
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        stats = pstats.Stats(self.__profile)
+        with self.__lock:
+            for profile in self.__thread_profiles:
+                stats.add(profile)
+
+        stats.dump_stats(self.path)
+        # с python 3.12 потоки профилируются одним профилем, и их количество неизвестно
+        threads = len(self.__thread_profiles) + 1 if sys.version_info < (3, 12) else None
+        self.summary = dict(path=self.path, threads=threads, functions=self.__get_hot_functions(stats))
+        self.__profile = None
+        self.__thread_profiles = []
+
+        return False
+
+    def __profile_thread(self, frame, event, arg):
+        # вызывается первым событием нового потока и заменяет себя профилем этого потока
+        profile = cProfile.Profile()
+
+        try:
+            profile.enable()
+        except ValueError:
+            # профиль уже включен в другом потоке (sys.monitoring), а хук не должен вызываться на каждом событии
+            sys.setprofile(None)
+            return
+
+        with self.__lock:
+            self.__thread_profiles.append(profile)
+
+    def __get_hot_functions(self, stats):
+        functions = []
+
+        for (file_name, line, function_name), (_, calls, tottime, cumtime, _) in stats.stats.items():
+            functions.append(dict(function="{0}:{1}({2})".format(os.path.basename(file_name), line, function_name),
+                                  calls=calls,
+                                  tottime=round(tottime, 6),
+                                  cumtime=round(cumtime, 6)))
+
+        functions.sort(key=lambda f: f["tottime"], reverse=True)
+
+        return functions[:self.limit]
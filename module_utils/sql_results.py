@@ -0,0 +1,127 @@
+import json
+import os
+import threading
+
+STATUS_CHANGED = "changed"
+STATUS_INFO = "info"
+STATUS_WARNING = "warning"
+STATUS_ERROR = "error"
+
+STATUSES = [STATUS_CHANGED, STATUS_INFO, STATUS_WARNING, STATUS_ERROR]
+
+
+class SqlRecord(object):
+
+    def __init__(self, status, operation, login=None, database=None, principal=None, roles=None, details=None,
+                 message=None, duration=None):
+        """Constructor
+        :param status: changed, info, warning или error
+        :param operation: операция, например create_login, drop_user, add_roles
+        :param login: логин
+        :param database: база данных
+        :param principal: пользователь базы данных
+        :param roles: роли, к которым относится запись
+        :param details: дополнительные поля операции
+        :param message: человекочитаемое описание
+        :param duration: длительность операции в секундах
+        """
+        self.status = status
+        self.operation = operation
+        self.login = login
+        self.database = database
+        self.principal = principal
+        self.roles = roles
+        self.details = details
+        self.message = message
+        self.duration = duration
+
+    def to_dict(self):
+        record = dict((key, value) for key, value in self.__dict__.items() if value is not None)
+
+        if self.duration is not None:
+            record["duration"] = round(self.duration, 6)
+
+        return record
+
+    def __str__(self):
+        return self.message or self.operation
+
+
+class ResultSink(object):
+
+    def __init__(self, path=None, sample_size=20):
+        """Constructor
+        :param path: путь к jsonl файлу, в который записываются все записи по мере выполнения
+        :param sample_size: сколько записей каждого статуса хранить в памяти для результата модуля
+
+        Для проверки после применения хранит (login, database, principal) всех измененных записей.
+        """
+        self.path = path
+        self.sample_size = sample_size
+        self.counts = dict((status, 0) for status in STATUSES)
+        self.operations = {}
+        self.sample = dict((status, []) for status in STATUSES)
+        self.affected = set()
+        self.__lock = threading.Lock()
+        self.__file = None
+
+        if path:
+            directory = os.path.dirname(path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+
+            self.__file = open(path, "a")
+
+    @property
+    def changed(self):
+        return self.counts[STATUS_CHANGED] > 0
+
+    @property
+    def failed(self):
+        return self.counts[STATUS_ERROR] > 0
+
+    def emit(self, record):
+        with self.__lock:
+            self.counts[record.status] += 1
+
+            key = "{0}:{1}".format(record.operation, record.status)
+            self.operations[key] = self.operations.get(key, 0) + 1
+
+            if record.status == STATUS_CHANGED and record.login:
+                self.affected.add((record.login, record.database, record.principal))
+
+            if len(self.sample[record.status]) < self.sample_size:
+                self.sample[record.status].append(record.to_dict())
+
+            if self.__file:
+                self.__file.write(json.dumps(record.to_dict(), sort_keys=True) + "\n")
+                self.__file.flush()
+
+    def get_error_message(self):
+        messages = [record["message"] for record in self.sample[STATUS_ERROR]]
+        hidden = self.counts[STATUS_ERROR] - len(messages)
+
+        if hidden > 0:
+            messages.append("... and {0} more errors".format(hidden))
+
+        return "; ".join(messages)
+
+    def summary(self):
+        result = dict(counts=self.counts, operations=self.operations, sample=self.sample)
+
+        if self.path:
+            result["results_file"] = self.path
+
+        return result
+
+    def close(self):
+        if self.__file:
+            self.__file.close()
+            self.__file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
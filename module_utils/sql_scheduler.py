@@ -0,0 +1,121 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+class _Node(object):
+
+    def __init__(self, key, function, after, always):
+        self.key = key
+        self.function = function
+        self.after = list(after)
+        self.always = always
+        self.dependents = []
+
+
+class Scheduler(object):
+
+    def __init__(self, workers=1):
+        """Constructor
+        :param workers: сколько узлов выполнять одновременно
+
+        Выполняет граф операций: узел запускается, когда выполнены все узлы, после которых он добавлен.
+        Если хотя бы одна из зависимостей упала или пропущена, узел пропускается (кроме узлов с always),
+        и вместе с ним пропускаются все его потомки. Независимые узлы выполняются параллельно.
+        """
+        self.workers = workers
+        self.status = {}
+        self.causes = {}
+        self.__nodes = {}
+        self.__order = []
+
+    def add(self, key, function, after=(), always=False):
+        """Метод добавляет узел графа.
+        Args:
+            key (tuple): уникальный ключ узла
+            function (callable): операция без аргументов, False - операция не удалась
+            after (list): ключи узлов, которые должны выполниться раньше
+            always (bool): выполнять узел, даже если зависимости упали или пропущены
+        """
+        if key in self.__nodes:
+            raise ValueError("node {0} already added".format(key))
+
+        node = _Node(key, function, after, always)
+
+        # все зависимости проверяются до связывания, чтобы отклоненный узел не остался в графе
+        for dependency in node.after:
+            if dependency not in self.__nodes:
+                raise ValueError("node {0} depends on unknown node {1}".format(key, dependency))
+
+        for dependency in node.after:
+            self.__nodes[dependency].dependents.append(node)
+
+        self.__nodes[key] = node
+        self.__order.append(key)
+
+    def run(self):
+        """Метод выполняет граф.
+
+        Returns:
+            dict: статус (done, failed, skipped) по ключу узла, для пропущенных узлов causes хранит зависимость,
+            из-за которой узел пропущен
+        """
+        remaining = dict((key, len(self.__nodes[key].after)) for key in self.__order)
+        ready = deque(key for key in self.__order if remaining[key] == 0)
+        errors = []
+        running = {}
+        executor = ThreadPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+
+        try:
+            while ready or running:
+                while ready:
+                    node = self.__nodes[ready.popleft()]
+
+                    cause = None if node.always else next((key for key in node.after if self.status[key] != DONE), None)
+
+                    if cause is not None:
+                        self.causes[node.key] = cause
+                        self.__finish(node, SKIPPED, remaining, ready)
+                    elif executor:
+                        running[executor.submit(self.__call, node, errors)] = node
+                    else:
+                        self.__finish(node, self.__call(node, errors), remaining, ready)
+
+                if running:
+                    done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.__finish(running.pop(future), future.result(), remaining, ready)
+        finally:
+            if executor:
+                executor.shutdown()
+
+        if errors:
+            raise errors[0]
+
+        return self.status
+
+    def get_root_cause(self, key):
+        """Метод возвращает упавший узел, из-за которого пропущен узел key (через цепочку пропущенных)."""
+        while key in self.causes:
+            key = self.causes[key]
+
+        return key
+
+    def __finish(self, node, status, remaining, ready):
+        self.status[node.key] = status
+
+        for dependent in node.dependents:
+            remaining[dependent.key] -= 1
+            if remaining[dependent.key] == 0:
+                ready.append(dependent.key)
+
+    @staticmethod
+    def __call(node, errors):
+        try:
+            return FAILED if node.function() is False else DONE
+        except Exception as e:
+            errors.append(e)
+            return FAILED
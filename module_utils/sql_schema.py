@@ -0,0 +1,241 @@
+import re
+
+TRUE_VALUES = ["true", "yes", "on", "1"]
+FALSE_VALUES = ["false", "no", "off", "0"]
+UNKNOWN_FIELD = "unknown field"
+
+
+# Проверки - функции check(value, path, errors), возвращающие нормализованное значение. path - это
+# кортеж (родительский путь, сегмент), строка пути собирается только для ошибки, а объекты и списки
+# нормализуются на месте, поэтому корректные данные проверяются без лишних аллокаций.
+
+def string(pattern=None, message=None, nullable=True):
+    """Строка или null (если nullable), при заданном pattern - совпадающая с регулярным выражением."""
+    match = re.compile(pattern).match if pattern else None
+
+    def check(value, path, errors):
+        if type(value) is str:
+            if match is not None and not match(value):
+                errors.append((path, message or "must match {0}".format(pattern)))
+            return value
+
+        if value is not None or not nullable:
+            errors.append((path, "must be a string, got {0}".format(__type_name(value))))
+
+        return value
+
+    check.is_plain_string = match is None
+    return check
+
+
+def enum(*values):
+    """Строка из списка values без учета регистра, нормализуется в нижний регистр."""
+    allowed = frozenset(values)
+
+    def check(value, path, errors):
+        normalized = value.lower() if isinstance(value, str) else value
+
+        if normalized not in allowed:
+            errors.append((path, "must be one of: {0}, got {1}".format(", ".join(values), __format_value(value))))
+            return value
+
+        return normalized
+
+    return check
+
+
+def boolean():
+    """true/false, а также строки "true"/"false", "yes"/"no", "on"/"off", "1"/"0" и числа 1/0."""
+
+    def check(value, path, errors):
+        if isinstance(value, bool):
+            return value
+
+        if isinstance(value, str):
+            normalized = value.strip().lower()
+            if normalized in TRUE_VALUES:
+                return True
+            if normalized in FALSE_VALUES:
+                return False
+        elif isinstance(value, int) and value in (0, 1):
+            return bool(value)
+
+        errors.append((path, "must be a boolean, got {0}".format(__format_value(value))))
+        return value
+
+    return check
+
+
+def array(item):
+    plain_strings = getattr(item, "is_plain_string", False)
+
+    def check(value, path, errors):
+        if type(value) is not list:
+            errors.append((path, "must be a list, got {0}".format(__type_name(value))))
+            return value
+
+        if plain_strings:
+            for element in value:
+                if type(element) is not str:
+                    break
+            else:
+                return value
+
+        for index, element in enumerate(value):
+            normalized = item(element, (path, index), errors)
+            if normalized is not element:
+                value[index] = normalized
+
+        return value
+
+    return check
+
+
+def mapping(item, key=None):
+    """Объект с произвольными именами ключей (логины, пользователи, базы данных), значения проверяет item."""
+
+    def check(value, path, errors):
+        if type(value) is not dict:
+            errors.append((path, "must be an object, got {0}".format(__type_name(value))))
+            return value
+
+        for name, element in value.items():
+            element_path = (path, name)
+
+            if not name.strip():
+                errors.append((element_path, "name cannot be empty"))
+                continue
+
+            if key is not None:
+                key(name.strip(), element_path, errors)
+
+            normalized = item(element, element_path, errors)
+            if normalized is not element:
+                value[name] = normalized
+
+        return value
+
+    return check
+
+
+def record(**fields):
+    """Объект с фиксированным набором необязательных полей, о неизвестных полях сообщается с UNKNOWN_FIELD."""
+    known = ", ".join(sorted(fields))
+    entries = dict((name, (field, "." + name, getattr(field, "is_plain_string", False))) for name, field in fields.items())
+
+    def check(value, path, errors):
+        if type(value) is not dict:
+            errors.append((path, "must be an object, got {0}".format(__type_name(value))))
+            return value
+
+        for name, element in value.items():
+            entry = entries.get(name)
+
+            if entry is None:
+                errors.append(((path, "." + name), "{0}, expected one of: {1}".format(UNKNOWN_FIELD, known)))
+                continue
+
+            field, segment, plain_string = entry
+
+            if plain_string and type(element) is str:
+                continue
+
+            normalized = field(element, (path, segment), errors)
+            if normalized is not element:
+                value[name] = normalized
+
+        return value
+
+    return check
+
+
+def securable():
+    regex = re.compile(r'^\s*(DATABASE\s*|(SCHEMA|OBJECT)\s*::\s*\S.*)$', re.IGNORECASE)
+
+    def check(name, path, errors):
+        if not regex.match(name):
+            errors.append((path, "securable must be DATABASE, SCHEMA::name or OBJECT::schema.name"))
+
+    return check
+
+
+PERMISSION = string(r'^\s*[A-Za-z]+( +[A-Za-z]+)*\s*$', "permission must contain only letters and spaces", nullable=False)
+
+DATABASE = record(
+    state=enum("present", "absent"),
+    roles=array(string(nullable=False)),
+    permissions=mapping(record(grant=array(PERMISSION), deny=array(PERMISSION)), key=securable()))
+
+USER = record(
+    state=enum("present", "absent"),
+    databases=mapping(DATABASE))
+
+LOGIN = record(
+    sid=string(r'^0x[0-9A-Fa-f]{2,170}$', "sid must be a hex string like 0x0123ABCD"),
+    password=string(),
+    password_hash=string(r'^0x0[12]00[0-9A-Fa-f]{48,}$', "password_hash must be a hex string like 0x0200..."),
+    default_database=string(),
+    default_language=string(),
+    enabled=boolean(),
+    state=enum("present", "absent"),
+    users=mapping(USER))
+
+LOGINS = mapping(LOGIN)
+
+
+def validate(data, file_path=None, strict=False):
+    """Метод за один проход проверяет источник логинов и нормализует типы на месте (enabled: "false" -> False,
+    state: "Present" -> present).
+    Args:
+        data (dict): разобранный json файла источника
+        file_path (str): путь к файлу для сообщений об ошибках
+        strict (bool): неизвестные поля - ошибки, иначе только предупреждения, а сами поля игнорируются
+
+    Returns:
+        tuple: нормализованные данные, список всех ошибок и список предупреждений с файлом и json путем
+    """
+    found = []
+    normalized = LOGINS(data, None, found)
+    errors = []
+    warnings = []
+
+    for path, message in found:
+        line = "FILE: {0}, PATH: {1}: {2}".format(file_path, __format_path(path), message)
+
+        if not strict and message.startswith(UNKNOWN_FIELD):
+            warnings.append(line)
+        else:
+            errors.append(line)
+
+    return normalized, errors, warnings
+
+
+def __format_path(path):
+    segments = []
+
+    while path is not None:
+        path, segment = path
+        if isinstance(segment, int):
+            segments.append("[{0}]".format(segment))
+        elif segment.startswith("."):
+            segments.append(segment)
+        else:
+            segments.append('["{0}"]'.format(segment))
+
+    return "$" + "".join(reversed(segments))
+
+
+def __type_name(value):
+    if value is None:
+        return "null"
+    if isinstance(value, dict):
+        return "object"
+    if isinstance(value, list):
+        return "list"
+    return type(value).__name__
+
+
+def __format_value(value):
+    if isinstance(value, str):
+        return '"{0}"'.format(value)
+    return str(value)
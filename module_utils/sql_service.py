@@ -0,0 +1,273 @@
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+from ansible.module_utils.sql_objects import SqlLogin
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+DEFAULT_SOCKET_PATH = "~/.ansible/mssql_users.sock"
+
+
+class ServiceUnavailable(Exception):
+    """Сервис не принял соединение, запрос не отправлен и его можно выполнить локально."""
+    pass
+
+
+class ServiceError(Exception):
+    """Запрос отправлен, но ответ не получен или поврежден: сервис мог уже начать изменения."""
+    pass
+
+
+class ReconcilerService(object):
+
+    def __init__(self, socket_path=None, pool_size=4, capabilities_ttl=3600):
+        """Constructor
+        :param socket_path: путь к unix сокету
+        :param pool_size: сколько свободных соединений хранить на каждую базу данных
+        :param capabilities_ttl: время жизни профиля возможностей сервера в секундах
+
+        Сервис живет между запусками ansible и хранит на каждый sql server пул соединений
+        и профиль возможностей, поэтому запрос не платит за импорт pymssql и установку соединений.
+        """
+        self.socket_path = os.path.expanduser(socket_path or DEFAULT_SOCKET_PATH)
+        self.pool_size = pool_size
+        self.capabilities_ttl = capabilities_ttl
+        self.__pools = {}
+        self.__capabilities = {}
+        self.__lock = threading.Lock()
+        self.__server = None
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+        directory = os.path.dirname(self.socket_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        service = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                response = service.handle(self.rfile.read())
+                self.wfile.write(json.dumps(response, default=str).encode("utf-8"))
+
+        # в запросе есть пароли, поэтому сокет доступен только владельцу
+        umask = os.umask(0o177)
+        try:
+            self.__server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        finally:
+            os.umask(umask)
+
+        self.__server.daemon_threads = True
+
+        try:
+            self.__server.serve_forever()
+        finally:
+            self.close()
+
+    def shutdown(self):
+        if self.__server:
+            self.__server.shutdown()
+
+    def close(self):
+        with self.__lock:
+            pools = list(self.__pools.values())
+            self.__pools = {}
+
+        for pool in pools:
+            pool.close()
+
+        if self.__server:
+            self.__server.server_close()
+            self.__server = None
+
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def handle(self, data):
+        try:
+            return self.reconcile(json.loads(data.decode("utf-8")))
+        except Exception as e:
+            return dict(failed=True, msg="reconciler service error: {0}".format(str(e)))
+
+    def reconcile(self, request):
+        """Метод синхронизирует логины запроса и возвращает результат в формате модуля mssql_users.
+        Args:
+            request (dict): connection, sql_logins, check_mode, workers и остальные параметры модуля
+
+        Returns:
+            dict: результат синхронизации
+        """
+        import ansible.module_utils.sql_processor as SqlProcessor
+        from ansible.module_utils.sql_journal import Journal, get_desired_hash
+        from ansible.module_utils.sql_locks import AppLocks
+        from ansible.module_utils.sql_metrics import Metrics, write_run_metrics
+        from ansible.module_utils.sql_results import ResultSink
+
+        start_time = time.time()
+        connection = request['connection']
+        pool = self.get_pool(connection['server'], connection['login'], connection['password'])
+        metrics_file = request.get('metrics_file')
+        metrics = Metrics("mssql_users", dict(host=connection['server']))
+        statistics = pool.statistics
+
+        try:
+            with metrics.phase("capabilities"):
+                capabilities = self.get_capabilities(pool, connection['server'])
+        except Exception:
+            if metrics_file:
+                metrics.set("up", 0, "Whether the server was reachable")
+                metrics.write(metrics_file)
+            raise
+
+        if capabilities.major_version < 10:
+            return dict(failed=True, msg="sql server version {0} not supported".format(capabilities.version))
+
+        sql_logins = list(map(SqlLogin.from_json, request.get('sql_logins') or []))
+        check_mode = request.get('check_mode', False)
+        workers = request.get('workers', 1)
+        orphaned_users = None
+        locks = None
+        journal = None
+
+        if request.get('journal') and not check_mode:
+            journal = Journal(request['journal'], get_desired_hash(sql_logins))
+
+        with ResultSink(request.get('results_file'), request.get('sample_size', 20)) as sink:
+            if request.get('lock_timeout') is not None and not check_mode:
+                locks = AppLocks(pool, request['lock_timeout'], sink)
+
+            try:
+                with metrics.phase("apply_logins"):
+                    SqlProcessor.apply_sql_logins(pool, sql_logins, capabilities, check_mode, workers, sink,
+                                                  request.get('password_check', 'server'), request.get('role_diff', 'client'), locks, journal)
+
+                verified = None
+                if request.get('verify') and not check_mode:
+                    with metrics.phase("verify"):
+                        verified = SqlProcessor.verify_sql_logins(pool, sql_logins, capabilities, sink.affected, workers, sink)
+
+                if request.get('orphaned_users'):
+                    with metrics.phase("orphaned_users"):
+                        orphaned_users = SqlProcessor.fix_orphaned_users(pool, capabilities, request['orphaned_users'], check_mode,
+                                                                         request.get('orphaned_users_databases'), request.get('batch_size', 500), workers, sink)
+            except Exception:
+                if journal is not None:
+                    journal.close()
+                if metrics_file:
+                    write_run_metrics(metrics_file, metrics, self.__get_run_statistics(pool, statistics), sink, len(sql_logins))
+                raise
+
+        if metrics_file:
+            write_run_metrics(metrics_file, metrics, self.__get_run_statistics(pool, statistics), sink, len(sql_logins))
+
+        result = dict(changed=sink.changed, sql_server_version=capabilities.version, capabilities=capabilities.to_dict(),
+                      execution_time=time.time() - start_time, service=dict(socket=self.socket_path, statistics=pool.statistics), **sink.summary())
+
+        if orphaned_users is not None:
+            result['orphaned_users'] = orphaned_users
+
+        if verified is not None:
+            result['verified'] = verified
+
+        if locks is not None:
+            result['locks'] = locks.statistics
+
+        if journal is not None:
+            result['checkpoint'] = dict(journal=journal.path, completed=not sink.failed, **journal.progress)
+
+            if sink.failed:
+                journal.close()
+            else:
+                journal.complete()
+
+        if sink.failed:
+            result['failed'] = True
+            result['msg'] = sink.get_error_message()
+
+        return result
+
+    @staticmethod
+    def __get_run_statistics(pool, before):
+        # пул общий для всех запросов к серверу, метрики запуска - это прирост его счетчиков за время запроса
+        after = pool.statistics
+        return dict((name, after[name] - before.get(name, 0)) for name in after)
+
+    def get_pool(self, server, login, password):
+        from ansible.module_utils.db_provider import ConnectionPool
+
+        key = (server, login, hashlib.sha256(password.encode("utf-8")).hexdigest())
+
+        with self.__lock:
+            pool = self.__pools.get(key)
+
+            if pool is None:
+                pool = ConnectionPool(server, login, password, self.pool_size)
+                self.__pools[key] = pool
+
+            return pool
+
+    def get_capabilities(self, pool, server):
+        import ansible.module_utils.sql_capabilities as SqlCapabilities
+
+        with self.__lock:
+            capabilities = self.__capabilities.get(server)
+
+        if capabilities is None or time.time() - capabilities.probed_at >= self.capabilities_ttl:
+            capabilities = SqlCapabilities.probe(pool)
+
+            with self.__lock:
+                self.__capabilities[server] = capabilities
+
+        return capabilities
+
+
+def request(socket_path, payload, timeout=3600):
+    """Метод отправляет запрос сервису и ждет результат.
+    Args:
+        socket_path (str): путь к unix сокету сервиса
+        payload (dict): запрос
+        timeout (int): время ожидания результата в секундах
+
+    Returns:
+        dict: результат синхронизации
+
+    Raises:
+        ServiceUnavailable: сервис не запущен или не принимает соединения
+        ServiceError: соединение прервано после отправки запроса, истек timeout или ответ неполный
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+
+    try:
+        try:
+            client.connect(os.path.expanduser(socket_path))
+        except (IOError, OSError) as e:
+            raise ServiceUnavailable(str(e))
+
+        try:
+            client.sendall(json.dumps(payload, default=lambda o: o.__dict__).encode("utf-8"))
+            client.shutdown(socket.SHUT_WR)
+
+            chunks = []
+            while True:
+                chunk = client.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        except (IOError, OSError) as e:
+            raise ServiceError("connection lost after the request was sent: {0}".format(str(e) or type(e).__name__))
+    finally:
+        client.close()
+
+    try:
+        return json.loads(b"".join(chunks).decode("utf-8"))
+    except ValueError as e:
+        raise ServiceError("incomplete or invalid response ({0} bytes): {1}".format(sum(len(chunk) for chunk in chunks), str(e)))
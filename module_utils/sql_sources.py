@@ -0,0 +1,119 @@
+import glob
+import json
+from ansible.module_utils.sql_objects import SqlLogin
+import ansible.module_utils.sql_schema as sql_schema
+
+
+class SqlSourceError(Exception):
+
+    def __init__(self, errors):
+        """Constructor
+        :type errors: list
+        """
+        super(SqlSourceError, self).__init__("; ".join(errors))
+        self.errors = errors
+
+
+def read_sources(sources, log=None, strict=False):
+    """Метод читает и разбирает файлы источников логинов.
+    Args:
+        sources (list): список путей (glob шаблонов) к json файлам
+        log (callable): функция для записи предупреждений
+        strict (bool): неизвестные поля в файлах - ошибки, а не предупреждения
+
+    Returns:
+        tuple: словарь SqlLogin по имени логина и информация о найденных файлах
+
+    Raises:
+        SqlSourceError: все ошибки разбора и дубликаты логинов, в порядке файлов
+    """
+    files_info = {}
+    all_file_paths = []
+    file_sources = {}
+
+    for path in sources:
+        file_paths = sorted(glob.glob(path))
+
+        files_info[path] = {'files': file_paths}
+
+        if not file_paths:
+            msg = "no files found for source: {0}".format(path)
+            if log:
+                log(msg)
+
+            files_info[path]['warnings'] = [msg]
+            continue
+
+        all_file_paths.extend(file_paths)
+
+        for file_path in file_paths:
+            file_sources.setdefault(file_path, path)
+
+    # файлы разбираются в этом процессе: передача разобранных логинов из пула процессов обратно через pickle
+    # стоит дороже самого json.load и проверки (100000 логинов: ~1.8 с только на распаковку против ~1.7 с разбора)
+    parsed_files = [__try_read_source_file(file_path, strict) for file_path in all_file_paths]
+
+    sql_logins = {}
+    login_files = {}
+    errors = []
+
+    for file_path, (items, file_errors, file_warnings) in zip(all_file_paths, parsed_files):
+        for warning in file_warnings:
+            if log:
+                log(warning)
+
+            files_info[file_sources[file_path]].setdefault('warnings', []).append(warning)
+
+        if file_errors:
+            errors.extend(file_errors)
+            continue
+
+        for item in items:
+            if item.login in sql_logins:
+                errors.append("DUPLICATE LOGIN: [{0}], FILE: [{1}], FIRST DEFINED IN: [{2}]".format(item.login, file_path, login_files[item.login]))
+                continue
+
+            sql_logins[item.login] = item
+            login_files[item.login] = file_path
+
+    if errors:
+        raise SqlSourceError(errors)
+
+    return sql_logins, files_info
+
+
+def read_source_file(file_path, strict=False, warnings=None):
+    """Метод читает и разбирает один файл источника.
+    Args:
+        file_path (str): путь к json файлу
+        strict (bool): неизвестные поля - ошибки, а не предупреждения
+        warnings (list): сюда добавляются предупреждения о неизвестных полях
+
+    Returns:
+        list: список SqlLogin
+    """
+    with open(file_path, "r") as read_file:
+        data, errors, file_warnings = sql_schema.validate(json.load(read_file), file_path, strict)
+
+    if errors:
+        raise SqlSourceError(errors)
+
+    if warnings is not None:
+        warnings.extend(file_warnings)
+
+    return SqlLogin.parse(data)
+
+
+def __try_read_source_file(file_path, strict=False):
+    warnings = []
+
+    try:
+        return read_source_file(file_path, strict, warnings), None, warnings
+    except SqlSourceError as e:
+        return None, e.errors, warnings
+    except Exception as e:
+        return None, ["FILE: %s, PARSE SQL LOGIN EXCEPTION: %s" % (file_path, str(e))], warnings
+
+
+def to_facts(sql_logins):
+    return json.loads(json.dumps(sql_logins, default=lambda o: o.__dict__, sort_keys=True))
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+import time
+
+PENDING_SUFFIX = ".pending"
+
+
+def fingerprint(sql_login):
+    """Метод вычисляет отпечаток нормализованного описания логина.
+    Args:
+        sql_login (SqlLogin): логин
+
+    Returns:
+        str: sha256 канонического json логина
+    """
+    data = json.dumps(sql_login, default=lambda o: o.__dict__, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def load_state(path):
+    """Метод читает последнее успешно примененное состояние.
+    Args:
+        path (str): путь к файлу состояния
+
+    Returns:
+        dict: logins - отпечаток по имени логина, full_sync_at - время последней полной синхронизации,
+        пустое состояние, если файла нет
+    """
+    if not os.path.exists(path):
+        return dict(logins={}, full_sync_at=None)
+
+    with open(path, "r") as read_file:
+        return json.load(read_file)
+
+
+def get_delta(state, sql_logins, full_sync=False, full_sync_interval=None, now=None):
+    """Метод сравнивает логины источников с последним успешно примененным состоянием.
+    Args:
+        state (dict): состояние, прочитанное load_state
+        sql_logins (dict): словарь SqlLogin по имени логина
+        full_sync (bool): применить все логины независимо от состояния
+        full_sync_interval (int): через сколько секунд после последней полной синхронизации сделать новую
+        now (float): текущее время
+
+    Returns:
+        dict: added, changed, removed - имена логинов, unchanged - их количество, full_sync - полная ли синхронизация,
+        fingerprints - отпечатки всех логинов для нового состояния
+    """
+    now = time.time() if now is None else now
+    full_sync_at = state.get('full_sync_at')
+
+    if full_sync_at is None or (full_sync_interval is not None and now - full_sync_at >= full_sync_interval):
+        full_sync = True
+
+    applied = state.get('logins') or {}
+    fingerprints = dict((login, fingerprint(sql_login)) for login, sql_login in sql_logins.items())
+    added = sorted(login for login in fingerprints if login not in applied)
+    changed = sorted(login for login, value in fingerprints.items() if login in applied and applied[login] != value)
+    removed = sorted(login for login in applied if login not in fingerprints)
+
+    return dict(added=added, changed=changed, removed=removed, unchanged=len(fingerprints) - len(added) - len(changed),
+                full_sync=full_sync, fingerprints=fingerprints)
+
+
+def write_pending(path, delta, now=None):
+    """Метод записывает новое состояние рядом с текущим, оно вступает в силу только после commit.
+    Args:
+        path (str): путь к файлу состояния
+        delta (dict): результат get_delta
+        now (float): текущее время
+
+    Returns:
+        str: путь к файлу ожидающего состояния
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    state = load_state(path)
+    full_sync_at = (time.time() if now is None else now) if delta['full_sync'] else state.get('full_sync_at')
+    pending_path = path + PENDING_SUFFIX
+    tmp_path = pending_path + ".tmp"
+
+    # отпечатки считаются и по паролям, поэтому файл доступен только владельцу
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as write_file:
+        json.dump(dict(logins=delta['fingerprints'], full_sync_at=full_sync_at), write_file, sort_keys=True, separators=(',', ':'))
+
+    os.rename(tmp_path, pending_path)
+
+    return pending_path
+
+
+def commit(path):
+    """Метод делает ожидающее состояние текущим после успешного применения.
+    Args:
+        path (str): путь к файлу состояния
+
+    Returns:
+        bool: True если состояние изменено, False если ожидающего состояния нет
+    """
+    pending_path = path + PENDING_SUFFIX
+
+    if not os.path.exists(pending_path):
+        return False
+
+    os.rename(pending_path, path)
+
+    return True
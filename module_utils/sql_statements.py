@@ -0,0 +1,29 @@
+class SqlStatement(object):
+
+    def __init__(self, sql, parameters=None):
+        """Constructor
+        :param sql: неизменный текст запроса, параметры в нем задаются как @name
+        :param parameters: список (name, sql_type) параметров запроса
+
+        Запрос выполняется через sp_executesql, поэтому текст запроса одинаковый для любых
+        значений параметров и его план переиспользуется из кеша.
+        """
+        self.sql = sql
+        self.parameters = parameters or []
+
+        statement = sql.replace("'", "''")
+
+        if self.parameters:
+            definition = ", ".join("@{0} {1}".format(name, sql_type) for name, sql_type in self.parameters)
+            values = ", ".join("@{0} = %({0})s".format(name) for name, _ in self.parameters)
+            self.batch = "exec sp_executesql N'{0}', N'{1}', {2}".format(statement.replace("%", "%%"), definition, values)
+        else:
+            self.batch = "exec sp_executesql N'{0}'".format(statement)
+
+    def execute(self, cursor, **values):
+        if not self.parameters:
+            cursor.execute(self.batch)
+            return
+
+        params = dict((name, values.get(name)) for name, _ in self.parameters)
+        cursor.execute(self.batch, params)
@@ -1,8 +1,15 @@
 import hashlib
+import re
+from ansible.module_utils.sql_statements import SqlStatement
+from ansible.module_utils.sql_passwords import is_password_hash
+from ansible.module_utils.sql_names import NameIndex, split_name, format_name
 
 
 # region logins
 
+_LOGIN_EXISTS = SqlStatement("select count(*) from sys.server_principals where name = @login and type in ('S', 'U', 'G')", [("login", "sysname")])
+
+
 def login_exists(connection_factory, login):
     """Метод проверять существует ли логин.
     Args:
@@ -18,8 +25,9 @@ def login_exists(connection_factory, login):
 
     with connection_factory.connect() as conn:
         with conn.cursor() as cursor:
-            cursor.execute("SELECT NULL FROM master.sys.syslogins WHERE name = %(login)s", dict(login=login))
-            return bool(cursor.rowcount)
+            _LOGIN_EXISTS.execute(cursor, login=login)
+            row = cursor.fetchone()
+            return bool(row[0])
 
 
 def logins_exists(connection_factory, logins):
@@ -38,7 +46,62 @@ def logins_exists(connection_factory, logins):
             return exists_logins
 
 
-def create_login(connection_factory, login, password=None, sid=None, default_database=None, default_language=None):
+def get_logins(connection_factory, logins, chunk_size=1000):
+    """Метод получает состояние логинов одним запросом на каждые chunk_size логинов.
+    Args:
+        connection_factory (connection_factory): Коннект к базе данных
+        logins (list): логины
+        chunk_size (int): количество логинов в одном запросе
+
+    Returns:
+        dict: словари is_disabled, default_database, default_language по имени логина
+    """
+    result = {}
+
+    with connection_factory.connect() as conn:
+        with conn.cursor(as_dict=True) as cursor:
+            for offset in range(0, len(logins), chunk_size):
+                cursor.execute("select name, is_disabled, default_database_name, default_language_name from sys.server_principals "
+                               "where type in ('S', 'U', 'G') and name in %(logins)s", dict(logins=tuple(logins[offset:offset + chunk_size])))
+
+                for row in cursor:
+                    result[row["name"]] = dict(is_disabled=bool(row["is_disabled"]), default_database=row["default_database_name"],
+                                               default_language=row["default_language_name"])
+
+    return result
+
+
+_CREATE_LOGIN = SqlStatement("""
+    declare @sql nvarchar(max) = N'create login ' + quotename(@login);
+    declare @options nvarchar(max) = N'';
+
+    if @from_windows = 1
+        set @sql = @sql + N' from windows';
+    else
+        begin
+            if @password_hash is not null
+                set @options = @options + N', password = ' + @password_hash + N' hashed';
+            else if @password is not null
+                set @options = @options + N', password = N''' + replace(@password, N'''', N'''''') + N'''';
+            set @options = @options + N', sid = ' + @sid;
+        end
+
+    if @default_language is not null
+        set @options = @options + N', default_language = ' + quotename(@default_language);
+
+    if @default_database is not null
+        set @options = @options + N', default_database = ' + quotename(@default_database);
+
+    if @options <> N''
+        set @sql = @sql + N' with ' + stuff(@options, 1, 2, N'');
+
+    exec sp_executesql @sql;
+    select 1;
+""", [("login", "sysname"), ("from_windows", "bit"), ("password", "nvarchar(128)"), ("password_hash", "varchar(600)"),
+      ("sid", "varchar(200)"), ("default_language", "sysname"), ("default_database", "sysname")])
+
+
+def create_login(connection_factory, login, password=None, sid=None, default_database=None, default_language=None, password_hash=None):
     """Метод создает логин.
     Args:
         connection_factory (connection_factory): Коннект к базе данных
@@ -47,48 +110,41 @@ def create_login(connection_factory, login, password=None, sid=None, default_dat
         sid (str): использвется не в доменной авторизации
         default_database (str): база данных по умолчанию
         default_language (str): язык по умолчанию
+        password_hash (str): хеш пароля 0x0200..., используется вместо пароля
     Returns:
         None
     """
     if not login:
         raise ValueError("login cannot be empty")
 
-    sql = "create login [{0}]".format(login)
-
     from_windows = "\\" in login
 
-    if from_windows:
-        sql += " from windows"
-
-    options = []
-
     if not from_windows:
-
-        if password:
-            options.append("password = N'{0}'".format(password))
-
-        if sid:
-            options.append("sid = {0}".format(sid))
-        else:
+        if not sid:
             sid = "0x" + hashlib.md5(login.upper().encode('utf-8')).hexdigest()
-            options.append("sid = {0}".format(sid))
-
-    if default_language:
-        options.append("default_language = [{0}]".format(default_language))
 
-    if default_database:
-        options.append("default_database = [{0}]".format(default_database))
+        if not re.match(r'^0x[0-9A-Fa-f]{2,170}$', sid):
+            raise ValueError("sid: {0} must be a hex string like 0x0123ABCD".format(sid))
 
-    if options:
-        sql += " with " + ", ".join(options)
+        __check_password_hash(password_hash)
 
     with connection_factory.connect() as conn:
         with conn.cursor() as cursor:
-            cursor.execute(sql)
+            _CREATE_LOGIN.execute(cursor, login=login, from_windows=from_windows, password=password or None,
+                                  password_hash=password_hash or None, sid=sid,
+                                  default_language=default_language or None, default_database=default_database or None)
+            cursor.fetchone()
             conn.commit()
             return True
 
 
+_HAS_CHANGE_DEFAULT_DATABASE = SqlStatement('''
+    if @default_database is not null and not exists(select name from sys.server_principals where name = @login and default_database_name = @default_database)
+        select 1
+    else
+        select 0''', [("login", "sysname"), ("default_database", "sysname")])
+
+
 def has_change_default_database(connection_factory, login, default_database):
     """Метод проверяет нужно ли менять базу данных по умолчанию у существующего логина
     Args:
@@ -99,28 +155,25 @@ def has_change_default_database(connection_factory, login, default_database):
     Returns:
         bool: Метод возвращает True если база данных по умолчанию будет изменена, в противном случае False
     """
-    has_change_default_database_command = '''
-                                IF %(default_database)s is not null and not exists(select name from sys.server_principals where name = %(login)s and default_database_name = %(default_database)s)
-                                    begin 
-                                        select 1
-                                    end
-                                else
-                                    begin
-                                        select 0
-                                    end'''
     changed = False
 
     if default_database:
         with connection_factory.connect() as conn:
             with conn.cursor() as cursor:
-                cursor.execute(has_change_default_database_command.format(login, default_database),
-                               dict(login=login, default_database=default_database))
+                _HAS_CHANGE_DEFAULT_DATABASE.execute(cursor, login=login, default_database=default_database)
                 row = cursor.fetchone()
                 changed = bool(row[0])
 
     return changed
 
 
+_HAS_CHANGE_DEFAULT_LANGUAGE = SqlStatement('''
+    if @default_language is not null and not exists(select name from sys.server_principals where name = @login and default_language_name = @default_language)
+        select 1
+    else
+        select 0''', [("login", "sysname"), ("default_language", "sysname")])
+
+
 def has_change_default_language(connection_factory, login, default_language):
     """Метод проверяет нужно ли менять язык по умолчанию у существующего логина
     Args:
@@ -131,67 +184,62 @@ def has_change_default_language(connection_factory, login, default_language):
     Returns:
         bool: Метод возвращает True если язык по умолчанию будет изменен, в противном случае False
     """
-
-    has_change_default_language_command = '''
-                                if %(default_language)s is not null and not exists(select name from sys.server_principals where name = %(login)s and default_language_name = %(default_language)s)
-                                    begin
-                                        select 1
-                                    end
-                                else
-                                    begin
-                                        select 0
-                                    end
-                                '''
-
     changed = False
 
     if default_language:
         with connection_factory.connect() as conn:
             with conn.cursor() as cursor:
-                cursor.execute(has_change_default_language_command.format(login, default_language),
-                               dict(login=login, default_language=default_language))
+                _HAS_CHANGE_DEFAULT_LANGUAGE.execute(cursor, login=login, default_language=default_language)
                 row = cursor.fetchone()
                 changed = bool(row[0])
 
     return changed
 
 
-def has_change_password(connection_factory, login, password):
+_HAS_CHANGE_PASSWORD = SqlStatement('''
+    if charindex(N'\\', @login) = 0 and not exists(select * from sys.server_principals sp inner join sys.sql_logins sl on sp.principal_id = sl.principal_id and sp.name = @login and pwdcompare(@password, sl.password_hash) = 1)
+        select 1
+    else
+        select 0''', [("login", "sysname"), ("password", "nvarchar(128)")])
+
+_HAS_CHANGE_PASSWORD_HASH = SqlStatement('''
+    if charindex(N'\\', @login) = 0 and not exists(select * from sys.sql_logins sl where sl.name = @login and sl.password_hash = convert(varbinary(256), @password_hash, 1))
+        select 1
+    else
+        select 0''', [("login", "sysname"), ("password_hash", "varchar(600)")])
+
+
+def has_change_password(connection_factory, login, password, password_hash=None):
     """Метод проверяет нужно ли менять базу данных по умолчанию у существующего логиа
     Args:
         connection_factory (connection_factory): Коннект к базе данных
         login (str): логин пользователя
         password (str): пароль
+        password_hash (str): хеш пароля 0x0200..., сравнивается с sys.sql_logins.password_hash
 
     Returns:
         bool: Метод возвращает True если пароль будет изменен, в противном случае False
     """
-    has_change_password_command = '''
-                                    if not exists(select * from sys.server_principals sp inner join sys.sql_logins sl on sp.principal_id = sl.principal_id and sp.name = %(login)s and pwdcompare(N'{1}', sl.password_hash) = 1)
-                                        begin
-                                            if charindex('\', '{0}') = 0
-                                                begin
-                                                    select 1
-                                                end
-                                            else
-                                                begin
-                                                    select 0
-                                                end
-                                        end
-                                    else
-                                        begin
-                                            select 0
-                                        end'''
+    if password_hash:
+        __check_password_hash(password_hash)
 
-    changed = False
+        with connection_factory.connect() as conn:
+            with conn.cursor() as cursor:
+                _HAS_CHANGE_PASSWORD_HASH.execute(cursor, login=login, password_hash=password_hash)
+                row = cursor.fetchone()
+                return bool(row[0])
+
+    if not password:
+        return False
 
     with connection_factory.connect() as conn:
         with conn.cursor() as cursor:
-            cursor.execute(has_change_password_command.format(login, password), dict(login=login, password=password))
+            _HAS_CHANGE_PASSWORD.execute(cursor, login=login, password=password)
             row = cursor.fetchone()
-            changed = bool(row[0])
+            return bool(row[0])
 
-    return changed
+
+_IS_ENABLED_LOGIN = SqlStatement("select ~is_disabled from sys.server_principals where name = @login and type in ('S', 'U', 'G')", [("login", "sysname")])
 
 
 def is_enabled_login(connection_factory, login):
@@ -204,16 +252,25 @@ def is_enabled_login(connection_factory, login):
         bool: True если логин включен, в противном случае False.
     """
 
-    is_enabled_login_command = "select ~is_disabled from sys.server_principals where name = %(login)s"
-
     with connection_factory.connect() as conn:
         with conn.cursor() as cursor:
-            cursor.execute(is_enabled_login_command, dict(login=login))
+            _IS_ENABLED_LOGIN.execute(cursor, login=login)
             row = cursor.fetchone()
             is_enabled = bool(row[0])
             return is_enabled
 
 
+_ALTER_DEFAULT_DATABASE = SqlStatement('''
+    if @default_database is not null and not exists(select name from sys.server_principals where name = @login and default_database_name = @default_database)
+        begin
+            declare @sql nvarchar(max) = N'alter login ' + quotename(@login) + N' with default_database = ' + quotename(@default_database);
+            exec sp_executesql @sql;
+            select 1;
+        end
+    else
+        select 0''', [("login", "sysname"), ("default_database", "sysname")])
+
+
 def change_default_database(connection_factory, login, default_database):
     """Метод изменяет базу данных логин по умолчанию
     Args:
@@ -224,29 +281,28 @@ def change_default_database(connection_factory, login, default_database):
     Returns:
         bool: True если была изменена база данный по умолчанию
     """
-    _alter_default_database_sql = '''
-                                if %(default_database)s is not null and not exists(select name from sys.server_principals where name = %(login)s and default_database_name = %(default_database)s)
-                                    begin
-                                        alter login [{0}] with default_database = [{1}]
-                                        select 1;
-                                    end
-                                else
-                                    begin
-                                        select 0
-                                    end'''
-
     if not default_database:
         return False
 
     with connection_factory.connect() as conn:
         with conn.cursor() as cursor:
-            cursor.execute(_alter_default_database_sql.format(login, default_database),
-                           dict(login=login, default_database=default_database))
+            _ALTER_DEFAULT_DATABASE.execute(cursor, login=login, default_database=default_database)
             row = cursor.fetchone()
             conn.commit()
             return bool(row[0])
 
 
+_ALTER_DEFAULT_LANGUAGE = SqlStatement('''
+    if @default_language is not null and not exists(select name from sys.server_principals where name = @login and default_language_name = @default_language)
+        begin
+            declare @sql nvarchar(max) = N'alter login ' + quotename(@login) + N' with default_language = ' + quotename(@default_language);
+            exec sp_executesql @sql;
+            select 1;
+        end
+    else
+        select 0''', [("login", "sysname"), ("default_language", "sysname")])
+
+
 def change_default_language(connection_factory, login, default_language):
     """Метод изменяет язык логина по умолчанию
     Args:
@@ -257,70 +313,131 @@ def change_default_language(connection_factory, login, default_language):
     Returns:
         bool: True если был изменен язык по умолчанию
     """
-    _alter_default_language_sql = '''
-                                if %(default_language)s is not null and not exists(select name from sys.server_principals where name = %(login)s and default_language_name = %(default_language)s)
-                                    begin
-                                        alter login [{0}] with default_language = [{1}]
-                                        select 1
-                                    end
-                                else
-                                    begin
-                                        select 0
-                                    end
-                                '''
-
     if not default_language:
         return False
 
     with connection_factory.connect() as conn:
         with conn.cursor() as cursor:
-            cursor.execute(_alter_default_language_sql.format(login, default_language),
-                           dict(login=login, default_language=default_language))
+            _ALTER_DEFAULT_LANGUAGE.execute(cursor, login=login, default_language=default_language)
             row = cursor.fetchone()
             conn.commit()
             return bool(row[0])
 
 
-def change_password(connection_factory, login, password):
+_ALTER_PASSWORD = SqlStatement("""
+    if charindex(N'\\', @login) = 0 and not exists(select * from sys.server_principals sp inner join sys.sql_logins sl on sp.principal_id = sl.principal_id and sp.name = @login and pwdcompare(@password, sl.password_hash) = 1)
+        begin
+            declare @sql nvarchar(max) = N'alter login ' + quotename(@login) + N' with password = N''' + replace(@password, N'''', N'''''') + N'''';
+            exec sp_executesql @sql;
+            select 1;
+        end
+    else
+        select 0""", [("login", "sysname"), ("password", "nvarchar(128)")])
+
+_ALTER_PASSWORD_HASH = SqlStatement('''
+    if charindex(N'\\', @login) = 0 and not exists(select * from sys.sql_logins sl where sl.name = @login and sl.password_hash = convert(varbinary(256), @password_hash, 1))
+        begin
+            declare @sql nvarchar(max) = N'alter login ' + quotename(@login) + N' with password = ' + @password_hash + N' hashed';
+            exec sp_executesql @sql;
+            select 1;
+        end
+    else
+        select 0''', [("login", "sysname"), ("password_hash", "varchar(600)")])
+
+def change_password(connection_factory, login, password, password_hash=None):
     """Метод изменяет пароль логина
     Args:
         connection_factory (connection_factory): Коннект к базе данных
         login (str): логин пользователя
         password (str): пароль
+        password_hash (str): хеш пароля 0x0200..., используется вместо пароля
 
     Returns:
         bool: True если был изменен пароль, в противном случае False
     """
-    _alter_password_sql = '''
-                                        if not exists(select * from sys.server_principals sp inner join sys.sql_logins sl on sp.principal_id = sl.principal_id and sp.name = %(login)s and pwdcompare(N'{1}', sl.password_hash) = 1)
-                                            begin
-                                                if charindex('\', '{0}') = 0
-                                                    begin
-                                                        alter login [{0}] with password = N'{1}';
-                                                        select 1
-                                                    end
-                                                else
-                                                    begin
-                                                        select 0
-                                                    end
-                                            end
-                                        else
-                                            begin
-                                                select 0
-                                            end
-                                            '''
+    if password_hash:
+        __check_password_hash(password_hash)
+
+        with connection_factory.connect() as conn:
+            with conn.cursor() as cursor:
+                _ALTER_PASSWORD_HASH.execute(cursor, login=login, password_hash=password_hash)
+                row = cursor.fetchone()
+                conn.commit()
+                return bool(row[0])
 
     if not password:
         return False
 
     with connection_factory.connect() as conn:
         with conn.cursor() as cursor:
-            cursor.execute(_alter_password_sql.format(login, password), dict(login=login, password=password))
+            _ALTER_PASSWORD.execute(cursor, login=login, password=password)
             row = cursor.fetchone()
             conn.commit()
             return bool(row[0])
 
 
+def get_password_hashes(connection_factory, logins, chunk_size=1000):
+    """Метод получает sys.sql_logins.password_hash одним запросом на каждые chunk_size логинов.
+    Args:
+        connection_factory (connection_factory): Коннект к базе данных
+        logins (list): логины
+        chunk_size (int): количество логинов в одном запросе
+
+    Returns:
+        NameIndex: хеш пароля (bytes) по имени логина без учета регистра, как их сравнивает сервер,
+        только для существующих sql логинов
+    """
+    result = NameIndex()
+
+    with connection_factory.connect() as conn:
+        with conn.cursor() as cursor:
+            for offset in range(0, len(logins), chunk_size):
+                cursor.execute("select name, password_hash from sys.sql_logins where name in %(logins)s",
+                               dict(logins=tuple(logins[offset:offset + chunk_size])))
+
+                for row in cursor:
+                    result.add(row[0], bytes(row[1]) if row[1] is not None else None)
+
+    return result
+
+
+def get_alter_login_statement(login, option, value):
+    """Метод формирует alter login для одной опции логина, изменения нескольких логинов выполняются одним execute_batch.
+    Пароль сюда не входит: его меняет change_password, где пароль передается только параметром.
+    Args:
+        login (str): логин
+        option (str): default_database, default_language или enabled
+        value: новое значение опции
+
+    Returns:
+        str: sql команда
+    """
+    if option == 'enabled':
+        return 'alter login {0} {1}'.format(__quote_name(login), 'enable' if value else 'disable')
+
+    if option in ('default_database', 'default_language'):
+        return 'alter login {0} with {1} = {2}'.format(__quote_name(login), option, __quote_name(value))
+
+    raise ValueError("unknown login option: {0}".format(option))
+
+
+def __check_password_hash(password_hash):
+    # хеш подставляется в текст alter/create login как есть, поэтому формат проверяется до отправки на сервер
+    if password_hash and not is_password_hash(password_hash):
+        raise ValueError("password_hash must be a hex string like 0x0200...")
+
+
+_DISABLE_OR_ENABLE_LOGIN = SqlStatement('''
+    if not exists(select name from sys.server_principals where name = @login and is_disabled = @disabled)
+        begin
+            declare @sql nvarchar(max) = N'alter login ' + quotename(@login) + case when @disabled = 1 then N' disable' else N' enable' end;
+            exec sp_executesql @sql;
+            select 1;
+        end
+    else
+        select 0''', [("login", "sysname"), ("disabled", "bit")])
+
+
 def disable_or_enable_login(connection_factory, login, enabled=True):
     """Метод изменяет пароль логина
     Args:
@@ -332,33 +449,25 @@ def disable_or_enable_login(connection_factory, login, enabled=True):
         bool: True если была включена или выключена учетная запись, в противном случае False
     """
 
-    _disable_or_enable_login_sql = '''
-                                if %(disabled)d is not null and not exists(select name from sys.server_principals where name = %(login)s and is_disabled = %(disabled)d)
-                                    begin
-                                        if %(disabled)d = 1
-                                            begin
-                                                alter login [{0}] disable;
-                                                select 1
-                                            end
-                                        else
-                                            begin
-                                                alter login [{0}] enable;
-                                                select 1
-                                            end
-                                    end
-                                else
-                                    begin
-                                        select 0
-                                    end'''
-
     with connection_factory.connect() as conn:
         with conn.cursor() as cursor:
-            cursor.execute(_disable_or_enable_login_sql.format(login), dict(login=login, disabled=not enabled))
+            _DISABLE_OR_ENABLE_LOGIN.execute(cursor, login=login, disabled=not enabled)
             row = cursor.fetchone()
             conn.commit()
             return bool(row[0])
 
 
+_DROP_LOGIN = SqlStatement('''
+    if exists(select name from sys.server_principals where name = @login and type in ('S', 'U', 'G'))
+        begin
+            declare @sql nvarchar(max) = N'drop login ' + quotename(@login);
+            exec sp_executesql @sql;
+            select 1;
+        end
+    else
+        select 0''', [("login", "sysname")])
+
+
 def drop_login(connection_factory, login):
     """Метод удаляет логин
     Args:
@@ -369,20 +478,9 @@ def drop_login(connection_factory, login):
         int: Метод возвращает количество изменений.
     """
 
-    _drop_login_sql = '''
-                    if exists(select name from sys.server_principals where name = %(login)s) 
-                        begin
-                            drop login [{0}];
-                            select 1; 
-                        end
-                    else
-                        begin
-                            select 0;
-                        end'''
-
     with connection_factory.connect() as conn:
         with conn.cursor() as cursor:
-            cursor.execute(_drop_login_sql.format(login), dict(login=login))
+            _DROP_LOGIN.execute(cursor, login=login)
             row = cursor.fetchone()
             conn.commit()
             return bool(row[0])
@@ -392,140 +490,171 @@ def drop_login(connection_factory, login):
 
 # region users
 
+_IS_DATABASE_AVAILABLE = SqlStatement("select count(*) from sys.databases where name = @database and is_read_only = 0 and [state] = 0",
+                                      [("database", "sysname")])
+
+
 def is_database_available(connection_factory, database):
     with connection_factory.connect() as conn:
         with conn.cursor() as cursor:
-            cursor.execute("select database_id from sys.databases where name = %(database)s and is_read_only = 0 and "
-                           "[state] = 0", dict(database=database))
-            return cursor.rowcount != 0
+            _IS_DATABASE_AVAILABLE.execute(cursor, database=database)
+            row = cursor.fetchone()
+            return bool(row[0])
 
 
-def has_drop_user(connection_factory, user_name, database):
-    _sql_command = '''
-    if exists(select name from sys.database_principals where name = %(user_name)s) 
-        begin 
-            select 1;
-        end
+_HAS_DROP_USER = SqlStatement('''
+    if exists(select name from sys.database_principals where name = @user_name)
+        select 1
     else
-        begin
-            select 0;
-        end
-    '''
+        select 0''', [("user_name", "sysname")])
 
+
+def has_drop_user(connection_factory, user_name, database):
     with connection_factory.connect(database=database) as conn:
         with conn.cursor() as cursor:
-            cursor.execute(_sql_command.format(user_name), dict(user_name=user_name))
+            _HAS_DROP_USER.execute(cursor, user_name=user_name)
             row = cursor.fetchone()
             return bool(row[0])
 
 
-def is_primary_hadr_replica(connection_factory, database):
-    _sql_command = '''select coalesce(sys.fn_hadr_is_primary_replica(%(database_name)s), 1)'''
+_IS_PRIMARY_HADR_REPLICA = SqlStatement("select coalesce(sys.fn_hadr_is_primary_replica(@database_name), 1)", [("database_name", "sysname")])
 
+
+def is_primary_hadr_replica(connection_factory, database):
     with connection_factory.connect(database="master") as conn:
         with conn.cursor() as cursor:
-            cursor.execute(_sql_command, dict(database_name=database))
+            _IS_PRIMARY_HADR_REPLICA.execute(cursor, database_name=database)
             row = cursor.fetchone()
             return bool(row[0])
 
 
-def is_mirror_database(connection_factory, database):
-    _sql_command = '''
-    if exists(SELECT null FROM sys.database_mirroring AS sd WHERE mirroring_guid IS NOT null and db_name(sd.[database_id]) = %(database_name)s and sd.mirroring_role=2)
-        select 1;
+_IS_MIRROR_DATABASE = SqlStatement('''
+    if exists(select null from sys.database_mirroring as sd where mirroring_guid is not null and db_name(sd.[database_id]) = @database_name and sd.mirroring_role = 2)
+        select 1
     else
-        select 0;
-    '''
+        select 0''', [("database_name", "sysname")])
 
+
+def is_mirror_database(connection_factory, database):
     with connection_factory.connect(database="master") as conn:
         with conn.cursor() as cursor:
-            cursor.execute(_sql_command, dict(database_name=database))
+            _IS_MIRROR_DATABASE.execute(cursor, database_name=database)
             row = cursor.fetchone()
             return bool(row[0])
 
 
-def drop_user(connection_factory, user_name, database):
-    _sql_command = '''
-    if exists(select name from sys.database_principals where name = %(user_name)s) 
+_GET_DATABASES_SQL = '''
+    select d.name, d.database_id, d.collation_name,
+           cast(case when d.[state] = 0 and d.is_read_only = 0 then 1 else 0 end as bit) as is_available,
+           cast(case when m.mirroring_guid is not null and m.mirroring_role = 2 then 1 else 0 end as bit) as is_mirror,
+           cast({0} as bit) as is_primary_replica
+    from sys.databases d
+        left join sys.database_mirroring m on (m.database_id = d.database_id)
+    order by d.name
+    '''
+
+_GET_DATABASES = SqlStatement(_GET_DATABASES_SQL.format("1"))
+_GET_DATABASES_WITH_REPLICAS = SqlStatement(_GET_DATABASES_SQL.format("coalesce(sys.fn_hadr_is_primary_replica(d.name), 1)"))
+
+
+def get_databases(connection_factory, capabilities=None):
+    """Метод получает все базы данных сервера и их доступность одним запросом.
+    Args:
+        connection_factory (connection_factory): Коннект к базе данных
+        capabilities (SqlCapabilities): профиль возможностей сервера
+
+    Returns:
+        list: словари name, database_id, collation_name, is_available, is_mirror, is_primary_replica
+    """
+    if capabilities is not None and capabilities.checks_primary_replica:
+        statement = _GET_DATABASES_WITH_REPLICAS
+    else:
+        statement = _GET_DATABASES
+
+    with connection_factory.connect() as conn:
+        with conn.cursor(as_dict=True) as cursor:
+            statement.execute(cursor)
+            databases = []
+            for row in cursor:
+                databases.append(dict(name=row["name"], database_id=row["database_id"], collation_name=row["collation_name"],
+                                      is_available=bool(row["is_available"]), is_mirror=bool(row["is_mirror"]),
+                                      is_primary_replica=bool(row["is_primary_replica"])))
+
+            return databases
+
+
+_DROP_USER = SqlStatement('''
+    if exists(select name from sys.database_principals where name = @user_name)
         begin
-            drop user [{0}]; 
+            declare @sql nvarchar(max) = N'drop user ' + quotename(@user_name);
+            exec sp_executesql @sql;
             select 1;
         end
     else
-        begin
-            select 0;
-        end
-    '''
+        select 0''', [("user_name", "sysname")])
+
 
+def drop_user(connection_factory, user_name, database):
     with connection_factory.connect(database=database) as conn:
         with conn.cursor() as cursor:
-            cursor.execute(_sql_command.format(user_name), dict(user_name=user_name))
+            _DROP_USER.execute(cursor, user_name=user_name)
             row = cursor.fetchone()
             conn.commit()
             return bool(row[0])
 
 
-def has_create_user(connection_factory, user_name, login, database):
-    _sql_command = '''
-                        if not exists(select name from sys.database_principals where name = %(user_name)s) 
-                            begin 
-                                select 1;
-                            end
-                        else
-                            begin
-                                if not exists (select 1 from sys.database_principals sdp inner join sys.server_principals ssp on ssp.sid = sdp.sid and ssp.name = %(user_name)s and sdp.name = %(user_name)s)
-                                    begin
-                                        select 1
-                                    end
-                                else
-                                    begin
-                                        select 0;
-                                    end
-                        end'''
+_HAS_CREATE_USER = SqlStatement('''
+    if not exists(select name from sys.database_principals where name = @user_name)
+        select 1
+    else if not exists(select 1 from sys.database_principals sdp inner join sys.server_principals ssp on ssp.sid = sdp.sid and ssp.name = @login and sdp.name = @user_name)
+        select 1
+    else
+        select 0''', [("user_name", "sysname"), ("login", "sysname")])
 
+
+def has_create_user(connection_factory, user_name, login, database):
     with connection_factory.connect(database=database) as conn:
         with conn.cursor() as cursor:
-            cursor.execute(_sql_command.format(user_name, login), dict(user_name=user_name))
+            _HAS_CREATE_USER.execute(cursor, user_name=user_name, login=login)
             row = cursor.fetchone()
-            conn.commit()
             return bool(row[0])
 
 
-def create_user(connection_factory, user_name, login, database):
-    _sql_command = '''
-                        if not exists(select name from sys.database_principals where name = %(user_name)s) 
-                            begin 
-                                create user [{0}] for login [{1}];
-                                select 1;
-                            end
-                        else
-                            begin
-                                if not exists (select 1 from sys.database_principals sdp inner join sys.server_principals ssp on ssp.sid = sdp.sid and ssp.name = %(user_name)s and sdp.name = %(user_name)s)
-                                    begin
-                                        alter user [{0}] with login = [{1}];
-                                        select 1
-                                    end
-                                else
-                                    begin
-                                        select 0;
-                                    end
-                        end'''
+_CREATE_USER = SqlStatement('''
+    declare @sql nvarchar(max);
 
+    if not exists(select name from sys.database_principals where name = @user_name)
+        begin
+            set @sql = N'create user ' + quotename(@user_name) + N' for login ' + quotename(@login);
+            exec sp_executesql @sql;
+            select 1;
+        end
+    else if not exists(select 1 from sys.database_principals sdp inner join sys.server_principals ssp on ssp.sid = sdp.sid and ssp.name = @login and sdp.name = @user_name)
+        begin
+            set @sql = N'alter user ' + quotename(@user_name) + N' with login = ' + quotename(@login);
+            exec sp_executesql @sql;
+            select 1;
+        end
+    else
+        select 0''', [("user_name", "sysname"), ("login", "sysname")])
+
+
+def create_user(connection_factory, user_name, login, database):
     with connection_factory.connect(database=database) as conn:
         with conn.cursor() as cursor:
-            cursor.execute(_sql_command.format(user_name, login), dict(user_name=user_name))
+            _CREATE_USER.execute(cursor, user_name=user_name, login=login)
             row = cursor.fetchone()
             conn.commit()
             return bool(row[0])
 
 
+_GET_AVAILABLE_ROLES = SqlStatement("select rl.name as [database_role] from sys.database_principals as rl where (rl.type = 'R') order by [database_role] asc")
+
+
 def get_available_roles(connection_factory, database='master'):
-    _sql_command = '''
-    SELECT rl.name AS [database_role] FROM sys.database_principals AS rl WHERE (rl.type = 'R') ORDER BY [database_role] ASC
-    '''
     with connection_factory.connect(database=database) as conn:
         with conn.cursor(as_dict=True) as cursor:
-            cursor.execute(_sql_command)
+            _GET_AVAILABLE_ROLES.execute(cursor)
             roles = []
             for row in cursor:
                 role = row["database_role"]
@@ -534,16 +663,47 @@ def get_available_roles(connection_factory, database='master'):
             return roles
 
 
-def get_user_roles(connection_factory, user_name, database):
-    _sql_command = '''
+_GET_DATABASE_USERS_SQL = '''
+    select dp.name as user_name, sp.name as login_name from sys.database_principals dp
+        left join sys.server_principals sp on (sp.sid = dp.sid)
+    where dp.type in ('S', 'U', 'G'){0}'''
+
+_GET_DATABASE_USERS = SqlStatement(_GET_DATABASE_USERS_SQL.format(""))
+
+
+def get_database_users(connection_factory, database, user_names=None, chunk_size=1000):
+    """Метод получает пользователей базы данных и их логины одним запросом.
+    Args:
+        connection_factory (connection_factory): Коннект к базе данных
+        database (str): база данных
+        user_names (list): только эти пользователи, по запросу на каждые chunk_size имен; None - все пользователи
+        chunk_size (int): количество имен в одном запросе
+
+    Returns:
+        dict: имя логина (None для сирот) по имени пользователя
+    """
+    with connection_factory.connect(database=database) as conn:
+        with conn.cursor(as_dict=True) as cursor:
+            if user_names is None:
+                _GET_DATABASE_USERS.execute(cursor)
+                rows = cursor
+            else:
+                rows = __select_by_names(cursor, _GET_DATABASE_USERS_SQL.format(" and dp.name in %(names)s"), user_names, chunk_size)
+
+            return dict((row["user_name"], row["login_name"]) for row in rows)
+
+
+_GET_USER_ROLES = SqlStatement('''
     select rp.name as database_role from sys.database_role_members drm
         inner join sys.database_principals rp on (drm.role_principal_id = rp.principal_id)
         inner join sys.database_principals mp on (drm.member_principal_id = mp.principal_id)
-    where mp.name = %(user_name)s
-    '''
+    where mp.name = @user_name''', [("user_name", "sysname")])
+
+
+def get_user_roles(connection_factory, user_name, database):
     with connection_factory.connect(database=database) as conn:
         with conn.cursor(as_dict=True) as cursor:
-            cursor.execute(_sql_command, dict(user_name=user_name))
+            _GET_USER_ROLES.execute(cursor, user_name=user_name)
             roles = []
             for row in cursor:
                 role = row["database_role"]
@@ -552,28 +712,90 @@ def get_user_roles(connection_factory, user_name, database):
             return roles
 
 
-def add_user_role(connection_factory, user_name, role_name, database, sql_server_version=12):
-    if sql_server_version in [12, 14]:
-        _sql_command = "alter role [{0}] add member [{1}]"
+_GET_USERS_ROLES_SQL = '''
+    select mp.name as user_name, rp.name as database_roles from sys.database_role_members drm
+        inner join sys.database_principals rp on (drm.role_principal_id = rp.principal_id)
+        inner join sys.database_principals mp on (drm.member_principal_id = mp.principal_id){0}'''
+
+_GET_USERS_ROLES_STRING_AGG_SQL = '''
+    select mp.name as user_name, string_agg(cast(rp.name as nvarchar(max)), nchar(31)) as database_roles from sys.database_role_members drm
+        inner join sys.database_principals rp on (drm.role_principal_id = rp.principal_id)
+        inner join sys.database_principals mp on (drm.member_principal_id = mp.principal_id){0}
+    group by mp.name'''
+
+_GET_USERS_ROLES = SqlStatement(_GET_USERS_ROLES_SQL.format(""))
+_GET_USERS_ROLES_STRING_AGG = SqlStatement(_GET_USERS_ROLES_STRING_AGG_SQL.format(""))
+
+
+def get_users_roles(connection_factory, database, capabilities=None, collation=None, user_names=None, chunk_size=1000):
+    """Метод получает роли пользователей базы данных одним запросом.
+    Args:
+        connection_factory (connection_factory): Коннект к базе данных
+        database (str): база данных
+        capabilities (SqlCapabilities): профиль возможностей сервера
+        collation (str): collation базы данных, по нему имена пользователей сравниваются так же, как в get_user_roles
+        user_names (list): только эти пользователи, по запросу на каждые chunk_size имен; None - все пользователи
+        chunk_size (int): количество имен в одном запросе
+
+    Returns:
+        NameIndex: список ролей по имени пользователя
+    """
+    string_agg = capabilities is not None and capabilities.supports_string_agg
+
+    with connection_factory.connect(database=database) as conn:
+        with conn.cursor(as_dict=True) as cursor:
+            if user_names is None:
+                (_GET_USERS_ROLES_STRING_AGG if string_agg else _GET_USERS_ROLES).execute(cursor)
+                rows = cursor
+            else:
+                sql = _GET_USERS_ROLES_STRING_AGG_SQL if string_agg else _GET_USERS_ROLES_SQL
+                rows = __select_by_names(cursor, sql.format("\n    where mp.name in %(names)s"), user_names, chunk_size)
+
+            users_roles = NameIndex(collation=collation)
+            for row in rows:
+                roles = users_roles.get(row["user_name"], [])
+                roles.extend(row["database_roles"].split(u"\u001f"))
+                users_roles.add(row["user_name"], roles)
+
+            return users_roles
+
+
+_ALTER_ROLE_ADD_MEMBER = SqlStatement('''
+    declare @sql nvarchar(max) = N'alter role ' + quotename(@role_name) + N' add member ' + quotename(@user_name);
+    exec sp_executesql @sql''', [("role_name", "sysname"), ("user_name", "sysname")])
+
+_SP_ADDROLEMEMBER = SqlStatement("exec sp_addrolemember @role_name, @user_name", [("role_name", "sysname"), ("user_name", "sysname")])
+
+
+def add_user_role(connection_factory, user_name, role_name, database, capabilities=None):
+    if capabilities is None or capabilities.supports_alter_role_membership:
+        statement = _ALTER_ROLE_ADD_MEMBER
     else:
-        _sql_command = "exec sp_addrolemember %(role_name)s, %(user_name)s"
+        statement = _SP_ADDROLEMEMBER
 
     with connection_factory.connect(database=database) as conn:
         with conn.cursor() as cursor:
-            cursor.execute(_sql_command.format(role_name, user_name), dict(role_name=role_name, user_name=user_name))
+            statement.execute(cursor, role_name=role_name, user_name=user_name)
             conn.commit()
             return True
 
 
-def remove_user_role(connection_factory, user_name, role_name, database, sql_server_version=12):
-    if sql_server_version in [12, 14]:
-        _sql_command = "alter role [{0}] drop member [{1}]"
+_ALTER_ROLE_DROP_MEMBER = SqlStatement('''
+    declare @sql nvarchar(max) = N'alter role ' + quotename(@role_name) + N' drop member ' + quotename(@user_name);
+    exec sp_executesql @sql''', [("role_name", "sysname"), ("user_name", "sysname")])
+
+_SP_DROPROLEMEMBER = SqlStatement("exec sp_droprolemember @role_name, @user_name", [("role_name", "sysname"), ("user_name", "sysname")])
+
+
+def remove_user_role(connection_factory, user_name, role_name, database, capabilities=None):
+    if capabilities is None or capabilities.supports_alter_role_membership:
+        statement = _ALTER_ROLE_DROP_MEMBER
     else:
-        _sql_command = "exec sp_droprolemember %(role_name)s, %(user_name)s"
+        statement = _SP_DROPROLEMEMBER
 
     with connection_factory.connect(database=database) as conn:
         with conn.cursor() as cursor:
-            cursor.execute(_sql_command.format(role_name, user_name), dict(role_name=role_name, user_name=user_name))
+            statement.execute(cursor, role_name=role_name, user_name=user_name)
             conn.commit()
             return True
 
@@ -586,23 +808,116 @@ def has_sync_user_roles(connection_factory, user_name, roles, database):
     return len(deleted) > 0 or len(add)
 
 
-def sync_user_roles(connection_factory, user_name, roles, database, sql_server_version=10):
+def sync_user_roles(connection_factory, user_name, roles, database, capabilities=None):
     current_user_roles = get_user_roles(connection_factory, user_name, database)
     deleted = set(current_user_roles) - set(roles)
     add = set(roles) - set(current_user_roles)
     changed = False
 
     for role in deleted:
-        if remove_user_role(connection_factory, user_name, role, database, sql_server_version):
+        if remove_user_role(connection_factory, user_name, role, database, capabilities):
             changed = True
 
     for role in add:
-        if add_user_role(connection_factory, user_name, role, database, sql_server_version):
+        if add_user_role(connection_factory, user_name, role, database, capabilities):
             changed = True
 
     return changed
 
 
+# #desired создается в той же сессии, что и сравнение, collate database_default - имена сравниваются
+# по правилам сортировки базы данных, а не tempdb
+_CREATE_DESIRED_ROLES = '''
+    if object_id('tempdb..#desired_roles') is not null drop table #desired_roles;
+    create table #desired_roles (user_name sysname collate database_default not null, role_name sysname collate database_default null);'''
+
+_SYNC_ROLE_MEMBERS = SqlStatement('''
+    set nocount on;
+    set xact_abort off;
+
+    create table #delta (id int identity(1, 1) primary key, action varchar(6) not null,
+                         user_name sysname collate database_default not null, role_name sysname collate database_default not null, error nvarchar(4000) null);
+
+    insert into #delta (action, user_name, role_name)
+    select 'remove', mp.name, rp.name from sys.database_role_members drm
+        inner join sys.database_principals rp on (drm.role_principal_id = rp.principal_id)
+        inner join sys.database_principals mp on (drm.member_principal_id = mp.principal_id)
+    where exists(select * from #desired_roles d where d.user_name = mp.name)
+      and not exists(select * from #desired_roles d where d.user_name = mp.name and d.role_name = rp.name)
+    order by mp.name, rp.name;
+
+    insert into #delta (action, user_name, role_name)
+    select distinct 'add', d.user_name, d.role_name from #desired_roles d
+    where d.role_name is not null
+      and not exists(select * from sys.database_role_members drm
+                         inner join sys.database_principals rp on (drm.role_principal_id = rp.principal_id)
+                         inner join sys.database_principals mp on (drm.member_principal_id = mp.principal_id)
+                     where mp.name = d.user_name and rp.name = d.role_name);
+
+    if @apply = 1
+        begin
+            declare @id int = 0, @action varchar(6), @user_name sysname, @role_name sysname, @sql nvarchar(max);
+
+            while 1 = 1
+                begin
+                    select top (1) @id = id, @action = action, @user_name = user_name, @role_name = role_name from #delta where id > @id order by id;
+                    if @@rowcount = 0 break;
+
+                    begin try
+                        if @alter_role = 1
+                            begin
+                                set @sql = N'alter role ' + quotename(@role_name) + case @action when 'add' then N' add member ' else N' drop member ' end + quotename(@user_name);
+                                exec sp_executesql @sql;
+                            end
+                        else if @action = 'add'
+                            exec sp_addrolemember @role_name, @user_name;
+                        else
+                            exec sp_droprolemember @role_name, @user_name;
+                    end try
+                    begin catch
+                        update #delta set error = error_message() where id = @id;
+                    end catch
+                end
+        end
+
+    drop table #desired_roles;
+
+    select action, user_name, role_name, error from #delta order by id;''', [("apply", "bit"), ("alter_role", "bit")])
+
+
+def sync_role_members(connection_factory, database, memberships, apply=False, capabilities=None, chunk_size=1000):
+    """Метод загружает желаемое членство в ролях во временную таблицу и вычисляет разницу с
+    sys.database_role_members на сервере одним запросом, при apply там же применяет ее.
+    Args:
+        connection_factory (connection_factory): Коннект к базе данных
+        database (str): база данных
+        memberships (list): пары (user_name, role_name), role_name None - у пользователя не должно быть ролей
+        apply (bool): выполнить изменения, иначе только вернуть разницу
+        capabilities (SqlCapabilities): профиль возможностей сервера
+        chunk_size (int): количество строк в одном insert
+
+    Returns:
+        list: словари action (add, remove), user_name, role_name, error для каждого изменения
+
+    Роли удаляются только у пользователей из memberships, остальные пользователи базы не затрагиваются.
+    """
+    alter_role = capabilities is None or capabilities.supports_alter_role_membership
+
+    with connection_factory.connect(database=database) as conn:
+        with conn.cursor(as_dict=True) as cursor:
+            cursor.execute(_CREATE_DESIRED_ROLES)
+
+            for offset in range(0, len(memberships), chunk_size):
+                chunk = memberships[offset:offset + chunk_size]
+                cursor.execute("insert into #desired_roles (user_name, role_name) values " + ", ".join(["(%s, %s)"] * len(chunk)),
+                               tuple(value for membership in chunk for value in membership))
+
+            _SYNC_ROLE_MEMBERS.execute(cursor, apply=bool(apply), alter_role=alter_role)
+            delta = [dict(action=row["action"], user_name=row["user_name"], role_name=row["role_name"], error=row["error"]) for row in cursor]
+            conn.commit()
+            return delta
+
+
 def create_db_executor_role(connection_factory, database):
     _sql_command = '''
     begin tran
@@ -630,3 +945,242 @@ def create_db_executor_role(connection_factory, database):
 
 
 # endregion
+
+# region permissions
+
+def get_database_permissions(connection_factory, database, user_names=None, chunk_size=1000):
+    """Метод получает явные права пользователей базы данных на базу, схемы и объекты одним запросом.
+    Args:
+        connection_factory (connection_factory): Коннект к базе данных
+        database (str): база данных
+        user_names (list): только эти пользователи, по запросу на каждые chunk_size имен; None - все пользователи
+        chunk_size (int): количество имен в одном запросе
+
+    Returns:
+        dict: множество (securable_class, securable, permission, state) по имени пользователя, securable в виде
+        format_name (dbo.[my.proc]), state - grant, grant_with_grant_option или deny
+    """
+    _sql_command = '''
+    select pr.name as principal_name,
+           case dp.class when 0 then 'DATABASE' when 3 then 'SCHEMA' else 'OBJECT' end as securable_class,
+           case dp.class when 3 then s.name else os.name end as schema_name,
+           o.name as object_name,
+           dp.permission_name,
+           case dp.state when 'D' then 'deny' when 'W' then 'grant_with_grant_option' else 'grant' end as permission_state
+    from sys.database_permissions dp
+        inner join sys.database_principals pr on (pr.principal_id = dp.grantee_principal_id)
+        left join sys.schemas s on (dp.class = 3 and s.schema_id = dp.major_id)
+        left join sys.objects o on (dp.class = 1 and o.object_id = dp.major_id)
+        left join sys.schemas os on (os.schema_id = o.schema_id)
+    where dp.class in (0, 1, 3) and dp.minor_id = 0 and dp.state in ('G', 'W', 'D')
+      and not (dp.class = 0 and dp.permission_name = 'CONNECT')
+    '''
+
+    with connection_factory.connect(database=database) as conn:
+        with conn.cursor(as_dict=True) as cursor:
+            if user_names is None:
+                cursor.execute(_sql_command)
+                rows = cursor
+            else:
+                rows = __select_by_names(cursor, _sql_command + "  and pr.name in %(names)s", user_names, chunk_size)
+
+            permissions = {}
+            for row in rows:
+                if row["securable_class"] == 'DATABASE':
+                    securable = None
+                elif row["securable_class"] == 'SCHEMA':
+                    securable = format_name([row["schema_name"]])
+                else:
+                    securable = format_name([row["schema_name"], row["object_name"]])
+
+                permissions.setdefault(row["principal_name"], set()).add(
+                    (row["securable_class"], securable, row["permission_name"], row["permission_state"]))
+
+            return permissions
+
+
+def get_permission_statement(action, securable_class, securable, permission, user_name):
+    """Метод формирует grant/deny/revoke для права пользователя.
+    Args:
+        action (str): grant, deny, revoke или revoke_grant_option (отзывает только with grant option)
+        securable_class (str): DATABASE, SCHEMA или OBJECT
+        securable (str): имя схемы или объекта (schema.object, части с точками в [])
+        permission (str): право
+        user_name (str): пользователь базы данных
+
+    Returns:
+        str: sql команда
+    """
+    if securable_class == 'DATABASE':
+        on = ''
+    elif securable_class == 'SCHEMA':
+        on = ' on schema::{0}'.format(".".join(__quote_name(part) for part in split_name(securable)))
+    else:
+        on = ' on object::{0}'.format(".".join(__quote_name(part) for part in split_name(securable)))
+
+    if action == 'revoke':
+        return 'revoke {0}{1} from {2} cascade'.format(permission, on, __quote_name(user_name))
+
+    if action == 'revoke_grant_option':
+        return 'revoke grant option for {0}{1} from {2} cascade'.format(permission, on, __quote_name(user_name))
+
+    return '{0} {1}{2} to {3}'.format(action, permission, on, __quote_name(user_name))
+
+
+def execute_batch(connection_factory, database, statements):
+    """Метод выполняет команды одним пакетом, каждая в своем try/catch.
+    Args:
+        connection_factory (connection_factory): Коннект к базе данных
+        database (str): база данных
+        statements (list): sql команды
+
+    Returns:
+        list: текст ошибки или None для каждой команды, в порядке команд
+    """
+    if not statements:
+        return []
+
+    sql = ["set xact_abort off;", "declare @results table (id int not null, error nvarchar(4000) null);"]
+
+    for i, statement in enumerate(statements):
+        sql.append("begin try {1}; insert into @results values ({0}, null); end try "
+                   "begin catch insert into @results values ({0}, error_message()); end catch;".format(i, statement))
+
+    sql.append("select id, error from @results order by id;")
+
+    with connection_factory.connect(database=database) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("\n".join(sql))
+            errors = [None] * len(statements)
+            for row in cursor.fetchall():
+                errors[row[0]] = row[1]
+            conn.commit()
+            return errors
+
+
+def __select_by_names(cursor, sql, names, chunk_size=1000):
+    # фильтр in %(names)s выполняется по запросу на каждые chunk_size имен, как в get_logins
+    names = list(names)
+    rows = []
+
+    for offset in range(0, len(names), chunk_size):
+        cursor.execute(sql, dict(names=tuple(names[offset:offset + chunk_size])))
+        rows.extend(cursor)
+
+    return rows
+
+
+def __quote_name(name):
+    return "[{0}]".format(name.replace("]", "]]"))
+
+# endregion
+
+# region orphaned users
+
+def get_orphaned_users(connection_factory, database, capabilities=None):
+    """Метод получает пользователей базы данных, sid которых нет среди логинов сервера.
+    Args:
+        connection_factory (connection_factory): Коннект к базе данных
+        database (str): база данных
+        capabilities (SqlCapabilities): профиль возможностей сервера
+
+    Returns:
+        list: словари user_name и login_name (логин с таким же именем, если он есть)
+    """
+    if capabilities is not None and capabilities.major_version >= 11:
+        # 1 - INSTANCE, 3 - WINDOWS; contained пользователи и пользователи без логина не сироты
+        user_filter = "dp.authentication_type in (1, 3)"
+    else:
+        user_filter = "(dp.type in ('U', 'G') or datalength(dp.sid) = 16)"
+
+    _sql_command = '''
+    select dp.name as user_name, sp.name as login_name
+    from sys.database_principals dp
+        left join sys.server_principals sp on (sp.name = dp.name collate database_default and sp.type in ('S', 'U', 'G'))
+    where dp.type in ('S', 'U', 'G') and dp.principal_id > 4 and dp.sid is not null and {0}
+      and not exists (select null from sys.server_principals ssp where ssp.sid = dp.sid)
+    order by dp.name
+    '''.format(user_filter)
+
+    with connection_factory.connect(database=database) as conn:
+        with conn.cursor(as_dict=True) as cursor:
+            cursor.execute(_sql_command)
+            return [dict(user_name=row["user_name"], login_name=row["login_name"]) for row in cursor]
+
+
+def get_remap_user_statement(user_name, login):
+    return "alter user {0} with login = {1}".format(__quote_name(user_name), __quote_name(login))
+
+
+def get_drop_user_statement(user_name):
+    return "drop user {0}".format(__quote_name(user_name))
+
+# endregion
+
+# region changes
+
+_GET_SERVER_PRINCIPALS_MARKER = SqlStatement('''
+    select max(modify_date) as modify_date, count(*) as principals
+    from sys.server_principals where type in ('S', 'U', 'G')''')
+
+
+def get_server_principals_marker(connection_factory):
+    """Метод получает дешевый признак изменения логинов: последнюю дату изменения и количество.
+    Args:
+        connection_factory (connection_factory): Коннект к базе данных
+
+    Returns:
+        tuple: (modify_date, principals)
+    """
+    with connection_factory.connect() as conn:
+        with conn.cursor() as cursor:
+            _GET_SERVER_PRINCIPALS_MARKER.execute(cursor)
+            row = cursor.fetchone()
+            return row[0], row[1]
+
+
+_GET_CHANGED_LOGINS = SqlStatement('''
+    select name from sys.server_principals where type in ('S', 'U', 'G') and modify_date > @since''', [("since", "datetime")])
+
+
+def get_changed_logins(connection_factory, since):
+    with connection_factory.connect() as conn:
+        with conn.cursor() as cursor:
+            _GET_CHANGED_LOGINS.execute(cursor, since=since)
+            return [row[0] for row in cursor]
+
+
+_GET_DATABASE_PRINCIPALS_MARKER = SqlStatement('''
+    select (select max(modify_date) from sys.database_principals) as modify_date,
+           (select count(*) from sys.database_principals) as principals,
+           (select checksum_agg(checksum(role_principal_id, member_principal_id)) from sys.database_role_members) as members,
+           (select checksum_agg(checksum(class, major_id, grantee_principal_id, permission_name, state)) from sys.database_permissions) as permissions''')
+
+
+def get_database_principals_marker(connection_factory, database):
+    """Метод получает дешевый признак изменения пользователей, членства в ролях и прав базы данных.
+    Args:
+        connection_factory (connection_factory): Коннект к базе данных
+        database (str): база данных
+
+    Returns:
+        tuple: (modify_date, principals, members, permissions)
+    """
+    with connection_factory.connect(database=database) as conn:
+        with conn.cursor() as cursor:
+            _GET_DATABASE_PRINCIPALS_MARKER.execute(cursor)
+            row = cursor.fetchone()
+            return row[0], row[1], row[2], row[3]
+
+
+_GET_CHANGED_PRINCIPALS = SqlStatement('''
+    select name from sys.database_principals where modify_date > @since''', [("since", "datetime")])
+
+
+def get_changed_principals(connection_factory, database, since):
+    with connection_factory.connect(database=database) as conn:
+        with conn.cursor() as cursor:
+            _GET_CHANGED_PRINCIPALS.execute(cursor, since=since)
+            return [row[0] for row in cursor]
+
+# endregion
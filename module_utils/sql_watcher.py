@@ -0,0 +1,184 @@
+import fnmatch
+import time
+import ansible.module_utils.sql_utils as sql_utils
+import ansible.module_utils.sql_processor as sql_processor
+from ansible.module_utils.sql_names import NameIndex
+from ansible.module_utils.sql_objects import SqlDatabase, SqlLogin, SqlUser
+from ansible.module_utils.sql_results import ResultSink, SqlRecord, STATUS_INFO, STATUS_ERROR
+
+
+class DriftWatcher(object):
+
+    def __init__(self, connection_factory, sql_logins, capabilities, check_mode=False, workers=1, sink=None):
+        """Constructor
+        :param connection_factory: фабрика соединений, для долгой работы - ConnectionPool
+        :param sql_logins: список SqlLogin, желаемое состояние
+        :param capabilities: профиль возможностей sql server
+        :param check_mode: только проверить изменения
+        :param workers: количество потоков для обработки баз данных
+        :param sink: приемник записей о результатах
+
+        После полной синхронизации хранит снимок дешевых признаков изменений: дату последнего изменения
+        и количество логинов сервера, а для каждой базы данных - дату последнего изменения и количество
+        пользователей и контрольные суммы членства в ролях и прав. При опросе синхронизируются заново
+        только логины и пользователи, признаки которых изменились.
+        """
+        self.connection_factory = connection_factory
+        self.sql_logins = dict((sql_login.login, sql_login) for sql_login in sql_logins)
+        self.capabilities = capabilities
+        self.check_mode = check_mode
+        self.workers = workers
+        self.sink = sink or ResultSink()
+        self.logins = NameIndex(self.sql_logins)
+        self.polls = 0
+        self.__server_marker = None
+        self.__database_markers = {}
+        self.__entries = {}
+        self.__collations = {}
+
+    def reconcile(self):
+        """Полная синхронизация желаемого состояния и снимок признаков изменений."""
+        sql_processor.apply_sql_logins(self.connection_factory, list(self.sql_logins.values()), self.capabilities,
+                                       self.check_mode, self.workers, self.sink)
+        self.snapshot()
+
+    def snapshot(self):
+        self.__server_marker = sql_utils.get_server_principals_marker(self.connection_factory)
+        self.__entries, self.__collations = self.__get_entries()
+        self.__database_markers = {}
+
+        for database_name in self.__entries:
+            self.__database_markers[database_name] = sql_utils.get_database_principals_marker(self.connection_factory, database_name)
+
+    def poll(self):
+        """Метод проверяет признаки изменений и синхронизирует только изменившиеся логины и пользователей.
+
+        Returns:
+            dict: логины, которые были синхронизированы заново, и базы данных (None - логин целиком)
+        """
+        self.polls += 1
+        changes = {}
+
+        try:
+            self.__get_server_changes(changes)
+            self.__get_database_changes(changes)
+        except Exception as e:
+            self.sink.emit(SqlRecord(STATUS_ERROR, 'watch', message='ERROR OCCURRED WHILE POLL CHANGES: {0}'.format(str(e))))
+            return {}
+
+        if not changes:
+            return changes
+
+        sql_logins = [self.__get_partial_login(login, databases) for login, databases in sorted(changes.items())]
+
+        self.sink.emit(SqlRecord(STATUS_INFO, 'watch', details=dict(logins=sorted(changes)[:100]),
+                                 message='DRIFT DETECTED: {0} LOGINS'.format(len(changes))))
+
+        sql_processor.apply_sql_logins(self.connection_factory, sql_logins, self.capabilities, self.check_mode, self.workers, self.sink)
+        self.snapshot()
+
+        return changes
+
+    def run(self, interval=60, iterations=None, sleep=time.sleep):
+        """Метод синхронизирует все и затем опрашивает изменения каждые interval секунд.
+        Args:
+            interval (int): пауза между опросами в секундах
+            iterations (int): количество опросов, None - бесконечно
+            sleep (callable): функция паузы
+        """
+        self.reconcile()
+
+        while iterations is None or self.polls < iterations:
+            sleep(interval)
+            self.poll()
+
+    def __get_server_changes(self, changes):
+        marker = sql_utils.get_server_principals_marker(self.connection_factory)
+
+        if marker == self.__server_marker:
+            return
+
+        since, count = self.__server_marker
+
+        if since is not None:
+            for name in sql_utils.get_changed_logins(self.connection_factory, since):
+                login = self.logins.name(name)
+                if login is not None:
+                    changes[login] = None
+
+        if marker[1] != count:
+            # удаленный логин не оставляет следа в sys.server_principals, поэтому проверяем наличие всех логинов
+            exists = NameIndex(sql_utils.logins_exists(self.connection_factory, list(self.sql_logins)))
+
+            for login, sql_login in self.sql_logins.items():
+                if (sql_login.state == 'present') != (login in exists):
+                    changes[login] = None
+
+    def __get_database_changes(self, changes):
+        entries, collations = self.__get_entries()
+
+        for database_name, database_entries in entries.items():
+            previous = self.__database_markers.get(database_name)
+
+            if previous is None:
+                # новая база данных, например подходящая под шаблон
+                affected = database_entries
+            else:
+                marker = sql_utils.get_database_principals_marker(self.connection_factory, database_name)
+
+                if marker == previous:
+                    continue
+
+                if marker[1:] != previous[1:] or previous[0] is None:
+                    affected = database_entries
+                else:
+                    names = NameIndex(sql_utils.get_changed_principals(self.connection_factory, database_name, previous[0]), collations[database_name])
+                    affected = [entry for entry in database_entries if entry[1] in names]
+
+            for login, user_name, database in affected:
+                if login in changes and changes[login] is None:
+                    continue
+
+                changes.setdefault(login, {}).setdefault(database_name, []).append((user_name, database))
+
+    def __get_entries(self):
+        databases = [database for database in sql_utils.get_databases(self.connection_factory, self.capabilities)
+                     if database['is_available'] and not database['is_mirror'] and database['is_primary_replica']]
+        by_lower_name = dict((database['name'].lower(), database) for database in databases)
+        entries = {}
+
+        for login, sql_login in self.sql_logins.items():
+            if sql_login.state != 'present':
+                continue
+
+            for user in sql_login.users:
+                for database in user.databases:
+                    if not database.is_pattern:
+                        info = by_lower_name.get(database.name.lower())
+                        if info is not None:
+                            entries.setdefault(info['name'], []).append((login, user.name, database))
+                        continue
+
+                    for info in databases:
+                        if info['database_id'] > 4 and fnmatch.fnmatchcase(info['name'].lower(), database.name.lower()):
+                            entries.setdefault(info['name'], []).append(
+                                (login, user.name, SqlDatabase(info['name'], database.state, database.roles, database.permissions)))
+
+        collations = dict((name, by_lower_name[name.lower()]['collation_name']) for name in entries)
+
+        return entries, collations
+
+    def __get_partial_login(self, login, databases):
+        sql_login = self.sql_logins[login]
+
+        if databases is None:
+            return sql_login
+
+        users = {}
+        for database_name, user_entries in databases.items():
+            for user_name, database in user_entries:
+                users.setdefault(user_name, []).append(database)
+
+        return SqlLogin(sql_login.login, sql_login.sid, sql_login.password, sql_login.default_database, sql_login.default_language,
+                        sql_login.enabled, sql_login.state, [SqlUser(user_name, user_databases) for user_name, user_databases in sorted(users.items())],
+                        sql_login.password_hash)
@@ -0,0 +1,9 @@
+import os
+
+import ansible.module_utils
+
+# модули роли импортируются как ansible.module_utils.*, как их видит ansible при запуске модуля
+ROLE_MODULE_UTILS = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "module_utils")
+
+if ROLE_MODULE_UTILS not in ansible.module_utils.__path__:
+    ansible.module_utils.__path__.append(ROLE_MODULE_UTILS)
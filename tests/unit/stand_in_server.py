@@ -0,0 +1,145 @@
+import datetime
+
+import ansible.module_utils.sql_utils as sql_utils
+from ansible.module_utils.sql_names import NameIndex
+
+EPOCH = datetime.datetime(2020, 1, 1)
+
+
+class StandInError(Exception):
+    pass
+
+
+class StandInServer(object):
+
+    def __init__(self):
+        """Локальная замена sql server для DriftWatcher: фабрика соединений, которая отвечает на запросы признаков
+        изменений и каталога (sys.server_principals, sys.databases, sys.database_principals) из состояния в памяти.
+
+        Состояние меняется методами touch_login, drop_login, touch_user, add_member, grant, add_database,
+        каждое изменение сдвигает modify_date как на настоящем сервере. Неизвестный запрос - ошибка,
+        поэтому тест видит, какие запросы делает опрос.
+        """
+        self.logins = {}
+        self.databases = {}
+        self.queries = []
+        self.failing = set()
+        self.__clock = 0
+        self.__handlers = {
+            sql_utils._GET_SERVER_PRINCIPALS_MARKER.batch: ('server_marker', self.__server_marker),
+            sql_utils._GET_CHANGED_LOGINS.batch: ('changed_logins', self.__changed_logins),
+            sql_utils._GET_DATABASES.batch: ('databases', self.__get_databases),
+            sql_utils._GET_DATABASE_PRINCIPALS_MARKER.batch: ('database_marker', self.__database_marker),
+            sql_utils._GET_CHANGED_PRINCIPALS.batch: ('changed_principals', self.__changed_principals),
+        }
+
+    def add_database(self, name, collation="SQL_Latin1_General_CP1_CI_AS", database_id=None):
+        self.databases[name] = dict(database_id=database_id or len(self.databases) + 5, collation=collation, principals={}, members=set(), permissions=set())
+
+    def touch_login(self, name):
+        self.logins[name] = self.__tick()
+
+    def drop_login(self, name):
+        del self.logins[name]
+
+    def touch_user(self, database, name):
+        self.databases[database]['principals'][name] = self.__tick()
+
+    def add_member(self, database, user_name, role):
+        # членство в роли не меняет modify_date пользователя, меняется только контрольная сумма
+        self.databases[database]['members'].add((role, user_name))
+
+    def grant(self, database, user_name, permission):
+        self.databases[database]['permissions'].add((user_name, permission))
+
+    def connect(self, database=None):
+        return _Connection(self, database or "master")
+
+    def execute(self, database, sql, params):
+        if sql.startswith("SELECT name FROM master.sys.syslogins"):
+            name, handler = 'logins_exists', self.__logins_exists
+        elif sql in self.__handlers:
+            name, handler = self.__handlers[sql]
+        else:
+            raise StandInError("unexpected query: {0}".format(sql))
+
+        self.queries.append((name, database))
+
+        if name in self.failing:
+            raise StandInError("{0} failed".format(name))
+
+        return handler(database, params or {})
+
+    def __tick(self):
+        self.__clock += 1
+        return EPOCH + datetime.timedelta(seconds=self.__clock)
+
+    def __server_marker(self, database, params):
+        return [(max(self.logins.values()) if self.logins else None, len(self.logins))]
+
+    def __changed_logins(self, database, params):
+        return [(name,) for name, modify_date in sorted(self.logins.items()) if modify_date > params['since']]
+
+    def __logins_exists(self, database, params):
+        # syslogins сравнивает имена по collation сервера, по умолчанию без учета регистра
+        names = NameIndex(params['logins'])
+        return [dict(name=name) for name in sorted(self.logins) if name in names]
+
+    def __get_databases(self, database, params):
+        return [dict(name=name, database_id=info['database_id'], collation_name=info['collation'], is_available=1, is_mirror=0, is_primary_replica=1)
+                for name, info in sorted(self.databases.items())]
+
+    def __database_marker(self, database, params):
+        info = self.databases[database]
+        principals = info['principals']
+        return [(max(principals.values()) if principals else None, len(principals),
+                 hash(frozenset(info['members'])), hash(frozenset(info['permissions'])))]
+
+    def __changed_principals(self, database, params):
+        return [(name,) for name, modify_date in sorted(self.databases[database]['principals'].items()) if modify_date > params['since']]
+
+
+class _Connection(object):
+
+    def __init__(self, server, database):
+        self.server = server
+        self.database = database
+
+    def cursor(self, as_dict=False):
+        return _Cursor(self.server, self.database)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class _Cursor(object):
+
+    def __init__(self, server, database):
+        self.server = server
+        self.database = database
+        self.rows = []
+
+    def execute(self, sql, params=None):
+        self.rows = list(self.server.execute(self.database, sql, params))
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def __iter__(self):
+        rows, self.rows = self.rows, []
+        return iter(rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
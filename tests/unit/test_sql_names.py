@@ -0,0 +1,109 @@
+import pytest
+
+from ansible.module_utils.sql_names import NameIndex, parse_collation, split_name, format_name
+
+
+@pytest.mark.parametrize("collation, expected", [
+    (None, (False, True)),
+    ("", (False, True)),
+    ("SQL_Latin1_General_CP1_CI_AS", (False, True)),
+    ("Latin1_General_CS_AS", (True, True)),
+    ("Latin1_General_CI_AI", (False, False)),
+    ("Latin1_General_CS_AI", (True, False)),
+    ("Cyrillic_General_100_CI_AS_KS_WS", (False, True)),
+    ("Latin1_General_100_CI_AS_SC_UTF8", (False, True)),
+    ("Latin1_General_BIN", (True, True)),
+    ("Latin1_General_BIN2", (True, True)),
+    ("latin1_general_cs_as", (True, True)),
+])
+def test_parse_collation(collation, expected):
+    assert parse_collation(collation) == expected
+
+
+def test_default_collation_ignores_case_but_not_accents():
+    index = NameIndex(["Report", u"Café"])
+
+    assert "REPORT" in index
+    assert u"CAFÉ" in index
+    assert "Cafe" not in index
+    assert index.name("report") == "Report"
+
+
+def test_case_sensitive_collation():
+    index = NameIndex(["Report"], "Latin1_General_CS_AS")
+
+    assert "Report" in index
+    assert "report" not in index
+    assert index.name("REPORT") is None
+
+
+def test_accent_insensitive_collation_folds_accents():
+    index = NameIndex([u"Café", u"Ёлка"], "Cyrillic_General_CI_AI")
+
+    assert "cafe" in index
+    assert u"CAFE" in index
+    assert u"ЕЛКА" in index
+    assert index.key(u"Crème") == index.key("CREME")
+
+
+def test_case_sensitive_accent_insensitive_collation():
+    index = NameIndex([u"Café"], "Latin1_General_CS_AI")
+
+    assert "Cafe" in index
+    assert "cafe" not in index
+
+
+@pytest.mark.parametrize("collation", ["Latin1_General_BIN", "Latin1_General_BIN2"])
+def test_binary_collation_compares_exactly(collation):
+    index = NameIndex([u"Café"], collation)
+
+    assert u"Café" in index
+    assert "Cafe" not in index
+    assert u"café" not in index
+
+
+def test_first_spelling_is_kept_and_last_value_wins():
+    index = NameIndex()
+    index.add("App", 1)
+    index.add("APP", 2)
+
+    assert len(index) == 1
+    assert list(index) == ["App"]
+    assert index.name("app") == "App"
+    assert index.get("app") == 2
+    assert index.get("other", "default") == "default"
+
+
+def test_difference_uses_index_collation():
+    assert NameIndex(["db_owner", "Reader"]).difference(["READER"]) == ["db_owner"]
+    assert sorted(NameIndex(["db_owner", "Reader"], "Latin1_General_BIN").difference(["READER"])) == ["Reader", "db_owner"]
+
+
+@pytest.mark.parametrize("name, parts", [
+    ("dbo", ["dbo"]),
+    ("dbo.proc", ["dbo", "proc"]),
+    (" dbo . proc ", ["dbo", "proc"]),
+    ("[dbo].[report.v1]", ["dbo", "report.v1"]),
+    ('"my.schema"."a""b"', ["my.schema", 'a"b']),
+    ("[a]]b].c", ["a]b", "c"]),
+    ("dbo.[ spaced ]", ["dbo", " spaced "]),
+])
+def test_split_name(name, parts):
+    assert split_name(name) == parts
+
+
+@pytest.mark.parametrize("name", ["[dbo", "dbo..proc", "dbo.", "[dbo]x.proc"])
+def test_split_name_rejects_malformed_names(name):
+    with pytest.raises(ValueError):
+        split_name(name)
+
+
+@pytest.mark.parametrize("parts, name", [
+    (["dbo", "proc"], "dbo.proc"),
+    (["dbo", "report.v1"], "dbo.[report.v1]"),
+    (["a]b"], "[a]]b]"),
+    (["dbo", " spaced "], "dbo.[ spaced ]"),
+])
+def test_format_name_round_trips(parts, name):
+    assert format_name(parts) == name
+    assert split_name(name) == parts
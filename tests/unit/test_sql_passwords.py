@@ -0,0 +1,95 @@
+import pytest
+
+import ansible.module_utils.sql_passwords as sql_passwords
+from ansible.module_utils.sql_names import NameIndex
+from ansible.module_utils.sql_objects import SqlLogin
+
+# хеши пароля P@ssw0rd с солью 0A1B2C3D в формате sys.sql_logins.password_hash:
+# версия + соль + SHA-512 (2012+) или SHA-1 (2005/2008) от UTF-16LE(пароль) + соль
+SHA512_HASH = ("0x02000A1B2C3DF006540526141EDFFA00D7D0FF2A0B814D381CC5D8442CF15E7F03A50684C6BFE796B49D564D7C1948A967B2"
+               "E1EBB650B68869F83CF000EF54E91E1BEA0FD65A")
+SHA1_HASH = "0x01000A1B2C3DB8CA80A0E7827D6A19B5CCB842DD72741EA10BEF"
+
+
+def test_hash_password_round_trip():
+    password_hash = sql_passwords.hash_password(u"Пароль'1")
+
+    assert sql_passwords.is_password_hash(password_hash)
+    assert sql_passwords.verify_password(u"Пароль'1", sql_passwords.to_bytes(password_hash)) is True
+    assert sql_passwords.verify_password(u"пароль'1", sql_passwords.to_bytes(password_hash)) is False
+
+
+def test_hash_password_uses_random_salt():
+    assert sql_passwords.hash_password("secret") != sql_passwords.hash_password("secret")
+
+
+def test_hash_password_with_salt_matches_known_hash():
+    assert sql_passwords.hash_password("P@ssw0rd", bytes(bytearray([0x0A, 0x1B, 0x2C, 0x3D]))) == SHA512_HASH
+
+
+@pytest.mark.parametrize("password_hash", [SHA512_HASH, SHA1_HASH])
+def test_verify_known_hash(password_hash):
+    assert sql_passwords.verify_password("P@ssw0rd", sql_passwords.to_bytes(password_hash)) is True
+    assert sql_passwords.verify_password("p@ssw0rd", sql_passwords.to_bytes(password_hash)) is False
+    assert sql_passwords.verify_password("P@ssw0rd ", sql_passwords.to_bytes(password_hash)) is False
+
+
+def test_verify_sha1_hash_with_uppercase_digest():
+    # в хешах sql server 2000 за основным SHA-1 идет SHA-1 пароля в верхнем регистре, он не сравнивается
+    password_hash = sql_passwords.to_bytes(SHA1_HASH) + b"\x00" * 20
+
+    assert sql_passwords.verify_password("P@ssw0rd", password_hash) is True
+
+
+@pytest.mark.parametrize("password_hash", [None, b"", b"\x02\x00\x0a", b"\x03\x00\x0a\x1b\x2c\x3d" + b"\x00" * 64])
+def test_verify_unknown_or_short_hash(password_hash):
+    assert sql_passwords.verify_password("P@ssw0rd", password_hash) is None
+
+
+def test_verify_truncated_digest_does_not_match():
+    assert sql_passwords.verify_password("P@ssw0rd", sql_passwords.to_bytes(SHA512_HASH)[:-1]) is False
+
+
+@pytest.mark.parametrize("value, expected", [
+    (SHA512_HASH, True),
+    (SHA1_HASH, True),
+    ("0x0200ABC", False),
+    ("0x0300" + "00" * 68, False),
+    ("02000A1B" + "00" * 68, False),
+    ("", False),
+    (None, False),
+])
+def test_is_password_hash(value, expected):
+    assert sql_passwords.is_password_hash(value) is expected
+
+
+def get_password_hashes(**hashes):
+    index = NameIndex()
+
+    for name, password_hash in hashes.items():
+        index.add(name, sql_passwords.to_bytes(password_hash))
+
+    return index
+
+
+def test_find_password_changes_matches_logins_case_insensitively():
+    sql_logins = [SqlLogin("app", password="P@ssw0rd"), SqlLogin("REPORT", password="new"), SqlLogin("etl", password="P@ssw0rd")]
+
+    changes = sql_passwords.find_password_changes(sql_logins, get_password_hashes(App=SHA512_HASH, report=SHA1_HASH))
+
+    assert changes == set(["REPORT"])
+
+
+def test_find_password_changes_compares_password_hash_as_is():
+    sql_logins = [SqlLogin("same", password_hash=SHA512_HASH), SqlLogin("other", password_hash=sql_passwords.hash_password("P@ssw0rd"))]
+
+    changes = sql_passwords.find_password_changes(sql_logins, get_password_hashes(same=SHA512_HASH, other=SHA512_HASH))
+
+    assert changes == set(["other"])
+
+
+def test_find_password_changes_treats_unknown_hash_format_as_changed():
+    password_hashes = NameIndex()
+    password_hashes.add("app", b"\x03\x00" + b"\x00" * 68)
+
+    assert sql_passwords.find_password_changes([SqlLogin("app", password="P@ssw0rd")], password_hashes) == set(["app"])
@@ -0,0 +1,160 @@
+import contextlib
+
+import pytest
+
+import ansible.module_utils.sql_processor as sql_processor
+import ansible.module_utils.sql_utils as sql_utils
+from ansible.module_utils.sql_objects import SqlLogin, SqlPermission
+from ansible.module_utils.sql_results import ResultSink
+from ansible.module_utils.sql_scheduler import Scheduler
+
+
+class Controller(object):
+    """Логины сервера и второй контроллер, который успевает изменить логин, пока этот ждет блокировку."""
+
+    def __init__(self, monkeypatch, logins):
+        self.logins = logins
+        self.calls = []
+        self.locked = False
+        self.on_lock = None
+
+        monkeypatch.setattr(sql_utils, "get_logins", self.get_logins)
+        monkeypatch.setattr(sql_utils, "create_login", self.create_login)
+        monkeypatch.setattr(sql_utils, "execute_batch", self.execute_batch)
+
+    def get_logins(self, connection_factory, names):
+        self.calls.append(("get_logins", self.locked))
+        return dict((name, dict(state)) for name, state in self.logins.items() if name in names)
+
+    def create_login(self, connection_factory, login, *args):
+        self.calls.append(("create_login", self.locked))
+        self.logins[login] = dict(is_disabled=False, default_database="master", default_language="us_english")
+        return True
+
+    def execute_batch(self, connection_factory, database, statements):
+        self.calls.append(("execute_batch", self.locked, list(statements)))
+        return [None] * len(statements)
+
+    @contextlib.contextmanager
+    def lock(self, database, resource, login=None):
+        if self.on_lock is not None:
+            self.on_lock()
+        self.locked = True
+        try:
+            yield
+        finally:
+            self.locked = False
+
+
+@pytest.fixture
+def controller(monkeypatch):
+    return Controller(monkeypatch, {})
+
+
+def test_without_locks_logins_are_read_once_before_the_graph(controller):
+    controller.logins["app"] = dict(is_disabled=True, default_database="master", default_language="us_english")
+
+    sql_processor.apply_sql_logins(None, [SqlLogin("app", enabled=True)], None, False, sink=ResultSink())
+
+    assert controller.calls == [("get_logins", False), ("execute_batch", False, ["alter login [app] enable"])]
+
+
+def test_locked_login_is_not_created_when_another_controller_created_it(controller):
+    def create_by_other_controller():
+        controller.logins["app"] = dict(is_disabled=False, default_database="master", default_language="us_english")
+
+    controller.on_lock = create_by_other_controller
+    sink = ResultSink()
+
+    sql_processor.apply_sql_logins(None, [SqlLogin("app", enabled=True)], None, False, sink=sink, locks=controller)
+
+    assert controller.calls == [("get_logins", True)]
+    assert not sink.failed
+    assert not sink.changed
+
+
+def test_locked_login_alters_state_read_under_the_lock(controller):
+    controller.logins["app"] = dict(is_disabled=False, default_database="master", default_language="us_english")
+
+    def disable_by_other_controller():
+        controller.logins["app"]["is_disabled"] = True
+
+    controller.on_lock = disable_by_other_controller
+
+    sql_processor.apply_sql_logins(None, [SqlLogin("app", enabled=True)], None, False, sink=ResultSink(), locks=controller)
+
+    assert controller.calls == [("get_logins", True), ("execute_batch", True, ["alter login [app] enable"])]
+
+
+def get_permission_delta(permissions, current_permissions, collation=None):
+    return getattr(sql_processor, "__get_permission_delta")(SqlPermission.parse(permissions), set(current_permissions), collation)
+
+
+def test_permission_delta_grants_missing_and_revokes_extra():
+    statements = get_permission_delta({"DATABASE": {"grant": ["select"]}, "SCHEMA::dbo": {"deny": ["delete"]}},
+                                      [("DATABASE", None, "SELECT", "grant"), ("OBJECT", "dbo.proc", "EXECUTE", "grant")])
+
+    assert statements == [("deny", "SCHEMA", "dbo", "DELETE"), ("revoke", "OBJECT", "dbo.proc", "EXECUTE")]
+
+
+def test_permission_delta_is_empty_when_state_matches():
+    assert get_permission_delta({"OBJECT::proc": {"grant": ["execute"]}}, [("OBJECT", "dbo.proc", "EXECUTE", "grant")]) == []
+
+
+def test_permission_delta_changes_grant_to_deny():
+    statements = get_permission_delta({"DATABASE": {"deny": ["select"]}}, [("DATABASE", None, "SELECT", "grant")])
+
+    assert statements == [("deny", "DATABASE", None, "SELECT")]
+
+
+def test_permission_delta_revokes_only_the_grant_option():
+    statements = get_permission_delta({"SCHEMA::dbo": {"grant": ["select"]}}, [("SCHEMA", "dbo", "SELECT", "grant_with_grant_option")])
+
+    assert statements == [("revoke_grant_option", "SCHEMA", "dbo", "SELECT")]
+
+
+def test_permission_delta_revokes_unlisted_grant_with_grant_option():
+    statements = get_permission_delta({}, [("SCHEMA", "dbo", "SELECT", "grant_with_grant_option")])
+
+    assert statements == [("revoke", "SCHEMA", "dbo", "SELECT")]
+
+
+def test_permission_delta_matches_securables_by_collation_and_uses_catalog_spelling():
+    current = [("SCHEMA", "Sales", "SELECT", "grant")]
+
+    assert get_permission_delta({"SCHEMA::SALES": {"grant": ["select"]}}, current) == []
+    assert get_permission_delta({"SCHEMA::SALES": {"deny": ["select"]}}, current) == [("deny", "SCHEMA", "Sales", "SELECT")]
+    assert get_permission_delta({"SCHEMA::SALES": {"grant": ["select"]}}, current, "Latin1_General_CS_AS") == \
+        [("grant", "SCHEMA", "SALES", "SELECT"), ("revoke", "SCHEMA", "Sales", "SELECT")]
+
+
+def test_permission_delta_matches_bracketed_object_names():
+    current = [("OBJECT", "dbo.[report.v1]", "SELECT", "grant")]
+
+    assert get_permission_delta({"OBJECT::[dbo].[report.v1]": {"grant": ["select"]}}, current) == []
+    assert get_permission_delta({"OBJECT::[report.v1]": {"grant": ["select"]}}, current) == []
+
+
+def test_duplicate_logins_are_rejected_case_insensitively(controller):
+    with pytest.raises(ValueError, match="duplicate logins: App"):
+        sql_processor.apply_sql_logins(None, [SqlLogin("App"), SqlLogin("report"), SqlLogin("app")], None, False, sink=ResultSink())
+
+    assert controller.calls == []
+
+
+def test_skipped_nodes_are_reported_with_root_cause():
+    scheduler = Scheduler()
+    scheduler.add(("login", "app"), lambda: False)
+    scheduler.add(("user", "shop", "app", "app_user"), lambda: None, [("login", "app")])
+    scheduler.add(("roles", "shop"), lambda: None, [("user", "shop", "app", "app_user")])
+    scheduler.run()
+    sink = ResultSink()
+
+    getattr(sql_processor, "__report_skipped")(scheduler, sink)
+
+    records = sorted(sink.summary()["sample"]["warning"], key=lambda record: record["message"])
+    assert [(record["operation"], record.get("principal"), record["details"]["cause"]) for record in records] == [
+        ("skipped", None, "LOGIN: app"),
+        ("skipped", "app_user", "LOGIN: app"),
+    ]
+    assert records[1]["message"] == "[DB: shop; USER: app_user] - SKIPPED: LOGIN: app FAILED"
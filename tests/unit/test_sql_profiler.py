@@ -0,0 +1,37 @@
+import pstats
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from ansible.module_utils.sql_profiler import Profiler
+
+
+def worker_function(count):
+    return sum(range(count))
+
+
+def test_worker_thread_stats_are_merged(tmp_path):
+    path = str(tmp_path / "run.prof")
+
+    with Profiler(path) as profiler:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(worker_function, [1000] * 8))
+
+    assert results == [499500] * 8
+
+    calls = dict((function_name, stat[1]) for (_, _, function_name), stat in pstats.Stats(path).stats.items())
+    assert calls["worker_function"] == 8
+
+    if sys.version_info < (3, 12):
+        assert profiler.summary["threads"] > 1
+    else:
+        assert profiler.summary["threads"] is None
+
+
+def test_disabled_profiler_writes_nothing(tmp_path, monkeypatch):
+    monkeypatch.delenv("MSSQL_USERS_PROFILE", raising=False)
+
+    with Profiler() as profiler:
+        worker_function(10)
+
+    assert profiler.summary is None
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,113 @@
+import threading
+
+import pytest
+
+from ansible.module_utils.sql_scheduler import Scheduler, DONE, FAILED, SKIPPED
+
+
+class Nodes(object):
+    """Фиктивные операции: записывают порядок вызова и возвращают заданный результат."""
+
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def node(self, key, result=None, error=None):
+        def call():
+            with self.lock:
+                self.calls.append(key)
+            if error is not None:
+                raise error
+            return result
+
+        return call
+
+
+@pytest.fixture(params=[1, 4], ids=["serial", "parallel"])
+def workers(request):
+    return request.param
+
+
+def test_nodes_run_after_their_dependencies(workers):
+    nodes = Nodes()
+    scheduler = Scheduler(workers)
+    scheduler.add("login", nodes.node("login"))
+    scheduler.add("user_shop", nodes.node("user_shop"), ["login"])
+    scheduler.add("user_crm", nodes.node("user_crm"), ["login"])
+    scheduler.add("roles", nodes.node("roles"), ["user_shop", "user_crm"])
+
+    status = scheduler.run()
+
+    assert status == dict(login=DONE, user_shop=DONE, user_crm=DONE, roles=DONE)
+    assert nodes.calls[0] == "login"
+    assert nodes.calls[-1] == "roles"
+    assert sorted(nodes.calls[1:3]) == ["user_crm", "user_shop"]
+
+
+def test_failed_node_skips_all_descendants(workers):
+    nodes = Nodes()
+    scheduler = Scheduler(workers)
+    scheduler.add("login", nodes.node("login", result=False))
+    scheduler.add("user", nodes.node("user"), ["login"])
+    scheduler.add("roles", nodes.node("roles"), ["user"])
+    scheduler.add("other", nodes.node("other"))
+
+    status = scheduler.run()
+
+    assert status == dict(login=FAILED, user=SKIPPED, roles=SKIPPED, other=DONE)
+    assert sorted(nodes.calls) == ["login", "other"]
+    assert scheduler.causes == dict(user="login", roles="user")
+    assert scheduler.get_root_cause("roles") == "login"
+    assert scheduler.get_root_cause("other") == "other"
+
+
+def test_always_node_runs_after_failed_dependency(workers):
+    nodes = Nodes()
+    scheduler = Scheduler(workers)
+    scheduler.add("user", nodes.node("user", result=False))
+    scheduler.add("checkpoint", nodes.node("checkpoint"), ["user"], always=True)
+    scheduler.add("after_checkpoint", nodes.node("after_checkpoint"), ["checkpoint"])
+
+    status = scheduler.run()
+
+    assert status == dict(user=FAILED, checkpoint=DONE, after_checkpoint=DONE)
+    assert nodes.calls == ["user", "checkpoint", "after_checkpoint"]
+
+
+def test_exception_fails_node_and_is_raised_after_the_run(workers):
+    nodes = Nodes()
+    scheduler = Scheduler(workers)
+    scheduler.add("login", nodes.node("login", error=RuntimeError("boom")))
+    scheduler.add("user", nodes.node("user"), ["login"])
+    scheduler.add("other", nodes.node("other"))
+
+    with pytest.raises(RuntimeError, match="boom"):
+        scheduler.run()
+
+    assert scheduler.status == dict(login=FAILED, user=SKIPPED, other=DONE)
+
+
+def test_unknown_dependency_is_rejected():
+    scheduler = Scheduler()
+
+    with pytest.raises(ValueError, match="depends on unknown node"):
+        scheduler.add("user", lambda: None, ["login"])
+
+
+def test_duplicate_node_is_rejected():
+    scheduler = Scheduler()
+    scheduler.add("login", lambda: None)
+
+    with pytest.raises(ValueError, match="already added"):
+        scheduler.add("login", lambda: None)
+
+
+def test_cycle_cannot_be_built():
+    # зависимость должна быть добавлена раньше узла, поэтому граф всегда ацикличен
+    scheduler = Scheduler()
+    scheduler.add("a", lambda: None)
+
+    with pytest.raises(ValueError, match="depends on unknown node"):
+        scheduler.add("b", lambda: None, ["a", "b"])
+
+    assert scheduler.run() == dict(a=DONE)
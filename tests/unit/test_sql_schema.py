@@ -0,0 +1,100 @@
+import pytest
+
+import ansible.module_utils.sql_schema as sql_schema
+
+
+def validate(data, strict=False):
+    return sql_schema.validate(data, "sources/app.json", strict)
+
+
+def test_valid_source_has_no_errors():
+    data = {"app": {"password": "secret", "enabled": True, "users": {"app_user": {"databases": {
+        "shop": {"roles": ["db_datareader"], "permissions": {"SCHEMA::dbo": {"grant": ["select"]}}}}}}}}
+
+    normalized, errors, warnings = validate(data)
+
+    assert errors == []
+    assert warnings == []
+    assert normalized == data
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("false", False), ("False", False), ("no", False), ("off", False), ("0", False), (0, False), (False, False),
+    ("true", True), (" YES ", True), ("on", True), ("1", True), (1, True), (True, True),
+])
+def test_enabled_is_coerced_to_boolean(value, expected):
+    normalized, errors, _ = validate({"app": {"enabled": value}})
+
+    assert errors == []
+    assert normalized["app"]["enabled"] is expected
+
+
+@pytest.mark.parametrize("value", ["maybe", 2, None, []])
+def test_enabled_rejects_other_values(value):
+    _, errors, _ = validate({"app": {"enabled": value}})
+
+    assert len(errors) == 1
+    assert errors[0].startswith('FILE: sources/app.json, PATH: $["app"].enabled: must be a boolean')
+
+
+def test_state_is_case_insensitive():
+    normalized, errors, _ = validate({"app": {"state": "Absent", "users": {"u": {"databases": {"shop": {"state": "PRESENT"}}}}}})
+
+    assert errors == []
+    assert normalized["app"]["state"] == "absent"
+    assert normalized["app"]["users"]["u"]["databases"]["shop"]["state"] == "present"
+
+
+def test_errors_carry_json_path():
+    _, errors, _ = validate({"app": {"users": {"app_user": {"databases": {"shop": {"state": "gone", "roles": "db_owner"}}}}}})
+
+    assert sorted(errors) == [
+        'FILE: sources/app.json, PATH: $["app"].users["app_user"].databases["shop"].roles: must be a list, got str',
+        'FILE: sources/app.json, PATH: $["app"].users["app_user"].databases["shop"].state: must be one of: present, absent, got "gone"',
+    ]
+
+
+def test_null_role_is_rejected():
+    _, errors, _ = validate({"app": {"users": {"u": {"databases": {"shop": {"roles": ["db_datareader", None]}}}}}})
+
+    assert errors == ['FILE: sources/app.json, PATH: $["app"].users["u"].databases["shop"].roles[1]: must be a string, got null']
+
+
+def test_null_optional_string_is_allowed():
+    _, errors, _ = validate({"app": {"default_database": None}})
+
+    assert errors == []
+
+
+def test_unknown_field_is_a_warning_by_default():
+    normalized, errors, warnings = validate({"app": {"enable": False}})
+
+    assert errors == []
+    assert len(warnings) == 1
+    assert warnings[0].startswith('FILE: sources/app.json, PATH: $["app"].enable: unknown field, expected one of: ')
+    assert normalized["app"]["enable"] is False
+
+
+def test_unknown_field_is_an_error_in_strict_mode():
+    _, errors, warnings = validate({"app": {"enable": False}}, strict=True)
+
+    assert warnings == []
+    assert len(errors) == 1
+    assert "unknown field" in errors[0]
+
+
+def test_permission_checks_securable_and_name():
+    _, errors, _ = validate({"app": {"users": {"u": {"databases": {"shop": {"permissions": {
+        "TABLE::dbo.t": {"grant": ["select"]}, "DATABASE": {"grant": ["select;drop"], "deny": [None]}}}}}}}})
+
+    assert sorted(error.split(": ", 3)[3] for error in errors) == [
+        "must be a string, got null",
+        "permission must contain only letters and spaces",
+        "securable must be DATABASE, SCHEMA::name or OBJECT::schema.name",
+    ]
+
+
+def test_empty_login_name_is_rejected():
+    _, errors, _ = validate({" ": {}})
+
+    assert errors == ['FILE: sources/app.json, PATH: $[" "]: name cannot be empty']
@@ -0,0 +1,118 @@
+import json
+import os
+import stat
+
+import pytest
+
+import ansible.module_utils.sql_state as sql_state
+from ansible.module_utils.sql_objects import SqlDatabase, SqlLogin, SqlUser
+
+
+def get_logins(**overrides):
+    sql_logins = dict(
+        app=SqlLogin("app", password="secret", users=[SqlUser("app_user", [SqlDatabase("shop", roles=["db_datareader"])])]),
+        report=SqlLogin("report", password="secret"),
+        etl=SqlLogin("etl", enabled=False))
+    sql_logins.update(overrides)
+
+    return dict((login, sql_login) for login, sql_login in sql_logins.items() if sql_login is not None)
+
+
+@pytest.fixture
+def state_path(tmp_path):
+    return str(tmp_path / "state" / "sql_logins.state")
+
+
+def apply(state_path, sql_logins, now, **options):
+    """Один запуск роли: delta, файл .pending и commit после успешного применения."""
+    delta = sql_state.get_delta(sql_state.load_state(state_path), sql_logins, now=now, **options)
+    sql_state.write_pending(state_path, delta, now=now)
+    assert sql_state.commit(state_path)
+    return delta
+
+
+def test_missing_state_forces_full_sync(state_path):
+    delta = sql_state.get_delta(sql_state.load_state(state_path), get_logins(), now=100)
+
+    assert delta["full_sync"] is True
+    assert delta["added"] == ["app", "etl", "report"]
+    assert delta["changed"] == [] and delta["removed"] == [] and delta["unchanged"] == 0
+
+
+def test_delta_reports_added_changed_removed_and_unchanged(state_path):
+    apply(state_path, get_logins(), now=100)
+
+    sql_logins = get_logins(report=SqlLogin("report", password="rotated"), etl=None, new=SqlLogin("new"))
+    delta = sql_state.get_delta(sql_state.load_state(state_path), sql_logins, now=200)
+
+    assert delta["full_sync"] is False
+    assert delta["added"] == ["new"]
+    assert delta["changed"] == ["report"]
+    assert delta["removed"] == ["etl"]
+    assert delta["unchanged"] == 1
+
+
+def test_nested_change_changes_fingerprint(state_path):
+    apply(state_path, get_logins(), now=100)
+
+    app = SqlLogin("app", password="secret", users=[SqlUser("app_user", [SqlDatabase("shop", roles=["db_datareader", "db_datawriter"])])])
+    delta = sql_state.get_delta(sql_state.load_state(state_path), get_logins(app=app), now=200)
+
+    assert delta["changed"] == ["app"]
+
+
+def test_fingerprint_is_stable_for_equal_logins():
+    assert sql_state.fingerprint(get_logins()["app"]) == sql_state.fingerprint(get_logins()["app"])
+    assert sql_state.fingerprint(SqlLogin("app", enabled=True)) != sql_state.fingerprint(SqlLogin("app", enabled=False))
+
+
+def test_pending_state_takes_effect_only_after_commit(state_path):
+    apply(state_path, get_logins(), now=100)
+
+    changed = get_logins(report=SqlLogin("report", password="rotated"))
+    delta = sql_state.get_delta(sql_state.load_state(state_path), changed, now=200)
+    pending_path = sql_state.write_pending(state_path, delta, now=200)
+
+    assert pending_path == state_path + sql_state.PENDING_SUFFIX
+    assert stat.S_IMODE(os.stat(pending_path).st_mode) == 0o600
+
+    # применение упало и commit не выполнен: следующий запуск снова видит изменение
+    assert sql_state.get_delta(sql_state.load_state(state_path), changed, now=300)["changed"] == ["report"]
+
+    assert sql_state.commit(state_path)
+    assert not os.path.exists(pending_path)
+    assert sql_state.get_delta(sql_state.load_state(state_path), changed, now=300)["changed"] == []
+
+
+def test_commit_without_pending_state_changes_nothing(state_path):
+    assert sql_state.commit(state_path) is False
+    assert not os.path.exists(state_path)
+
+
+def test_full_sync_after_interval(state_path):
+    apply(state_path, get_logins(), now=100)
+
+    assert sql_state.get_delta(sql_state.load_state(state_path), get_logins(), full_sync_interval=3600, now=3699)["full_sync"] is False
+    assert sql_state.get_delta(sql_state.load_state(state_path), get_logins(), full_sync_interval=3600, now=3700)["full_sync"] is True
+
+
+def test_incremental_run_keeps_last_full_sync_time(state_path):
+    apply(state_path, get_logins(), now=100)
+    apply(state_path, get_logins(new=SqlLogin("new")), now=200)
+
+    with open(state_path) as read_file:
+        assert json.load(read_file)["full_sync_at"] == 100
+
+    apply(state_path, get_logins(), now=300, full_sync=True)
+
+    with open(state_path) as read_file:
+        assert json.load(read_file)["full_sync_at"] == 300
+
+
+def test_forced_full_sync_still_reports_delta(state_path):
+    apply(state_path, get_logins(), now=100)
+
+    delta = sql_state.get_delta(sql_state.load_state(state_path), get_logins(), full_sync=True, now=200)
+
+    assert delta["full_sync"] is True
+    assert delta["unchanged"] == 3
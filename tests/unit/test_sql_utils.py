@@ -0,0 +1,62 @@
+import pytest
+
+import ansible.module_utils.sql_utils as sql_utils
+
+
+@pytest.mark.parametrize("action, securable_class, securable, expected", [
+    ("grant", "DATABASE", None, "grant SELECT to [app]"),
+    ("deny", "SCHEMA", "dbo", "deny SELECT on schema::[dbo] to [app]"),
+    ("grant", "SCHEMA", "[my]]schema]", "grant SELECT on schema::[my]]schema] to [app]"),
+    ("grant", "OBJECT", "dbo.proc", "grant SELECT on object::[dbo].[proc] to [app]"),
+    ("grant", "OBJECT", "dbo.[report.v1]", "grant SELECT on object::[dbo].[report.v1] to [app]"),
+    ("grant", "OBJECT", "[my.schema].[a]]b]", "grant SELECT on object::[my.schema].[a]]b] to [app]"),
+    ("revoke", "OBJECT", "dbo.proc", "revoke SELECT on object::[dbo].[proc] from [app] cascade"),
+    ("revoke_grant_option", "SCHEMA", "dbo", "revoke grant option for SELECT on schema::[dbo] from [app] cascade"),
+])
+def test_permission_statement(action, securable_class, securable, expected):
+    assert sql_utils.get_permission_statement(action, securable_class, securable, "SELECT", "app") == expected
+
+
+def test_permission_statement_quotes_user_name():
+    assert sql_utils.get_permission_statement("grant", "DATABASE", None, "SELECT", "a]b") == "grant SELECT to [a]]b]"
+
+
+class PermissionsServer(object):
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def connect(self, database=None):
+        return self
+
+    def cursor(self, as_dict=False):
+        return self
+
+    def execute(self, sql, params=None):
+        self.sql = sql
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+def test_database_permissions_keep_grant_option_and_quote_dotted_names():
+    rows = [
+        dict(principal_name="app", securable_class="DATABASE", schema_name=None, object_name=None, permission_name="SELECT", permission_state="grant"),
+        dict(principal_name="app", securable_class="SCHEMA", schema_name="dbo", object_name=None, permission_name="SELECT",
+             permission_state="grant_with_grant_option"),
+        dict(principal_name="app", securable_class="OBJECT", schema_name="dbo", object_name="report.v1", permission_name="SELECT", permission_state="deny"),
+    ]
+    server = PermissionsServer(rows)
+
+    assert sql_utils.get_database_permissions(server, "shop") == {"app": set([
+        ("DATABASE", None, "SELECT", "grant"),
+        ("SCHEMA", "dbo", "SELECT", "grant_with_grant_option"),
+        ("OBJECT", "dbo.[report.v1]", "SELECT", "deny"),
+    ])}
+    assert "when 'W' then 'grant_with_grant_option'" in server.sql
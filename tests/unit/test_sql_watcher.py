@@ -0,0 +1,123 @@
+import pytest
+
+import ansible.module_utils.sql_processor as sql_processor
+from ansible.module_utils.sql_objects import SqlDatabase, SqlLogin, SqlUser
+from ansible.module_utils.sql_results import ResultSink
+from ansible.module_utils.sql_watcher import DriftWatcher
+
+from stand_in_server import StandInServer
+
+
+@pytest.fixture
+def server():
+    server = StandInServer()
+    server.add_database("shop")
+    server.add_database("crm")
+
+    for login in ("app", "report"):
+        server.touch_login(login)
+
+    server.touch_user("shop", "app_user")
+    server.touch_user("crm", "app_user")
+    server.touch_user("crm", "Report_User")
+
+    return server
+
+
+@pytest.fixture
+def applied(monkeypatch):
+    calls = []
+
+    def apply_sql_logins(connection_factory, sql_logins, capabilities, check_mode, workers=1, sink=None, *args):
+        calls.append(sql_logins)
+
+    monkeypatch.setattr(sql_processor, "apply_sql_logins", apply_sql_logins)
+
+    return calls
+
+
+@pytest.fixture
+def watcher(server, applied):
+    sql_logins = [
+        SqlLogin("app", users=[SqlUser("app_user", [SqlDatabase("shop", roles=["db_datareader"]), SqlDatabase("crm", roles=["db_datareader"])])]),
+        SqlLogin("report", users=[SqlUser("report_user", [SqlDatabase("crm", roles=["db_datareader"])])]),
+    ]
+    watcher = DriftWatcher(server, sql_logins, None, sink=ResultSink())
+    watcher.reconcile()
+
+    del applied[:]
+    del server.queries[:]
+
+    return watcher
+
+
+def test_poll_unchanged_reads_only_markers(server, applied, watcher):
+    assert watcher.poll() == {}
+    assert applied == []
+    assert sorted(set(name for name, _ in server.queries)) == ["database_marker", "databases", "server_marker"]
+    assert not watcher.sink.failed
+
+
+def test_poll_changed_login_reconciles_whole_login(server, applied, watcher):
+    server.touch_login("app")
+
+    changes = watcher.poll()
+
+    assert changes == {"app": None}
+    assert [[sql_login.login for sql_login in sql_logins] for sql_logins in applied] == [["app"]]
+    assert applied[0][0] is watcher.sql_logins["app"]
+
+
+def test_poll_dropped_login_is_detected_by_count(server, applied, watcher):
+    server.drop_login("report")
+
+    assert watcher.poll() == {"report": None}
+    assert ("logins_exists", "master") in server.queries
+
+
+def test_poll_changed_user_reconciles_only_its_database(server, applied, watcher):
+    # в каталоге имя записано в другом регистре, база данных сравнивает без учета регистра
+    server.touch_user("crm", "Report_User")
+
+    changes = watcher.poll()
+
+    assert list(changes) == ["report"]
+    assert list(changes["report"]) == ["crm"]
+    assert [user_name for user_name, _ in changes["report"]["crm"]] == ["report_user"]
+
+    sql_login = applied[0][0]
+    assert sql_login.login == "report"
+    assert [(user.name, [database.name for database in user.databases]) for user in sql_login.users] == [("report_user", ["crm"])]
+
+
+def test_poll_changed_membership_reconciles_all_users_of_database(server, applied, watcher):
+    server.add_member("shop", "app_user", "db_owner")
+
+    changes = watcher.poll()
+
+    assert changes == {"app": {"shop": [("app_user", watcher.sql_logins["app"].users[0].databases[0])]}}
+    assert [sql_login.login for sql_login in applied[0]] == ["app"]
+
+
+def test_poll_snapshot_is_refreshed_after_reconcile(server, applied, watcher):
+    server.grant("crm", "report_user", "SELECT")
+
+    assert list(watcher.poll()) == ["app", "report"]
+    assert watcher.poll() == {}
+    assert len(applied) == 1
+
+
+@pytest.mark.parametrize("query", ["server_marker", "database_marker", "databases"])
+def test_poll_marker_failure_reports_error_and_keeps_snapshot(server, applied, watcher, query):
+    server.touch_login("app")
+    server.failing.add(query)
+
+    assert watcher.poll() == {}
+    assert applied == []
+    assert watcher.sink.counts["error"] == 1
+    assert watcher.sink.sample["error"][0]["operation"] == "watch"
+
+    server.failing.clear()
+
+    assert watcher.poll() == {"app": None}
+    assert len(applied) == 1
@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Нагрузочный тест пути mssql_users_source: glob, разбор, проверка дубликатов и сериализация фактов.
+
+Example:
+    python3 tools/generate_sources.py --output /tmp/sources
+    python3 tools/bench_sources.py --sources '/tmp/sources/*.json' --baseline bench_baseline.json
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+
+import ansible.module_utils
+
+ROLE_MODULE_UTILS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "module_utils")
+ansible.module_utils.__path__.append(ROLE_MODULE_UTILS)
+
+import ansible.module_utils.sql_sources as SqlSources  # noqa: E402
+
+
+def get_peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak //= 1024
+    return peak
+
+
+def run(sources):
+    start_time = time.time()
+    sql_logins, files_info = SqlSources.read_sources(sources)
+    parse_time = time.time() - start_time
+
+    start_time = time.time()
+    facts = json.dumps(dict(sql_logins=SqlSources.to_facts(sql_logins), files_info=files_info))
+    serialize_time = time.time() - start_time
+
+    files = sum(len(info['files']) for info in files_info.values())
+    total_time = parse_time + serialize_time
+
+    return dict(files=files,
+                logins=len(sql_logins),
+                parse_time=round(parse_time, 4),
+                serialize_time=round(serialize_time, 4),
+                total_time=round(total_time, 4),
+                logins_per_second=int(len(sql_logins) / total_time) if total_time else 0,
+                facts_size=len(facts),
+                peak_rss_kb=get_peak_rss_kb())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark mssql_users_source parsing path")
+    parser.add_argument("--sources", required=True, action="append", help="glob of source files, can be repeated")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs, the fastest one is reported")
+    parser.add_argument("--output", help="write the result as json to this file")
+    parser.add_argument("--baseline", help="json result of a previous run to compare with")
+    parser.add_argument("--max-regression", dest="max_regression", type=float, default=0.2,
+                        help="allowed relative slowdown/memory growth against the baseline")
+    options = parser.parse_args()
+
+    runs = [run(options.sources) for _ in range(max(options.repeat, 1))]
+    result = min(runs, key=lambda r: r["total_time"])
+
+    print(json.dumps(result, indent=2))
+
+    if options.output:
+        with open(options.output, "w") as write_file:
+            json.dump(result, write_file, indent=2)
+
+    if not options.baseline:
+        return 0
+
+    with open(options.baseline, "r") as read_file:
+        baseline = json.load(read_file)
+
+    failures = []
+    for key in ("total_time", "peak_rss_kb"):
+        if baseline.get(key) and result[key] > baseline[key] * (1 + options.max_regression):
+            failures.append("{0}: {1} > {2} (+{3:.0%})".format(key, result[key], baseline[key], options.max_regression))
+
+    for failure in failures:
+        print("REGRESSION: " + failure, file=sys.stderr)
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
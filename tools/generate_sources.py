@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Генератор синтетических источников логинов для нагрузочного тестирования mssql_users_source.
+
+Example:
+    python3 tools/generate_sources.py --output /tmp/sources --files 2000 --logins 100000
+"""
+
+import argparse
+import json
+import os
+import random
+
+DEFAULT_ROLES = ["db_datareader", "db_datawriter", "db_ddladmin", "db_owner", "db_executor",
+                 "db_backupoperator", "db_securityadmin", "db_accessadmin"]
+
+LANGUAGES = ["English", "Russian", "us_english", "Deutsch"]
+
+
+def generate_login(rnd, index, options):
+    windows = rnd.random() < options.windows_ratio
+    absent = rnd.random() < options.absent_ratio
+
+    if windows:
+        login = "{0}\\user_{1:07d}".format(rnd.choice(options.domains), index)
+    else:
+        login = "sql_user_{0:07d}".format(index)
+
+    value = {"state": "absent" if absent else "present"}
+
+    if not windows:
+        value["password"] = "".join(rnd.choice("abcdefghijkmnpqrstuvwxyzABCDEFGHJKLMNPQRSTUVWXYZ23456789")
+                                    for _ in range(16))
+        if rnd.random() < 0.5:
+            value["sid"] = "0x%032X" % rnd.getrandbits(128)
+
+    if rnd.random() < 0.3:
+        value["default_database"] = rnd.choice(options.database_names)
+
+    if rnd.random() < 0.3:
+        value["default_language"] = rnd.choice(LANGUAGES)
+
+    if rnd.random() < 0.1:
+        value["enabled"] = "false"
+
+    databases = {}
+    for database in rnd.sample(options.database_names, rnd.randint(1, options.max_databases_per_login)):
+        entry = {"roles": rnd.sample(options.role_names, rnd.randint(1, options.max_roles_per_database))}
+        if not absent and rnd.random() < options.absent_ratio:
+            entry["state"] = "absent"
+        databases[database] = entry
+
+    value["users"] = {login: {"databases": databases}}
+
+    return login, value
+
+
+def generate(options):
+    rnd = random.Random(options.seed)
+
+    options.database_names = ["db_{0:04d}".format(i) for i in range(options.databases)]
+    options.role_names = DEFAULT_ROLES + ["app_role_{0:03d}".format(i) for i in range(options.roles)]
+    options.domains = ["domain{0}".format(i) for i in range(options.domains_count)]
+
+    if not os.path.isdir(options.output):
+        os.makedirs(options.output)
+
+    logins_per_file, remainder = divmod(options.logins, options.files)
+    index = 0
+
+    for file_index in range(options.files):
+        count = logins_per_file + (1 if file_index < remainder else 0)
+        data = {}
+
+        for _ in range(count):
+            login, value = generate_login(rnd, index, options)
+            data[login] = value
+            index += 1
+
+        file_path = os.path.join(options.output, "logins_{0:05d}.json".format(file_index))
+        with open(file_path, "w") as write_file:
+            json.dump(data, write_file, indent=2)
+
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="generate synthetic mssql_users_source files")
+    parser.add_argument("--output", required=True, help="directory for generated json files")
+    parser.add_argument("--files", type=int, default=1000)
+    parser.add_argument("--logins", type=int, default=100000)
+    parser.add_argument("--databases", type=int, default=200)
+    parser.add_argument("--roles", type=int, default=50, help="number of custom roles besides the fixed ones")
+    parser.add_argument("--max-databases-per-login", dest="max_databases_per_login", type=int, default=5)
+    parser.add_argument("--max-roles-per-database", dest="max_roles_per_database", type=int, default=3)
+    parser.add_argument("--windows-ratio", dest="windows_ratio", type=float, default=0.4)
+    parser.add_argument("--absent-ratio", dest="absent_ratio", type=float, default=0.05)
+    parser.add_argument("--domains", dest="domains_count", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    options = parser.parse_args()
+
+    if options.files < 1 or options.logins < options.files:
+        parser.error("--logins must be greater than or equal to --files and --files greater than 0")
+
+    count = generate(options)
+    print("generated {0} logins in {1} files: {2}".format(count, options.files, options.output))
+
+
+if __name__ == '__main__':
+    main()
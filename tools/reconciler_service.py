@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Локальный сервис синхронизации логинов, к которому mssql_users подключается через unix сокет (параметр service_socket).
+
+Example:
+    python3 tools/reconciler_service.py --socket ~/.ansible/mssql_users.sock
+"""
+
+import argparse
+import logging
+import os
+import signal
+import sys
+import threading
+
+import ansible.module_utils
+
+ROLE_MODULE_UTILS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "module_utils")
+ansible.module_utils.__path__.append(ROLE_MODULE_UTILS)
+
+from ansible.module_utils.sql_service import ReconcilerService, DEFAULT_SOCKET_PATH  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="persistent local reconciler service for mssql_users")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET_PATH, help="unix socket path")
+    parser.add_argument("--pool-size", dest="pool_size", type=int, default=4, help="idle connections kept per database")
+    parser.add_argument("--capabilities-ttl", dest="capabilities_ttl", type=int, default=3600,
+                        help="seconds to keep a server capability profile")
+    options = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    service = ReconcilerService(options.socket, options.pool_size, options.capabilities_ttl)
+
+    def stop(signum, frame):
+        threading.Thread(target=service.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    logging.info("listening on %s", service.socket_path)
+    service.serve_forever()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
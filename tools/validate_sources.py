@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Проверка файлов источников логинов для CI: все ошибки всех файлов с json путем, код возврата 1 при ошибках.
+
+Example:
+    python3 tools/validate_sources.py --sources 'sources/*.json'
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import ansible.module_utils
+
+ROLE_MODULE_UTILS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "module_utils")
+ansible.module_utils.__path__.append(ROLE_MODULE_UTILS)
+
+import ansible.module_utils.sql_schema as SqlSchema  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="validate mssql_users_source files")
+    parser.add_argument("--sources", required=True, action="append", help="glob of source files, can be repeated")
+    parser.add_argument("--strict", action="store_true", help="treat unknown fields as errors")
+    options = parser.parse_args()
+
+    file_paths = sorted(set(path for source in options.sources for path in glob.glob(source)))
+    errors = []
+    warnings = []
+    logins = {}
+    validation_time = 0
+
+    for file_path in file_paths:
+        try:
+            with open(file_path, "r") as read_file:
+                data = json.load(read_file)
+        except (IOError, ValueError) as e:
+            errors.append("FILE: {0}, PARSE SQL LOGIN EXCEPTION: {1}".format(file_path, str(e)))
+            continue
+
+        start_time = time.time()
+        _, file_errors, file_warnings = SqlSchema.validate(data, file_path, options.strict)
+        validation_time += time.time() - start_time
+        errors.extend(file_errors)
+        warnings.extend(file_warnings)
+
+        if isinstance(data, dict):
+            for login in data:
+                if login.strip() in logins:
+                    errors.append("DUPLICATE LOGIN: [{0}], FILE: [{1}], FIRST DEFINED IN: [{2}]".format(login.strip(), file_path, logins[login.strip()]))
+                else:
+                    logins[login.strip()] = file_path
+
+    for warning in warnings:
+        print("WARNING: " + warning, file=sys.stderr)
+
+    for error in errors:
+        print(error, file=sys.stderr)
+
+    print("files: {0}, logins: {1}, errors: {2}, warnings: {3}, validation time: {4:.3f}s".format(
+        len(file_paths), len(logins), len(errors), len(warnings), validation_time))
+
+    return 1 if errors or not file_paths else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
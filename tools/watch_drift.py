@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Демон, который синхронизирует логины, а затем опрашивает признаки изменений и исправляет только отклонения.
+
+Example:
+    MSSQL_PASSWORD=secret python3 tools/watch_drift.py --host localhost --login sa \\
+        --sources 'tests/users_*.json' --interval 30 --results-file /var/log/mssql_drift.jsonl
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+import ansible.module_utils
+
+ROLE_MODULE_UTILS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "module_utils")
+ansible.module_utils.__path__.append(ROLE_MODULE_UTILS)
+
+import ansible.module_utils.sql_capabilities as SqlCapabilities  # noqa: E402
+import ansible.module_utils.sql_sources as SqlSources  # noqa: E402
+from ansible.module_utils.db_provider import ConnectionPool  # noqa: E402
+from ansible.module_utils.sql_results import ResultSink  # noqa: E402
+from ansible.module_utils.sql_watcher import DriftWatcher  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="watch sql server logins and users for drift and reconcile it")
+    parser.add_argument("--host", required=True, help="sql server host")
+    parser.add_argument("--port", type=int, default=1433)
+    parser.add_argument("--login", required=True, help="sql server login")
+    parser.add_argument("--password-env", dest="password_env", default="MSSQL_PASSWORD",
+                        help="environment variable with the password")
+    parser.add_argument("--sources", required=True, action="append", help="glob of source files, can be repeated")
+    parser.add_argument("--interval", type=float, default=60, help="seconds between polls")
+    parser.add_argument("--iterations", type=int, help="stop after this number of polls")
+    parser.add_argument("--workers", type=int, default=4, help="number of threads for databases")
+    parser.add_argument("--pool-size", dest="pool_size", type=int, default=4, help="idle connections kept per database")
+    parser.add_argument("--results-file", dest="results_file", help="append result records to this jsonl file")
+    parser.add_argument("--check", action="store_true", help="only report drift, do not change anything")
+    options = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    server = options.host if options.port == 1433 else "{0}:{1}".format(options.host, options.port)
+    sql_logins, _ = SqlSources.read_sources(options.sources)
+
+    with ConnectionPool(server, options.login, os.environ.get(options.password_env, ""), options.pool_size) as pool:
+        capabilities = SqlCapabilities.load(pool, server)
+
+        with ResultSink(options.results_file) as sink:
+            watcher = DriftWatcher(pool, list(sql_logins.values()), capabilities, options.check, options.workers, sink)
+
+            def sleep(seconds):
+                logging.info("poll %s: %s, %s", watcher.polls, json.dumps(sink.counts), json.dumps(pool.statistics))
+                time.sleep(seconds)
+
+            try:
+                watcher.run(options.interval, options.iterations, sleep)
+            except KeyboardInterrupt:
+                pass
+
+    return 1 if sink.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())